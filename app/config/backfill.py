@@ -0,0 +1,15 @@
+from app.util import create_config
+
+backfill_download_concurrency = create_config("Backfill:DownloadConcurrency", default=2)
+backfill_transcode_concurrency = create_config(
+    "Backfill:TranscodeConcurrency", default=2
+)
+backfill_podbean_rate_per_minute = create_config(
+    "Backfill:PodBeanRatePerMinute", default=2.0
+)
+backfill_wordpress_rate_per_minute = create_config(
+    "Backfill:WordPressRatePerMinute", default=6.0
+)
+backfill_discord_rate_per_minute = create_config(
+    "Backfill:DiscordRatePerMinute", default=10.0
+)
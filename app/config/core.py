@@ -1,3 +1,18 @@
 from app.util import create_config
 
 message_broker = create_config("MessageBroker", default="mqtt://message_broker/")
+message_broker_max_connect_delay = create_config(
+    "MessageBrokerMaxConnectDelay", default=15.0
+)
+# "exactly_once" publishes and subscribes with QoS 2. "at_least_once" uses QoS 1 and
+# lets the consumers drop redelivered events by their event id.
+message_broker_delivery = create_config("MessageBrokerDelivery", default="exactly_once")
+message_broker_dedupe_window = create_config(
+    "MessageBrokerDedupeWindow", default=60.0 * 60
+)
+message_broker_persistent_sessions = create_config(
+    "MessageBrokerPersistentSessions", default=True
+)
+message_broker_heartbeat_interval = create_config(
+    "MessageBrokerHeartbeatInterval", default=15.0
+)
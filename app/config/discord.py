@@ -4,3 +4,6 @@ webhook_enabled = create_config("WebHook:Enabled", default=True)
 webhook_url_list = create_config("WebHook:UrlList", default=[])
 webhook_text_max_length = create_config("WebHook:TextMaxLength", default=100)
 webhook_max_duration = create_config("WebHook:MaxDuration", default=60 * 30)
+webhook_concurrency = create_config("WebHook:Concurrency", default=8)
+webhook_max_attempts = create_config("WebHook:MaxAttempts", default=5)
+webhook_coalesce_window = create_config("WebHook:CoalesceWindow", default=1.0)
@@ -0,0 +1,10 @@
+from app.util import create_config
+
+download_chunk_size = create_config("Download:ChunkSize", default=4_194_304)
+download_min_connections = create_config("Download:MinConnections", default=2)
+download_max_connections = create_config("Download:MaxConnections", default=8)
+download_max_chunk_attempts = create_config("Download:MaxChunkAttempts", default=5)
+segmented_transcode_threshold = create_config(
+    "Download:SegmentedTranscodeThreshold", default=60 * 60
+)
+transcode_processes = create_config("Download:TranscodeProcesses", default=0)
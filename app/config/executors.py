@@ -0,0 +1,5 @@
+from app.util import create_config
+
+network_threads = create_config("Executors:NetworkThreads", default=16)
+file_threads = create_config("Executors:FileThreads", default=4)
+cpu_processes = create_config("Executors:CpuProcesses", default=2)
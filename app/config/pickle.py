@@ -12,9 +12,19 @@ playlist_history_pickle_path = create_config(
 podbean_posted_pickle_path = create_config(
     "Pickle:PodBeanPosted", default="pickles/podbean_posted.pickle"
 )
+podbean_jobs_pickle_path = create_config(
+    "Pickle:PodBeanJobs", default="pickles/podbean_jobs.pickle"
+)
 webhook_posted_pickle_path = create_config(
     "Pickle:WebHookPosted", default="pickles/webhook_posted.pickle"
 )
 wp_post_history_pickle_path = create_config(
     "Pickle:WordPressPosted", default="pickles/wp_post_history.pickle"
 )
+backfill_pickle_path = create_config(
+    "Pickle:Backfill", default="pickles/backfill.pickle"
+)
+backfill_jobs_pickle_path = create_config(
+    "Pickle:BackfillJobs", default="pickles/backfill_jobs.pickle"
+)
+leases_path = create_config("Pickle:Leases", default="pickles/leases")
@@ -5,3 +5,9 @@ client_id = create_config("PodBean:ClientId")
 client_secret = create_config("PodBean:ClientSecret")
 title_pattern = create_config("PodBean:TitlePattern", default=".+")
 title_negative_pattern = create_config("PodBean:TitleNegativePattern", default="")
+shared_subscription = create_config("PodBean:SharedSubscription", default=False)
+lease_ttl = create_config("PodBean:LeaseTtl", default=60.0)
+download_deadline = create_config("PodBean:DownloadDeadline", default=60.0 * 60 * 2)
+transcode_deadline = create_config("PodBean:TranscodeDeadline", default=60.0 * 60 * 2)
+upload_deadline = create_config("PodBean:UploadDeadline", default=60.0 * 60)
+stall_timeout = create_config("PodBean:StallTimeout", default=60.0 * 5)
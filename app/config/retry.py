@@ -0,0 +1,7 @@
+from app.util import create_config
+
+retry_max_attempts = create_config("Retry:MaxAttempts", default=5)
+retry_base_delay = create_config("Retry:BaseDelay", default=30.0)
+retry_max_delay = create_config("Retry:MaxDelay", default=60.0 * 60)
+retry_rate_per_minute = create_config("Retry:RatePerMinute", default=6.0)
+retry_concurrency = create_config("Retry:Concurrency", default=1)
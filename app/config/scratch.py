@@ -0,0 +1,11 @@
+import tempfile
+
+from app.util import create_config
+
+scratch_directory = create_config(
+    "Scratch:Directory", default=f"{tempfile.gettempdir()}/youtube2podbean"
+)
+scratch_budget = create_config("Scratch:Budget", default=0)
+scratch_min_free_space = create_config("Scratch:MinFreeSpace", default=1_073_741_824)
+scratch_ram_directory = create_config("Scratch:RamDirectory", default="")
+scratch_ram_budget = create_config("Scratch:RamBudget", default=33_554_432)
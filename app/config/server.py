@@ -2,4 +2,5 @@ from app.util import create_config, get_public_ip
 
 host = create_config("Server:Host", default="0.0.0.0")
 port = create_config("Server:Port", default="23808")
+health_port = create_config("Server:HealthPort", default="23809")
 public_host = create_config("Server:PublicHost", default=get_public_ip)
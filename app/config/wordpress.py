@@ -7,3 +7,5 @@ wp_password = create_config("WordPress:Password", default="")
 wp_embed_width = create_config("WordPress:EmbedWidth", default=560)
 wp_embed_height = create_config("WordPress:EmbedHeight", default=315)
 wp_max_duration = create_config("WordPress:MaxDuration", default=60 * 30)
+wp_max_batch_size = create_config("WordPress:MaxBatchSize", default=10)
+wp_concurrency = create_config("WordPress:Concurrency", default=4)
@@ -6,6 +6,7 @@ start_from = create_config("YouTube:StartFrom", default="")
 video_process_delay = create_config("YouTube:VideoProcessDelay", default=10.0)
 channel_id = create_config("YouTube:ChannelId")
 polling_rate = create_config("YouTube:PollingRate", default=60.0)
+consumer_wait_timeout = create_config("YouTube:ConsumerWaitTimeout", default=30.0)
 manual_videos = create_config("YouTube:CustomVideos", default=[])
 youtube_num_iterations_until_refetch = create_config(
     "YouTube:NumIterationsUntilRefetch", default=10
@@ -13,3 +14,6 @@ youtube_num_iterations_until_refetch = create_config(
 youtube_default_avatar = create_config(
     "YouTube:DefaultAvatarUrl", default="https://i.imgur.com/eYw9nVR.jpg"
 )
+max_consumer_lag = create_config("YouTube:MaxConsumerLag", default=60.0 * 10)
+leader_election = create_config("YouTube:LeaderElection", default=False)
+leader_lease_ttl = create_config("YouTube:LeaderLeaseTtl", default=10.0)
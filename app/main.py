@@ -0,0 +1,66 @@
+import asyncio
+from argparse import ArgumentParser
+from typing import List
+
+from app.util import (
+    LocalBroker,
+    entrypoint,
+    setup_logging,
+    use_local_broker,
+    with_health_server,
+)
+
+logging = setup_logging("app.main")
+
+services = ["settings", "youtube", "podbean", "discord", "wordpress"]
+
+
+async def run_all_in_one(selected: List[str], use_mqtt: bool):
+    """Runs the YouTube poller and the destination handlers as tasks of one event loop.
+
+    The services share this process' settings cache, HTTP connection pool and thumbnail
+    cache. Unless `use_mqtt` is set, events are handed over in memory instead of through
+    the MQTT broker.
+    """
+    from app.services import discord, podbean, settings, wordpress, youtube
+
+    if not use_mqtt:
+        use_local_broker(LocalBroker())
+
+    runners = dict(
+        settings=settings.publish_changes,
+        youtube=youtube.poll,
+        podbean=podbean.on_new_video.consume,
+        discord=discord.on_new_video.consume,
+        wordpress=wordpress.on_new_video.consume,
+    )
+    logging.info(f"Running the following services in one process: {selected}")
+    await asyncio.gather(*(runners[service]() for service in selected))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Runs several (by default, all) services in a single process"
+    )
+    parser.add_argument(
+        "--service",
+        dest="services",
+        action="append",
+        choices=services,
+        help="Service to run. Can be repeated (default: all services).",
+    )
+    parser.add_argument(
+        "--mqtt",
+        dest="use_mqtt",
+        action="store_true",
+        help="Exchange events through the MQTT broker instead of in memory",
+    )
+    args = parser.parse_args()
+
+    async def main():
+        await run_all_in_one(args.services or services, args.use_mqtt)
+
+    # imported here, like the services, since it loads hbmqtt
+    from app.util import with_settings_watch
+
+    entrypoint(with_health_server(with_settings_watch(main)), logger=logging)
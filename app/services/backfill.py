@@ -0,0 +1,342 @@
+import asyncio
+import os
+import time
+from argparse import ArgumentParser
+from datetime import timedelta
+from typing import List, Optional
+
+import pafy
+from pafy.backend_youtube_dl import YtdlPafy
+
+from app.util import (
+    TokenBucket,
+    entrypoint,
+    get_playlist_id_for_channel_id,
+    is_already_posted,
+    load_pickle,
+    mark_as_posted,
+    run_sync,
+    save_pickle,
+    setup_logging,
+)
+
+logging = setup_logging("app.services.backfill")
+
+destinations = ["podbean", "wordpress", "discord"]
+
+
+async def plan_backfill(from_id: Optional[str], to_id: Optional[str]) -> List[YtdlPafy]:
+    """Lists the videos to backfill, oldest first.
+
+    The range ends right before `YouTube:StartFrom` by default, because everything from
+    there on is already handled by the YouTube service.
+    """
+    from app.config.youtube import channel_id, start_from, youtube_api_key
+
+    [channel_id, start_from, api_key] = await asyncio.gather(
+        channel_id(), start_from(), youtube_api_key()
+    )
+    if api_key:
+        pafy.set_api_key(api_key)
+
+    playlist_id = get_playlist_id_for_channel_id(channel_id)
+    logging.info(f"Fetching the entire playlist '{playlist_id}' to plan the backfill.")
+    videos = list(
+        reversed(
+            await run_sync(
+                lambda: list(pafy.get_playlist2(playlist_id)), executor="network"
+            )
+        )
+    )
+    ids = [video.videoid for video in videos]
+
+    def index_of(id: str) -> int:
+        if id not in ids:
+            raise Exception(f"Backfill video '{id}' was not found!")
+        return ids.index(id)
+
+    start = index_of(from_id) if from_id else 0
+    if to_id:
+        end = index_of(to_id) + 1
+    elif start_from:
+        end = index_of(start_from)
+    else:
+        end = len(ids)
+
+    return videos[start:end]
+
+
+class BackfillProgress:
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.completed = 0
+        self.started = time.monotonic()
+
+    def record(self, destination: str, video: YtdlPafy):
+        self.completed += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.completed / elapsed
+        remaining = self.total - self.done - self.completed
+        logging.info(
+            f"Backfilled '{video.title}' to {destination}. {self.done + self.completed}/{self.total} done at {rate * 3600:.1f} per hour. ETA: {timedelta(seconds=int(remaining / rate))}."
+        )
+
+
+async def make_podbean_handler(limits: dict):
+    from app.config.pickle import backfill_jobs_pickle_path, podbean_posted_pickle_path
+    from app.config.podbean import podbean_enabled
+    from app.services.podbean import (
+        create_oauth_session,
+        is_valid_title,
+        process_podbean_exclusively,
+        resume_unfinished_jobs,
+        sweep_orphaned_files,
+    )
+
+    oauth = await create_oauth_session()
+    await sweep_orphaned_files()
+    await resume_unfinished_jobs(oauth, backfill_jobs_pickle_path)
+
+    async def handle(video: YtdlPafy):
+        [enabled, already_posted, valid_title] = await asyncio.gather(
+            podbean_enabled(),
+            is_already_posted(video.videoid, podbean_posted_pickle_path),
+            is_valid_title(video.title),
+        )
+        if not enabled or already_posted or not valid_title:
+            logging.debug(
+                f"Skipping '{video.title}' for PodBean (enabled = {enabled}; already posted = {already_posted}; valid title = {valid_title})."
+            )
+            return
+
+        await process_podbean_exclusively(
+            oauth, video, get_jobs_pickle_path=backfill_jobs_pickle_path, limits=limits
+        )
+
+    return handle
+
+
+async def make_wordpress_handler(bucket: TokenBucket):
+    from app.config.pickle import wp_post_history_pickle_path
+    from app.config.wordpress import wp_enabled
+    from app.services.wordpress import post_video
+
+    async def handle(video: YtdlPafy):
+        # the maximum age is meant for live notifications and does not apply to backfills
+        [enabled, already_posted] = await asyncio.gather(
+            wp_enabled(), is_already_posted(video.videoid, wp_post_history_pickle_path)
+        )
+        if not enabled or already_posted:
+            return
+
+        async with bucket:
+            await post_video(video)
+        await mark_as_posted(video.videoid, wp_post_history_pickle_path)
+
+    return handle
+
+
+async def make_discord_handler(bucket: TokenBucket):
+    from app.config.discord import webhook_enabled
+    from app.config.pickle import webhook_posted_pickle_path
+    from app.services.discord import process_discord
+
+    async def handle(video: YtdlPafy):
+        [enabled, already_posted] = await asyncio.gather(
+            webhook_enabled(),
+            is_already_posted(video.videoid, webhook_posted_pickle_path),
+        )
+        if not enabled or already_posted:
+            return
+
+        async with bucket:
+            await process_discord(video)
+        await mark_as_posted(video.videoid, webhook_posted_pickle_path)
+
+    return handle
+
+
+async def run_backfill(
+    from_id: Optional[str], to_id: Optional[str], selected: List[str], replan: bool
+):
+    from app.config.backfill import (
+        backfill_discord_rate_per_minute,
+        backfill_download_concurrency,
+        backfill_podbean_rate_per_minute,
+        backfill_transcode_concurrency,
+        backfill_wordpress_rate_per_minute,
+    )
+    from app.config.pickle import backfill_pickle_path
+
+    pickle_path = await backfill_pickle_path()
+
+    async def make_checkpoint():
+        videos = await plan_backfill(from_id, to_id)
+        return dict(
+            range=(from_id, to_id),
+            videos=videos,
+            done={destination: set() for destination in destinations},
+        )
+
+    if replan and os.path.exists(pickle_path):
+        os.remove(pickle_path)
+    checkpoint = await load_pickle(pickle_path, get_default=make_checkpoint)
+    if checkpoint["range"] != (from_id, to_id):
+        logging.info(
+            f"The saved backfill checkpoint is for a different range. Planning a new backfill for the range {(from_id, to_id)}."
+        )
+        checkpoint = await save_pickle(pickle_path, await make_checkpoint())
+    videos: List[YtdlPafy] = checkpoint["videos"]
+    logging.info(
+        f"Backfilling {len(videos)} videos to {', '.join(selected)}"
+        + (f" (from '{videos[0].title}' to '{videos[-1].title}')." if videos else ".")
+    )
+
+    [
+        download_concurrency,
+        transcode_concurrency,
+        podbean_rate,
+        wordpress_rate,
+        discord_rate,
+    ] = await asyncio.gather(
+        backfill_download_concurrency(),
+        backfill_transcode_concurrency(),
+        backfill_podbean_rate_per_minute(),
+        backfill_wordpress_rate_per_minute(),
+        backfill_discord_rate_per_minute(),
+    )
+
+    # (handler, number of workers) for every destination
+    handlers = {}
+    if "podbean" in selected:
+        limits = dict(
+            download=asyncio.Semaphore(download_concurrency),
+            transcode=asyncio.Semaphore(transcode_concurrency),
+            publish=TokenBucket(podbean_rate / 60.0),
+        )
+        handlers["podbean"] = (
+            await make_podbean_handler(limits),
+            download_concurrency + transcode_concurrency,
+        )
+    if "wordpress" in selected:
+        from app.config.wordpress import wp_max_batch_size
+
+        # posts that are ready together go out in one multicall request, so the bucket
+        # may release a whole batch at once. the average rate stays the same.
+        max_batch_size = max(1, await wp_max_batch_size())
+        handlers["wordpress"] = (
+            await make_wordpress_handler(
+                TokenBucket(wordpress_rate / 60.0, burst=max_batch_size)
+            ),
+            max_batch_size,
+        )
+    if "discord" in selected:
+        handlers["discord"] = (
+            await make_discord_handler(TokenBucket(discord_rate / 60.0)),
+            1,
+        )
+
+    done = checkpoint["done"]
+    progress = BackfillProgress(
+        total=len(videos) * len(handlers),
+        done=sum(
+            1
+            for destination in handlers
+            for video in videos
+            if video.videoid in done[destination]
+        ),
+    )
+
+    async def worker(destination: str, queue: asyncio.Queue, handle):
+        while True:
+            video: YtdlPafy = await queue.get()
+            try:
+                await handle(video)
+            except asyncio.CancelledError:
+                # the backfill is stopping, the video is retried by the next run
+                raise
+            except Exception as e:
+                # left out of the checkpoint, so the next run retries it
+                logging.exception(
+                    f"Got an exception of type '{type(e)}' while backfilling video '{video.title}' to {destination}",
+                    exc_info=e,
+                )
+            else:
+                done[destination].add(video.videoid)
+                await save_pickle(pickle_path, checkpoint)
+                progress.record(destination, video)
+            finally:
+                queue.task_done()
+
+    queues = []
+    workers = []
+    for destination, (handle, num_workers) in handlers.items():
+        queue: asyncio.Queue = asyncio.Queue()
+        for video in videos:
+            if video.videoid not in done[destination]:
+                queue.put_nowait(video)
+        queues.append(queue)
+        workers.extend(
+            asyncio.ensure_future(worker(destination, queue, handle))
+            for _ in range(num_workers)
+        )
+
+    try:
+        await asyncio.gather(*(queue.join() for queue in queues))
+    finally:
+        for task in workers:
+            task.cancel()
+
+    logging.info(
+        f"Backfill finished. {progress.completed} items were processed in {timedelta(seconds=int(time.monotonic() - progress.started))}."
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Publishes a range of a channel's existing videos. Progress is checkpointed, so an interrupted backfill continues where it stopped."
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_id",
+        default=None,
+        help="Id of the oldest video to backfill (default: the first video of the channel)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_id",
+        default=None,
+        help="Id of the newest video to backfill (default: the video before YouTube:StartFrom)",
+    )
+    parser.add_argument(
+        "--destination",
+        dest="destinations",
+        action="append",
+        choices=destinations,
+        help="Destination to backfill. Can be repeated (default: all destinations).",
+    )
+    parser.add_argument(
+        "--replan",
+        dest="replan",
+        action="store_true",
+        help="Discard the saved checkpoint and plan the range again",
+    )
+    parser.add_argument(
+        "--nice",
+        dest="nice",
+        type=int,
+        default=10,
+        help="Niceness increment so the backfill never competes with newly detected uploads for CPU",
+    )
+    args = parser.parse_args()
+
+    if args.nice:
+        os.nice(args.nice)
+
+    async def main():
+        await run_backfill(
+            args.from_id, args.to_id, args.destinations or destinations, args.replan
+        )
+
+    entrypoint(main, logger=logging)
@@ -1,90 +1,227 @@
+from __future__ import annotations
+
 import asyncio
-from datetime import datetime
+from functools import partial
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
 
-import dateutil.parser
 from colorthief import ColorThief
-from discord_webhook import DiscordEmbed, DiscordWebhook
-from pafy.backend_youtube_dl import YtdlPafy
 
+from app.config.discord import webhook_enabled
 from app.util import (
-    clip_text,
     color_tuple_to_int,
-    download_thumbnail,
+    execute_webhooks,
+    fetch_thumbnail,
     get_avatar,
     is_already_posted,
+    is_too_old,
     load_pickle,
     mark_as_posted,
     new_video_event_handler,
+    parse_published,
+    render_description,
+    run_event_handler,
     run_sync,
     save_pickle,
     setup_logging,
-    temporary_files,
 )
 
+if TYPE_CHECKING:
+    from pafy.backend_youtube_dl import YtdlPafy
+
 logging = setup_logging("app.services.discord")
 
 
-async def send_webhook(video: YtdlPafy, color: int, avatar_url: str, webhook_url: str):
-    from app.config.discord import webhook_text_max_length
+def get_primary_color(thumbnail: bytes) -> Tuple[int, int, int]:
+    return ColorThief(BytesIO(thumbnail)).get_color(quality=1)
 
-    webhook_text_max_length = await webhook_text_max_length()
 
-    def sync():
-        logging.debug(
-            f"Sending Discord WebHook for '{video.title}' to the following Discord WebHook url: {webhook_url}"
-        )
+async def get_thumbnail_primary_color(video: YtdlPafy):
+    logging.debug(f"Downloading thumbnail for video '{video.title}'...")
+    thumbnail = await fetch_thumbnail(video)
+    logging.debug(f"Downloaded thumbnail for video '{video.title}'")
+    return color_tuple_to_int(
+        await run_sync(partial(get_primary_color, thumbnail), executor="cpu")
+    )
 
-        webhook = DiscordWebhook(url=webhook_url)
 
-        embed = DiscordEmbed()
-        embed.set_url(video.watchv_url)
-        embed.set_color(color)
-        embed.set_title(video.title)
-        embed.set_description(clip_text(video.description, webhook_text_max_length))
-        embed.set_author(
+async def make_webhook_embed(video: YtdlPafy) -> dict:
+    from app.config.discord import webhook_text_max_length
+
+    [thumbnail_color, avatar_url, webhook_text_max_length] = await asyncio.gather(
+        get_thumbnail_primary_color(video),
+        get_avatar(video.username),
+        webhook_text_max_length(),
+    )
+    logging.debug(
+        f"Processing Discord WebHook message for '{video.title}'. Video thumbnail color is '{thumbnail_color:02x}'. Avatar url is '{avatar_url}'."
+    )
+
+    return dict(
+        type="rich",
+        url=video.watchv_url,
+        color=thumbnail_color,
+        title=video.title,
+        description=render_description(
+            video, "discord", max_length=webhook_text_max_length
+        ),
+        author=dict(
             name=video.author,
             url=f"https://www.youtube.com/user/{video.username}",
             icon_url=avatar_url,
-        )
-        embed.set_timestamp(dateutil.parser.parse(video.published).isoformat())
-        embed.set_thumbnail(
-            url=video.bigthumbhd, width=480, height=360
-        )  # clicking "thumbnail" links to the video whereas set_image links to the image file
-        # embed.set_image(url=video.bigthumbhd, width=480, height=360)
-        embed.set_footer(text=f"Duration: {video.duration}")
+        ),
+        timestamp=parse_published(video.published).isoformat(),
+        # clicking "thumbnail" links to the video whereas "image" links to the image file
+        thumbnail=dict(url=video.bigthumbhd, width=480, height=360),
+        footer=dict(text=f"Duration: {video.duration}"),
+    )
 
-        webhook.add_embed(embed)
-        webhook.execute()
 
-    return await run_sync(sync)
+# Discord's limits for a single webhook message
+DISCORD_MAX_EMBEDS = 10
+DISCORD_MAX_EMBED_LENGTH = 6000
 
 
-async def get_thumbnail_primary_color(video: YtdlPafy):
-    logging.debug(f"Downloading thumbnail for video '{video.title}'...")
-    thumbnail_path = await download_thumbnail(video)
-    logging.debug(
-        f"Downloaded thumbnail for video '{video.title}' into '{thumbnail_path}'"
+def embed_length(embed: dict) -> int:
+    return (
+        len(embed["title"])
+        + len(embed["description"])
+        + len(embed["author"]["name"])
+        + len(embed["footer"]["text"])
     )
-    with temporary_files(thumbnail_path):
-        return color_tuple_to_int(ColorThief(thumbnail_path).get_color(quality=1))
 
 
-async def process_discord(video: YtdlPafy):
-    from app.config.discord import webhook_url_list
+def group_embeds(
+    videos: List[Tuple[YtdlPafy, dict]],
+) -> List[List[Tuple[YtdlPafy, dict]]]:
+    """Splits `videos` into as few messages as Discord's limits allow, keeping the order."""
+    messages: List[List[Tuple[YtdlPafy, dict]]] = []
+    length = 0
+    for video, embed in videos:
+        if (
+            not messages
+            or len(messages[-1]) >= DISCORD_MAX_EMBEDS
+            or length + embed_length(embed) > DISCORD_MAX_EMBED_LENGTH
+        ):
+            messages.append([])
+            length = 0
+        messages[-1].append((video, embed))
+        length += embed_length(embed)
+    return messages
 
-    thumbnail_color = await get_thumbnail_primary_color(video)
 
-    avatar_url = await get_avatar(video.username)
-    logging.debug(
-        f"Processing Discord WebHook message for '{video.title}'. Video thumbnail color is '{thumbnail_color:02x}'. Avatar url is '{avatar_url}'."
+pending_videos: List[Tuple[YtdlPafy, asyncio.Future, asyncio.Future]] = []
+flushing = False
+# the urls each pending video has already been sent to, so a retry only sends it to the others
+delivered_urls: Dict[str, Set[str]] = {}
+
+
+async def send_videos(batch: List[Tuple[YtdlPafy, asyncio.Future, asyncio.Future]]):
+    from app.config.discord import (
+        webhook_concurrency,
+        webhook_max_attempts,
+        webhook_url_list,
     )
 
-    await asyncio.gather(
-        *(
-            send_webhook(video, thumbnail_color, avatar_url, webhook_url)
-            for webhook_url in await webhook_url_list()
-        )
+    embeds = await asyncio.gather(
+        *(embed for _, embed, _ in batch), return_exceptions=True
     )
+    ready: List[Tuple[YtdlPafy, dict, asyncio.Future]] = []
+    for (video, _, done), embed in zip(batch, embeds):
+        if isinstance(embed, BaseException):
+            if not done.done():
+                done.set_exception(embed)
+        else:
+            ready.append((video, embed, done))
+
+    [webhook_urls, concurrency, max_attempts] = await asyncio.gather(
+        webhook_url_list(), webhook_concurrency(), webhook_max_attempts()
+    )
+    messages: List[Tuple[str, dict]] = []
+    recipients: List[List[YtdlPafy]] = []
+    for url in webhook_urls:
+        for group in group_embeds(
+            [
+                (video, embed)
+                for video, embed, _ in ready
+                if url not in delivered_urls.get(video.videoid, ())
+            ]
+        ):
+            messages.append((url, dict(embeds=[embed for _, embed in group])))
+            recipients.append([video for video, _ in group])
+    logging.debug(
+        f"Sending {len(ready)} video(s) in {len(messages)} Discord WebHook message(s) to the following Discord WebHook urls: {webhook_urls}"
+    )
+
+    results = await execute_webhooks(messages, concurrency, max_attempts)
+    for (url, _), videos, error in zip(messages, recipients, results):
+        if error is not None:
+            logging.error(
+                f"Could not send Discord WebHook for {len(videos)} video(s) to '{url}'.",
+                exc_info=error,
+            )
+            continue
+        for video in videos:
+            delivered_urls.setdefault(video.videoid, set()).add(url)
+
+    for video, _, done in ready:
+        missing = [
+            url
+            for url in webhook_urls
+            if url not in delivered_urls.get(video.videoid, ())
+        ]
+        if done.done():
+            continue
+        if missing:
+            done.set_exception(
+                Exception(
+                    f"Could not send Discord WebHook for '{video.title}' to {len(missing)} of {len(webhook_urls)} urls."
+                )
+            )
+        else:
+            done.set_result(None)
+
+
+async def flush_videos():
+    from app.config.discord import webhook_coalesce_window
+
+    global flushing
+
+    try:
+        while pending_videos:
+            # lets the rest of a burst arrive, so it shares the webhook messages
+            await asyncio.sleep(max(0.0, await webhook_coalesce_window()))
+            batch = pending_videos[:]
+            del pending_videos[:]
+
+            try:
+                await send_videos(batch)
+            except Exception as e:
+                for _, _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+    finally:
+        flushing = False
+
+
+async def process_discord(video: YtdlPafy):
+    """Sends `video` to every webhook url. Videos that arrive within
+    `WebHook:CoalesceWindow` of each other are sent together, up to
+    `DISCORD_MAX_EMBEDS` embeds per message and in the order they arrived."""
+    global flushing
+
+    for pending, _, done in pending_videos:
+        if pending.videoid == video.videoid:
+            return await asyncio.shield(done)
+
+    # the embed is made while waiting, but the video keeps its place in the queue
+    embed = asyncio.ensure_future(make_webhook_embed(video))
+    done = asyncio.get_event_loop().create_future()
+    pending_videos.append((video, embed, done))
+    if not flushing:
+        flushing = True
+        asyncio.ensure_future(flush_videos())
+    await asyncio.shield(done)
 
     logging.info(f"Successfully sent Discord WebHook for '{video.title}'")
 
@@ -93,42 +230,46 @@ async def is_video_too_old(video: YtdlPafy):
     from app.config.discord import webhook_max_duration
 
     max_duration = await webhook_max_duration()
-    return max_duration != 0 and (
-        (datetime.now() - dateutil.parser.parse(video.published)).total_seconds()
-        > max_duration
-    )
+    return is_too_old(video, max_duration)
 
 
-if __name__ == "__main__":
+# several videos have to be in flight at once to share webhook messages
+@new_video_event_handler(
+    "new_video/discord",
+    logger=logging,
+    enabled=webhook_enabled,
+    concurrency=DISCORD_MAX_EMBEDS,
+)
+async def on_new_video(video: YtdlPafy):
+    from app.config.discord import webhook_enabled
+    from app.config.pickle import webhook_posted_pickle_path
 
-    @new_video_event_handler("new_video/discord", logger=logging)
-    async def on_new_video(video: YtdlPafy):
-        from app.config.discord import webhook_enabled
-        from app.config.pickle import webhook_posted_pickle_path
+    [enabled, too_old, already_posted] = await asyncio.gather(
+        webhook_enabled(),
+        is_video_too_old(video),
+        is_already_posted(video.videoid, webhook_posted_pickle_path),
+    )
 
-        [enabled, too_old, already_posted] = await asyncio.gather(
-            webhook_enabled(),
-            is_video_too_old(video),
-            is_already_posted(video.videoid, webhook_posted_pickle_path),
+    if not enabled:
+        logging.info(
+            f'Discord WebHook posting not enabled. Skipping sending "{video.title}" to Discord.'
         )
+        return
+    if too_old:
+        logging.info(
+            f"Video '{video.title}' is too old to upload to Discord. Skipping."
+        )
+        return
+    if already_posted:
+        logging.info(f"'{video.title}' has already been posted to Discord. Ignoring.")
+        return
 
-        if not enabled:
-            logging.info(
-                f'Discord WebHook posting not enabled. Skipping sending "{video.title}" to Discord.'
-            )
-            return
-        if too_old:
-            logging.info(
-                f"Video '{video.title}' is too old to upload to Discord. Skipping."
-            )
-            return
-        if already_posted:
-            logging.info(
-                f"'{video.title}' has already been posted to Discord. Ignoring."
-            )
-            return
+    logging.info(f"'{video.title}' has not been posted to Discord. Posting.")
+
+    await process_discord(video)
+    await mark_as_posted(video.videoid, webhook_posted_pickle_path)
+    delivered_urls.pop(video.videoid, None)
 
-        logging.info(f"'{video.title}' has not been posted to Discord. Posting.")
 
-        await process_discord(video)
-        await mark_as_posted(video.videoid, webhook_posted_pickle_path)
+if __name__ == "__main__":
+    run_event_handler(on_new_video)
@@ -1,30 +1,50 @@
+from __future__ import annotations
+
 import asyncio
 import mimetypes
-import multiprocessing as mp
 import os
-import re
-import time
-from ctypes import c_char_p
 from datetime import datetime
+from functools import partial
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional
 
 import aiohttp
 import aiohttp.web
-from pafy.backend_youtube_dl import YtdlPafy
 from requests_oauthlib import OAuth2Session
 
+from app.config.podbean import podbean_enabled, shared_subscription
 from app.util import (
-    download_audio_as_mp3,
+    clear_job_state,
+    compile_title_rule,
+    convert_video,
+    download_audio,
     download_thumbnail,
+    get_session,
     is_already_posted,
+    limited,
+    load_all_job_states,
+    load_job_state,
     load_pickle,
+    make_temp_file,
     mark_as_posted,
     new_video_event_handler,
+    open_with_progress,
+    remove_files,
+    render_description,
+    run_event_handler,
+    run_stage,
     run_sync,
+    run_with_lease,
+    sanitize_title,
+    save_job_state,
     save_pickle,
+    serve_callback,
     setup_logging,
-    temporary_files,
+    sweep_scratch,
 )
 
+if TYPE_CHECKING:
+    from pafy.backend_youtube_dl import YtdlPafy
+
 logging = setup_logging("app.services.podbean")
 
 
@@ -43,37 +63,20 @@ token_url = "https://api.podbean.com/v1/oauth/token"
 authorize_upload_url = "https://api.podbean.com/v1/files/uploadAuthorize"
 publish_episode_url = "https://api.podbean.com/v1/episodes"
 
-mp.set_start_method("spawn", True)
 
+async def get_oauth_code(host: str, port: str) -> str:
+    code: asyncio.Future = asyncio.get_event_loop().create_future()
 
-def start_oauth_code_server(code, host: str, port: str):
     async def oauth_callback(request: aiohttp.web.Request):
-        request_code = request.rel_url.query["code"]
+        request_code = request.rel_url.query.get("code")
         if not request_code:
             return aiohttp.web.Response(text="Failed to authorize!")
-        else:
-            code.value = request_code
-            return aiohttp.web.Response(text="Successfully authorized!")
-
-    app = aiohttp.web.Application()
-    app.router.add_get("/", oauth_callback)
-    logging.info(f"Starting OAuth callback server at {host}:{port}")
-    aiohttp.web.run_app(app, host=host, port=port)
-
-
-def get_oauth_code(host: str, port: str):
-    manager = mp.Manager()
-    code = manager.Value(c_char_p, "")
-    server = mp.Process(target=start_oauth_code_server, args=(code, host, port))
-    server.start()
-
-    while not code.value:
-        time.sleep(0.5)
-
-    server.terminate()
-    server.join()
+        if not code.done():
+            code.set_result(request_code)
+        return aiohttp.web.Response(text="Successfully authorized!")
 
-    return code.value
+    async with serve_callback("/", oauth_callback, host, port):
+        return await code
 
 
 async def is_valid_title(title):
@@ -82,30 +85,26 @@ async def is_valid_title(title):
     [title_pattern, title_negative_pattern] = await asyncio.gather(
         title_pattern(), title_negative_pattern()
     )
-    return re.search(title_pattern, title, re.IGNORECASE) is not None and (
-        not title_negative_pattern
-        or re.search(title_negative_pattern, title, re.IGNORECASE) is None
-    )
+    return compile_title_rule(title_pattern, title_negative_pattern).matches(title)
 
 
 async def authorize_upload(access_token: str, file_path: str):
     logging.debug(f"Attemping to upload file '{file_path}' to PodBean.")
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            url=authorize_upload_url,
-            params=dict(
-                access_token=access_token,
-                filename=os.path.basename(file_path),
-                filesize=str(os.path.getsize(file_path)),
-                content_type=mimetypes.guess_type(file_path)[0] or "audio/mpeg",
-            ),
-        ) as response:
-            if response.status != 200:
-                raise Exception(
-                    f"Failed to authorize upload. Access token = '{access_token}'; file path = '{file_path}'; Response text = '{response.text}'"
-                )
-            result = await response.json()
+    async with get_session().get(
+        url=authorize_upload_url,
+        params=dict(
+            access_token=access_token,
+            filename=os.path.basename(file_path),
+            filesize=str(os.path.getsize(file_path)),
+            content_type=mimetypes.guess_type(file_path)[0] or "audio/mpeg",
+        ),
+    ) as response:
+        if response.status != 200:
+            raise Exception(
+                f"Failed to authorize upload. Access token = '{access_token}'; file path = '{file_path}'; Response text = '{response.text}'"
+            )
+        result = await response.json()
 
     try:
         return result["presigned_url"], result["file_key"]
@@ -117,23 +116,22 @@ async def authorize_upload(access_token: str, file_path: str):
 
 
 async def upload_file(file_path: str, presigned_url: str):
-    with open(file_path, mode="rb") as f:
-        async with aiohttp.ClientSession() as session:
-            async with session.put(
-                url=presigned_url,
-                data=f,
-                headers={
-                    "Content-Type": mimetypes.guess_type(file_path)[0] or "audio/mpeg"
-                },
-            ) as response:
-                if response.status != 200:
-                    raise Exception(
-                        f"Failed to upload file located at '{file_path}'. Presigned url = '{presigned_url}'. Response text = '{response.text}'"
-                    )
-                else:
-                    logging.debug(
-                        f"Successfully uploaded file '{file_path}' to presigned url '{presigned_url}'."
-                    )
+    with open_with_progress(file_path) as f:
+        async with get_session().put(
+            url=presigned_url,
+            data=f,
+            headers={
+                "Content-Type": mimetypes.guess_type(file_path)[0] or "audio/mpeg"
+            },
+        ) as response:
+            if response.status != 200:
+                raise Exception(
+                    f"Failed to upload file located at '{file_path}'. Presigned url = '{presigned_url}'. Response text = '{response.text}'"
+                )
+            else:
+                logging.debug(
+                    f"Successfully uploaded file '{file_path}' to presigned url '{presigned_url}'."
+                )
 
 
 async def publish_episode(
@@ -149,71 +147,48 @@ async def publish_episode(
         f"Attempting to publish episode '{title}' with audio_file_key='{audio_file_key}' and thumbnail_file_key='{thumbnail_file_key}'."
     )
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url=publish_episode_url,
-            data=dict(
-                access_token=access_token,
-                title=title,
-                content=description[0:500],  # first 500 chars
-                status=status,
-                type=type,
-                media_key=audio_file_key,
-                logo_key=thumbnail_file_key,
-            ),
-        ) as response:
-            if response.status != 200:
-                logging.error(
-                    f"Got an invalid status code from PodBean API servers while trying to publish episdoe '{title}'. status='{response.status}'. text='{response.text}'."
-                )
-                return
-
-            result = await response.json()
-
-            try:
-                episode = result["episode"]
-            except BaseException as e:
-                logging.error(
-                    f"Failed to publish episode '{title}' with audio_file_key='{audio_file_key}' and thumbnail_file_key='{thumbnail_file_key}'. Response text = '{result}'."
-                )
-                raise e
-            else:
-                logging.debug(
-                    f"Successfully published '{title}' with audio_file_key='{audio_file_key}' and thumbnail_file_key='{thumbnail_file_key}'."
-                )
-                return episode
+    async with get_session().post(
+        url=publish_episode_url,
+        data=dict(
+            access_token=access_token,
+            title=title,
+            content=description,
+            status=status,
+            type=type,
+            media_key=audio_file_key,
+            logo_key=thumbnail_file_key,
+        ),
+    ) as response:
+        if response.status != 200:
+            logging.error(
+                f"Got an invalid status code from PodBean API servers while trying to publish episdoe '{title}'. status='{response.status}'. text='{response.text}'."
+            )
+            return
 
+        result = await response.json()
 
-async def upload_episode_files(
-    access_token: str, audio_path: str, thumbnail_path: str, title: str
-):
-    logging.debug(f"Attempting to upload episode '{title}'.")
-
-    async def upload_audio():
-        logging.debug(f"Uploading audio for '{title}' located at '{audio_path}'.")
-        presigned_url, audio_file_key = await authorize_upload(access_token, audio_path)
-        await upload_file(audio_path, presigned_url)
-        logging.debug(f"Uploaded audio for '{title}' located at '{audio_path}'.")
-        return audio_file_key
-
-    async def upload_thumbnail():
-        logging.debug(
-            f"Uploading thumbnail for '{title}' located at '{thumbnail_path}'."
-        )
-        presigned_url, thumbnail_file_key = await authorize_upload(
-            access_token, thumbnail_path
-        )
-        await upload_file(thumbnail_path, presigned_url)
-        logging.debug(
-            f"Uploaded thumbnail for '{title}' located at '{thumbnail_path}'."
-        )
-        return thumbnail_file_key
+        try:
+            episode = result["episode"]
+        except BaseException as e:
+            logging.error(
+                f"Failed to publish episode '{title}' with audio_file_key='{audio_file_key}' and thumbnail_file_key='{thumbnail_file_key}'. Response text = '{result}'."
+            )
+            raise e
+        else:
+            logging.debug(
+                f"Successfully published '{title}' with audio_file_key='{audio_file_key}' and thumbnail_file_key='{thumbnail_file_key}'."
+            )
+            return episode
 
-    # run the two operations concurrently
-    audio_file_key = await upload_audio()
-    thumbnail_file_key = await upload_thumbnail()
 
-    return audio_file_key, thumbnail_file_key
+async def upload_episode_file(access_token: str, file_path: str, title: str) -> str:
+    logging.debug(f"Uploading file for '{title}' located at '{file_path}'.")
+    presigned_url, file_key = await authorize_upload(access_token, file_path)
+    await upload_file(file_path, presigned_url)
+    logging.debug(
+        f"Uploaded file for '{title}' located at '{file_path}'. File key is '{file_key}'."
+    )
+    return file_key
 
 
 async def get_access_token(oauth: OAuth2Session):
@@ -270,92 +245,380 @@ async def ensure_has_oauth_token(oauth: OAuth2Session):
             client_id(), client_secret(), host(), port()
         )
 
-        def sync():
-            authorization_url, _ = oauth.authorization_url(oauth_url)
-
-            logging.critical(f"Please visit the link below:\n{authorization_url}")
-            code = get_oauth_code(host, port)
-            return oauth.fetch_token(
-                token_url=token_url,
-                code=code,
-                auth=(client_id, client_secret),
-                client_id=client_id,
-                client_secret=client_secret,
-            )
-
-        return await run_sync(sync)
+        authorization_url, _ = oauth.authorization_url(oauth_url)
+        logging.critical(f"Please visit the link below:\n{authorization_url}")
+        # waits for the OAuth callback, which can take a while
+        code = await get_oauth_code(host, port)
+        fetch_token = partial(
+            oauth.fetch_token,
+            token_url=token_url,
+            code=code,
+            auth=(client_id, client_secret),
+            client_id=client_id,
+            client_secret=client_secret,
+        )
+        return await run_sync(fetch_token, executor="network")
 
     from app.config.pickle import access_code_pickle_path
 
     await load_pickle(await access_code_pickle_path(), get_default=first_time_auth)
 
 
+# stages of a PodBean job in the order they complete
+job_stages = [
+    "downloaded",
+    "transcoded",
+    "audio_uploaded",
+    "logo_uploaded",
+    "published",
+]
+
+
+async def run_job_stage(stage: str, video: YtdlPafy, func: Callable[[], Awaitable]):
+    """Runs the "download", "transcode" or "upload" stage of a job within its deadline.
+    A stage that runs out of time or stalls raises `StageTimeout`, so the video is
+    retried later and the job resumes from its last checkpoint."""
+    from app.config.podbean import (
+        download_deadline,
+        stall_timeout,
+        transcode_deadline,
+        upload_deadline,
+    )
+
+    deadlines = dict(
+        download=download_deadline,
+        transcode=transcode_deadline,
+        upload=upload_deadline,
+    )
+    [deadline, stall_timeout] = await asyncio.gather(
+        deadlines[stage](), stall_timeout()
+    )
+    return await run_stage(
+        stage, video.title, func, deadline=deadline, stall_timeout=stall_timeout
+    )
+
+
+def has_reached_stage(job: dict, stage: str) -> bool:
+    return job.get("stage") in job_stages and job_stages.index(
+        job["stage"]
+    ) >= job_stages.index(stage)
+
+
+def rewind_job(job: dict) -> dict:
+    """Moves a job back to the last stage whose artifacts still exist on disk.
+
+    File keys live on PodBean's side, so only the local files (which may have been
+    removed with the temporary directory) can invalidate a completed stage.
+    """
+
+    def missing(key: str) -> bool:
+        return not job.get(key) or not os.path.isfile(job[key])
+
+    stage = job.get("stage")
+    if stage is None or has_reached_stage(job, "logo_uploaded"):
+        return job
+
+    rewound = dict(job)
+    if missing("thumbnail_path"):
+        # it is fetched again before the logo upload, which is all that needs it
+        rewound["thumbnail_path"] = None
+    if (
+        has_reached_stage(job, "transcoded")
+        and not has_reached_stage(job, "audio_uploaded")
+        and missing("audio_path")
+    ):
+        rewound["stage"] = "downloaded"
+    # the download is removed once it is transcoded
+    if rewound["stage"] == "downloaded" and missing("downloaded_path"):
+        rewound["stage"] = None
+
+    if rewound["stage"] != stage:
+        logging.info(
+            f"Artifacts of the PodBean job for '{job['video'].title}' are missing. Resuming after stage '{rewound['stage']}' instead of '{stage}'."
+        )
+    return rewound
+
+
 async def add_to_podbean(
-    oauth: OAuth2Session, video: YtdlPafy, audio_path: str, thumbnail_path: str
-):
-    """Uploads and publishes a video to Podbean
+    oauth: OAuth2Session,
+    video: YtdlPafy,
+    *,
+    get_jobs_pickle_path=None,
+    limits: Optional[dict] = None,
+) -> dict:
+    """Downloads, transcodes, uploads and publishes a video to PodBean.
+
+    Every completed stage is checkpointed along with the artifacts it produced, so a
+    failed or interrupted job resumes from the last completed stage.
+
+    Arguments:
+        get_jobs_pickle_path {Config} -- where job states are saved (default: Pickle:PodBeanJobs)
+        limits {dict} -- optional limiters for the "download", "transcode" and "publish" stages
+
+    Returns:
+        dict -- the final state of the job
     """
+    from app.config.pickle import podbean_jobs_pickle_path
+
+    get_jobs_pickle_path = get_jobs_pickle_path or podbean_jobs_pickle_path
+    job = rewind_job(
+        await load_job_state(video.videoid, get_jobs_pickle_path)
+        or dict(video=video, stage=None)
+    )
+    if job["stage"] is not None:
+        logging.info(
+            f"Resuming PodBean job for '{video.title}' after stage '{job['stage']}'."
+        )
+
+    async def checkpoint(stage: str, **artifacts):
+        job.update(artifacts, stage=stage)
+        await save_job_state(video.videoid, job, get_jobs_pickle_path)
+        logging.debug(f"PodBean job for '{video.title}' reached stage '{stage}'.")
+
+    if not has_reached_stage(job, "downloaded"):
+        logging.debug(f"Download audio and thumbnail for '{video.title}'")
+        async with limited(limits, "download"):
+            [downloaded_path, thumbnail_path] = await run_job_stage(
+                "download",
+                video,
+                lambda: asyncio.gather(
+                    download_audio(video), download_thumbnail(video)
+                ),
+            )
+        await checkpoint(
+            "downloaded", downloaded_path=downloaded_path, thumbnail_path=thumbnail_path
+        )
+
+    if not has_reached_stage(job, "transcoded"):
+        audio_path = await make_temp_file(
+            prefix=f"{sanitize_title(video.title)}-", suffix=".mp3", name=video.videoid
+        )
+        logging.debug(f"Converting audio to mp3 for {video.title}")
+        async with limited(limits, "transcode"):
+            await run_job_stage(
+                "transcode",
+                video,
+                lambda: convert_video(job["downloaded_path"], audio_path),
+            )
+        await checkpoint("transcoded", audio_path=audio_path)
+        remove_files(job["downloaded_path"])
+
+    if not job.get("thumbnail_path") and not has_reached_stage(job, "logo_uploaded"):
+        job["thumbnail_path"] = await download_thumbnail(video)
+
+    if not has_reached_stage(job, "published"):
+        async with limited(limits, "publish"):
+            await publish_podbean_job(oauth, video, job, checkpoint)
+
+    return job
+
+
+async def publish_podbean_job(
+    oauth: OAuth2Session, video: YtdlPafy, job: dict, checkpoint
+):
     logging.debug(f"Getting PodBean access token...")
     access_token = await get_access_token(oauth)
     logging.debug(f"PodBean access token is '{access_token}'.")
 
-    logging.debug(f"Uploading '{video.title}' to PodBean...")
-    audio_file_key, thumbnail_file_key = await upload_episode_files(
-        access_token, audio_path, thumbnail_path, video.title
-    )
+    if not has_reached_stage(job, "audio_uploaded"):
+        audio_file_key = await run_job_stage(
+            "upload",
+            video,
+            lambda: upload_episode_file(access_token, job["audio_path"], video.title),
+        )
+        await checkpoint("audio_uploaded", audio_file_key=audio_file_key)
+
+    if not has_reached_stage(job, "logo_uploaded"):
+        thumbnail_file_key = await run_job_stage(
+            "upload",
+            video,
+            lambda: upload_episode_file(
+                access_token, job["thumbnail_path"], video.title
+            ),
+        )
+        await checkpoint("logo_uploaded", thumbnail_file_key=thumbnail_file_key)
     logging.info(f"Successfully uploaded '{video.title}' to PodBean.")
 
-    logging.debug(f"Publishing episode '{video.title}' to PodBean...")
-    await publish_episode(
-        access_token, video.title, video.description, audio_file_key, thumbnail_file_key
-    )
+    if not has_reached_stage(job, "published"):
+        logging.debug(f"Publishing episode '{video.title}' to PodBean...")
+        episode = await publish_episode(
+            access_token,
+            video.title,
+            render_description(video, "podbean"),
+            job["audio_file_key"],
+            job["thumbnail_file_key"],
+        )
+        if episode is None:
+            raise Exception(
+                f"PodBean did not publish episode '{video.title}'. The job will resume after stage '{job['stage']}'."
+            )
+        await checkpoint("published")
     logging.info(f"Successfully published episode '{video.title}' to PodBean.")
 
 
-if __name__ == "__main__":
+async def finish_podbean_job(video: YtdlPafy, job: dict, get_jobs_pickle_path=None):
+    from app.config.pickle import podbean_jobs_pickle_path, podbean_posted_pickle_path
 
-    async def init():
-        from app.config.podbean import client_id, podbean_enabled
+    await mark_as_posted(video.videoid, podbean_posted_pickle_path)
+    await clear_job_state(
+        video.videoid, get_jobs_pickle_path or podbean_jobs_pickle_path
+    )
+    remove_files(
+        *(
+            job[key]
+            for key in ["downloaded_path", "audio_path", "thumbnail_path"]
+            if job.get(key)
+        )
+    )
 
-        [client_id, redirect] = await asyncio.gather(client_id(), redirect_uri())
-        oauth = OAuth2Session(client_id=client_id, redirect_uri=redirect, scope=scope)
-        await ensure_has_oauth_token(oauth)
-        return dict(oauth=oauth)
 
-    @new_video_event_handler("new_video/podbean", logger=logging, init=init)
-    async def on_new_video(video: YtdlPafy, *, oauth: OAuth2Session):
-        from app.config.podbean import client_id, podbean_enabled
-        from app.config.pickle import podbean_posted_pickle_path
+async def process_podbean(
+    oauth: OAuth2Session,
+    video: YtdlPafy,
+    *,
+    get_jobs_pickle_path=None,
+    limits: Optional[dict] = None,
+):
+    logging.debug(f"Adding video '{video.title}' to PodBean...")
+    job = await add_to_podbean(
+        oauth, video, get_jobs_pickle_path=get_jobs_pickle_path, limits=limits
+    )
+    await finish_podbean_job(video, job, get_jobs_pickle_path)
+    logging.debug(f"Added video '{video.title}' to PodBean")
 
-        [enabled, already_posted, valid_title] = await asyncio.gather(
-            podbean_enabled(),
-            is_already_posted(video.videoid, podbean_posted_pickle_path),
-            is_valid_title(video.title),
-        )
 
-        if not enabled:
-            logging.info(
-                f"PodBean processing not enabled. Skipping video '{video.title}'."
-            )
-            return
+async def process_podbean_exclusively(
+    oauth: OAuth2Session,
+    video: YtdlPafy,
+    *,
+    get_jobs_pickle_path=None,
+    limits: Optional[dict] = None,
+    owner: Optional[str] = None,
+):
+    """Like `process_podbean`, but skips the video if another worker (a replica of the
+    PodBean service, or the backfill) holds its lease or has posted it in the meantime.
+    """
+    from app.config.pickle import leases_path, podbean_posted_pickle_path
+    from app.config.podbean import lease_ttl
 
-        if already_posted:
+    async def process():
+        # the worker that held the lease before may have finished the video
+        if await is_already_posted(video.videoid, podbean_posted_pickle_path):
             logging.info(f"Video '{video.title}' has already been posted. Skipping.")
             return
+        await process_podbean(
+            oauth, video, get_jobs_pickle_path=get_jobs_pickle_path, limits=limits
+        )
+
+    [directory, ttl] = await asyncio.gather(leases_path(), lease_ttl())
+    await run_with_lease(directory, video.videoid, process, ttl=ttl, owner=owner)
+
+
+async def load_unfinished_videos(get_jobs_pickle_path=None) -> List[YtdlPafy]:
+    """The videos of the PodBean jobs that were interrupted, e.g. by a restart."""
+    from app.config.pickle import podbean_jobs_pickle_path
+
+    jobs = await load_all_job_states(get_jobs_pickle_path or podbean_jobs_pickle_path)
+    if jobs:
+        logging.info(f"Resuming {len(jobs)} unfinished PodBean job(s).")
+    return [job["video"] for job in jobs.values()]
+
 
-        if not valid_title:
-            logging.info(
-                f"Video '{video.title}' skipped because the title was not compatible with the configuration patterns."
+async def resume_unfinished_jobs(oauth: OAuth2Session, get_jobs_pickle_path=None):
+    for video in await load_unfinished_videos(get_jobs_pickle_path):
+        try:
+            await process_podbean_exclusively(
+                oauth, video, get_jobs_pickle_path=get_jobs_pickle_path
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(
+                f"Got an exception of type '{type(e)}' while resuming the PodBean job for video '{video.title}'",
+                exc_info=e,
             )
-            return
 
-        logging.debug(f"Download audio and thumbnail for '{video.title}'")
-        [audio_path, thumbnail_path] = await asyncio.gather(
-            download_audio_as_mp3(video), download_thumbnail(video)
+
+async def sweep_orphaned_files():
+    """Removes the scratch files that no unfinished job of the PodBean service or the
+    backfill needs, e.g. those of a job that crashed before cleaning up."""
+    from app.config.pickle import backfill_jobs_pickle_path, podbean_jobs_pickle_path
+
+    jobs = [
+        job
+        for states in await asyncio.gather(
+            load_all_job_states(podbean_jobs_pickle_path),
+            load_all_job_states(backfill_jobs_pickle_path),
         )
+        for job in states.values()
+    ]
+    artifacts = {
+        os.path.abspath(job[key])
+        for job in jobs
+        for key in ["downloaded_path", "audio_path", "thumbnail_path"]
+        if job.get(key)
+    }
+    # e.g. a partial download, which is named after its video
+    ids = {job["video"].videoid for job in jobs}
+
+    def keep(path: str) -> bool:
+        name = os.path.basename(path)
+        return os.path.abspath(path) in artifacts or any(id in name for id in ids)
+
+    await sweep_scratch(keep)
+
+
+async def create_oauth_session() -> OAuth2Session:
+    from app.config.podbean import client_id
+
+    [client_id, redirect] = await asyncio.gather(client_id(), redirect_uri())
+    oauth = OAuth2Session(client_id=client_id, redirect_uri=redirect, scope=scope)
+    await ensure_has_oauth_token(oauth)
+    return oauth
+
+
+async def init():
+    oauth = await create_oauth_session()
+    await sweep_orphaned_files()
+    return dict(oauth=oauth)
+
+
+@new_video_event_handler(
+    "new_video/podbean",
+    logger=logging,
+    init=init,
+    enabled=podbean_enabled,
+    reinit_on=["PodBean:ClientId", "PodBean:ClientSecret"],
+    shared=shared_subscription,
+    # the unfinished jobs go through the retries like new videos
+    resume=load_unfinished_videos,
+)
+async def on_new_video(video: YtdlPafy, *, oauth: OAuth2Session):
+    from app.config.podbean import client_id, podbean_enabled
+    from app.config.pickle import podbean_posted_pickle_path
+
+    [enabled, already_posted, valid_title] = await asyncio.gather(
+        podbean_enabled(),
+        is_already_posted(video.videoid, podbean_posted_pickle_path),
+        is_valid_title(video.title),
+    )
+
+    if not enabled:
+        logging.info(f"PodBean processing not enabled. Skipping video '{video.title}'.")
+        return
 
-        with temporary_files(audio_path, thumbnail_path):
-            logging.debug(f"Adding video '{video.title}' to PodBean...")
-            await add_to_podbean(oauth, video, audio_path, thumbnail_path)
-            await mark_as_posted(video.videoid, podbean_posted_pickle_path)
-            logging.debug(f"Added video '{video.title}' to PodBean")
+    if already_posted:
+        logging.info(f"Video '{video.title}' has already been posted. Skipping.")
+        return
+
+    if not valid_title:
+        logging.info(
+            f"Video '{video.title}' skipped because the title was not compatible with the configuration patterns."
+        )
+        return
+
+    await process_podbean_exclusively(oauth, video)
+
+
+if __name__ == "__main__":
+    run_event_handler(on_new_video)
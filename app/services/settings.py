@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from app.util import (
+    SETTINGS_WATCH_INTERVAL,
+    create_client,
+    delivery_qos,
+    entrypoint,
+    read_retained,
+    settings_topic,
+    settings_signature,
+    setup_logging,
+    with_health_server,
+)
+
+logging = setup_logging("app.services.settings")
+
+
+def flatten(settings: Any, prefix: str = "") -> Dict[str, Any]:
+    # {"YouTube": {"Enabled": true}} => {"YouTube:Enabled": true}
+    if not isinstance(settings, dict) or not settings:
+        return {prefix: settings} if prefix else {}
+    return {
+        path: value
+        for key, child in settings.items()
+        for path, value in flatten(child, f"{prefix}:{key}" if prefix else key).items()
+    }
+
+
+def changed_paths(old_values: Dict[str, Any], new_values: Dict[str, Any]) -> List[str]:
+    return sorted(
+        path
+        for path in set(old_values) | set(new_values)
+        if old_values.get(path) != new_values.get(path)
+        or (path in old_values) != (path in new_values)
+    )
+
+
+def read_settings(settings_file: str) -> Optional[dict]:
+    try:
+        with open(settings_file, mode="r") as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        # the configurator is probably still writing the file
+        return None
+
+
+def settings_hash(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def path_hashes(settings: dict) -> Dict[str, str]:
+    # published instead of the values, which include credentials
+    return {path: settings_hash(value) for path, value in flatten(settings).items()}
+
+
+async def publish_changes():
+    """Publishes a retained notification on `settings_topic` whenever the settings file
+    changes, so the other services do not have to watch the file themselves."""
+
+    settings_file = os.environ.get("SETTINGS_FILE", "./settings.json")
+
+    async with create_client() as client:
+        retained = await read_retained(client, settings_topic)
+        last = json.loads(retained) if retained else dict(version=0, hash=None)
+        logging.info(f"Last published settings version is {last['version']}.")
+
+        while True:
+            # taken before reading, so a write in between is not missed
+            signature = settings_signature()
+            settings = read_settings(settings_file)
+            if settings is not None:
+                digest = settings_hash(settings)
+                if digest != last["hash"]:
+                    hashes = path_hashes(settings)
+                    last = dict(
+                        version=last["version"] + 1,
+                        hash=digest,
+                        # unknown if the retained notification predates the hashes
+                        changed=(
+                            changed_paths(last["paths"], hashes)
+                            if "paths" in last
+                            else None
+                        ),
+                        paths=hashes,
+                    )
+                    logging.info(
+                        f"Publishing settings version {last['version']} (changed: {last['changed']})."
+                    )
+                    await client.publish(
+                        settings_topic,
+                        json.dumps(last).encode(),
+                        qos=await delivery_qos(),
+                        retain=True,
+                    )
+            # always checks the file itself: in the all-in-one mode this process also
+            # receives the notifications, which would otherwise replace the check
+            while settings_signature() == signature:
+                await asyncio.sleep(SETTINGS_WATCH_INTERVAL)
+
+
+if __name__ == "__main__":
+    entrypoint(with_health_server(publish_changes), logger=logging)
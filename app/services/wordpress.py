@@ -1,23 +1,31 @@
+from __future__ import annotations
+
 import asyncio
-import re
-from datetime import datetime
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple, Union
+from xmlrpc.client import MultiCall
 
-import dateutil.parser
 import wordpress_xmlrpc as xmlrpc
-from pafy.backend_youtube_dl import YtdlPafy
+from wordpress_xmlrpc.methods.posts import NewPost
 
+from app.config.wordpress import wp_concurrency, wp_enabled
 from app.util import (
-    URL_REGEX,
     is_already_posted,
+    is_too_old,
     load_pickle,
     mark_as_posted,
     new_video_event_handler,
+    register_executor,
+    render_description,
+    run_event_handler,
     run_sync,
     save_pickle,
     setup_logging,
 )
 
+if TYPE_CHECKING:
+    from pafy.backend_youtube_dl import YtdlPafy
+
 logging = setup_logging("app.services.wordpress")
 
 
@@ -38,7 +46,117 @@ async def make_client() -> xmlrpc.Client:
             f"Creating WordPress client (username = '{username}'; password = '****'; XMLRPC url = '{xmlrpc_url}')..."
         )
 
-    return xmlrpc.Client(xmlrpc_url, username, password)
+    # the constructor already asks the server for its supported methods
+    return await run_sync(
+        lambda: xmlrpc.Client(xmlrpc_url, username, password), executor="wordpress"
+    )
+
+
+# the XML-RPC client keeps its HTTP connection open between calls, so it is reused until
+# the credentials change. all calls go through one thread because the connection cannot
+# be shared between threads.
+def make_wp_executor() -> Tuple[ThreadPoolExecutor, int]:
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="wordpress"), 1
+
+
+register_executor("wordpress", make_wp_executor)
+
+wp_client: Optional[xmlrpc.Client] = None
+wp_client_credentials: Optional[tuple] = None
+
+
+async def get_client() -> Optional[xmlrpc.Client]:
+    from app.config.wordpress import wp_password, wp_username, wp_xmlrpc_url
+
+    global wp_client, wp_client_credentials
+
+    credentials = tuple(
+        await asyncio.gather(wp_username(), wp_password(), wp_xmlrpc_url())
+    )
+    if wp_client is None or credentials != wp_client_credentials:
+        wp_client = await make_client()
+        wp_client_credentials = credentials
+    return wp_client
+
+
+def call_batch(client: xmlrpc.Client, posts: List[NewPost]) -> List[Any]:
+    """Sends `posts` in one `system.multicall` round trip (if the server supports it).
+    Returns the post id or the raised exception for every post."""
+    if len(posts) == 1 or "system.multicall" not in client.supported_methods:
+        results: List[Any] = []
+        for post in posts:
+            try:
+                results.append(client.call(post))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    multicall = MultiCall(client.server)
+    for post in posts:
+        getattr(multicall, post.method_name)(*post.get_args(client))
+    raw_results = multicall()
+
+    results = []
+    for i, post in enumerate(posts):
+        try:
+            # raises the `Fault` of this call
+            results.append(post.process_result(raw_results[i]))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+pending_posts: List[Tuple[NewPost, asyncio.Future]] = []
+flushing = False
+
+
+async def flush_posts():
+    from app.config.wordpress import wp_max_batch_size
+
+    global flushing
+
+    try:
+        while pending_posts:
+            max_batch_size = max(1, await wp_max_batch_size())
+            batch = pending_posts[:max_batch_size]
+            del pending_posts[:max_batch_size]
+
+            try:
+                client = await get_client()
+                if client is None:
+                    results: List[Any] = [None] * len(batch)
+                else:
+                    logging.debug(f"Sending {len(batch)} post(s) to WordPress.")
+                    results = await run_sync(
+                        lambda: call_batch(client, [post for post, _ in batch]),
+                        executor="wordpress",
+                    )
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+    finally:
+        flushing = False
+
+
+async def submit_post(post: NewPost) -> Optional[str]:
+    """Creates `post` and returns its id. Posts submitted while a request is in flight are
+    sent together with the next request, so bursts need fewer round trips without adding
+    latency to a single post."""
+    global flushing
+
+    future = asyncio.get_event_loop().create_future()
+    pending_posts.append((post, future))
+    if not flushing:
+        flushing = True
+        asyncio.ensure_future(flush_posts())
+    return await future
 
 
 async def make_embed_code(video: YtdlPafy) -> str:
@@ -52,22 +170,11 @@ async def make_embed_code(video: YtdlPafy) -> str:
     return f"""<iframe width="{wp_embed_width}" height="{wp_embed_height}" src="https://www.youtube.com/embed/{video.videoid}" frameborder="0" allow="accelerometer; autoplay; encrypted-media; gyroscope; picture-in-picture" allowfullscreen></iframe>"""
 
 
-def add_anchor_to_urls(text: str) -> str:
-    # adding anchor tags to each URL prevents WordPress from automatically embedding things into the post
-    # for example, https://twitter.com/user will trigger WordPress to embed a list of tweets from the user
-    # however, <a href="http://twitter.com/user">http://twitter.com/user</a> does not have this problem
-    return re.sub(URL_REGEX, r'<a href="\1">\1</a>', text)
-
-
-def process_description(description: str) -> str:
-    return add_anchor_to_urls(description)
-
-
 async def create_post_for_video(video: YtdlPafy) -> xmlrpc.methods.posts.NewPost:
     post = xmlrpc.WordPressPost()
     post.title = video.title
     post.content = (
-        f"{await make_embed_code(video)}<hr />{process_description(video.description)}"
+        f"{await make_embed_code(video)}<hr />{render_description(video, 'wordpress')}"
     )
     post.post_status = "publish"
     return xmlrpc.methods.posts.NewPost(post)
@@ -82,13 +189,6 @@ async def post_video(video: YtdlPafy) -> Union[str, None]:
         )
         return None
 
-    client = await make_client()
-    if client is None:
-        logging.critical(
-            f"Failed to create XMLRPC client. Aborting posting video '{video.title}' to WordPress."
-        )
-        return None
-
     post = await create_post_for_video(video)
     if not post:
         logging.critical(
@@ -96,7 +196,12 @@ async def post_video(video: YtdlPafy) -> Union[str, None]:
         )
         return None
 
-    id = await run_sync(lambda: client.call(post))
+    id = await submit_post(post)
+    if id is None:
+        logging.critical(
+            f"Failed to create XMLRPC client. Aborting posting video '{video.title}' to WordPress."
+        )
+        return None
     logging.info(
         f"Successfully created WordPress post with '{id}' for video '{video.title}'"
     )
@@ -107,44 +212,46 @@ async def is_video_too_old(video: YtdlPafy):
     from app.config.wordpress import wp_max_duration
 
     max_duration = await wp_max_duration()
-    return max_duration != 0 and (
-        (datetime.now() - dateutil.parser.parse(video.published)).total_seconds()
-        > max_duration
-    )
+    return is_too_old(video, max_duration)
 
 
-if __name__ == "__main__":
+@new_video_event_handler(
+    "new_video/wordpress",
+    logger=logging,
+    enabled=wp_enabled,
+    concurrency=wp_concurrency,
+)
+async def on_new_video(video: YtdlPafy):
+    from app.config.pickle import wp_post_history_pickle_path
+    from app.config.wordpress import wp_enabled
 
-    @new_video_event_handler("new_video/wordpress", logger=logging)
-    async def on_new_video(video: YtdlPafy):
-        from app.config.pickle import wp_post_history_pickle_path
-        from app.config.wordpress import wp_enabled
+    [enabled, too_old, already_posted] = await asyncio.gather(
+        wp_enabled(),
+        is_video_too_old(video),
+        is_already_posted(video.videoid, wp_post_history_pickle_path),
+    )
 
-        [enabled, too_old, already_posted] = await asyncio.gather(
-            wp_enabled(),
-            is_video_too_old(video),
-            is_already_posted(video.videoid, wp_post_history_pickle_path),
+    if not enabled:
+        logging.debug(
+            f"WordPress publishing not enabled. Skipping video '{video.title}'."
         )
-
-        if not enabled:
-            logging.debug(
-                f"WordPress publishing not enabled. Skipping video '{video.title}'."
-            )
-            return
-        if already_posted:
-            logging.info(
-                f"Video '{video.title}' is already posted to WordPress. Skipping"
-            )
-            return
-        if too_old:
-            logging.info(
-                f"Video '{video.title}' is too old to upload to WordPress. Skipping."
-            )
-            return
-
+        return
+    if already_posted:
+        logging.info(f"Video '{video.title}' is already posted to WordPress. Skipping")
+        return
+    if too_old:
         logging.info(
-            f"Video '{video.title}' has not been to WordPress. Posting the video to WordPRess"
+            f"Video '{video.title}' is too old to upload to WordPress. Skipping."
         )
+        return
+
+    logging.info(
+        f"Video '{video.title}' has not been to WordPress. Posting the video to WordPRess"
+    )
+
+    await post_video(video)
+    await mark_as_posted(video.videoid, wp_post_history_pickle_path)
 
-        await post_video(video)
-        await mark_as_posted(video.videoid, wp_post_history_pickle_path)
+
+if __name__ == "__main__":
+    run_event_handler(on_new_video)
@@ -1,33 +1,154 @@
 import asyncio
 from collections import OrderedDict
+from functools import partial
 from itertools import chain, islice
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 import pafy
 import pafy.g
 from pafy.backend_youtube_dl import YtdlPafy
 
 from app.util import (
+    EligibilityRules,
+    compile_rules,
     create_client,
+    elect_leader,
     entrypoint,
+    get_playlist_id_for_channel_id,
     load_pickle,
+    run_sync,
     save_pickle,
     send_video,
     setup_logging,
+    update_pickle,
+    wait_for_consumers,
+    watch_consumer_lag,
+    with_health_server,
+    with_settings_watch,
 )
 
 logging = setup_logging("app.services.youtube")
 
+destination_topics = ["new_video/discord", "new_video/podbean", "new_video/wordpress"]
 
 upload_check_iteration: dict = {}
 
 
-async def get_all_uploads(refetch_latest=5):
-    def get_playlist_id_for_channel_id(channel_id: str) -> str:
-        # in YouTube, taking a channel ID and changing the second letter from "C" to "U" gives you a playlist with all that channel's uploads
-        return (
-            f"{channel_id[:1]}U{channel_id[2:]}" if channel_id[1] == "C" else channel_id
+# YouTube returns at most this many playlist items per page
+PLAYLIST_PAGE_SIZE = 50
+HASH_MODULUS = (1 << 61) - 1
+HASH_BASE = 1_000_003
+
+
+def hash_window(ids: List[str]) -> int:
+    value = 0
+    for id in ids:
+        value = (value * HASH_BASE + hash(id)) % HASH_MODULUS
+    return value
+
+
+def index_windows(ids: List[str], size: int) -> Dict[int, List[int]]:
+    """Maps the hash of every window of `size` consecutive ids to the window's offsets,
+    rolling the hash along instead of hashing every window from scratch."""
+    index: Dict[int, List[int]] = {}
+    if len(ids) < size:
+        return index
+    # weight of the id that leaves the window
+    leading = pow(HASH_BASE, size - 1, HASH_MODULUS)
+    value = hash_window(ids[:size])
+    index.setdefault(value, []).append(0)
+    for offset in range(1, len(ids) - size + 1):
+        value = (value - hash(ids[offset - 1]) * leading) % HASH_MODULUS
+        value = (value * HASH_BASE + hash(ids[offset + size - 1])) % HASH_MODULUS
+        index.setdefault(value, []).append(offset)
+    return index
+
+
+def fetch_playlist_page(
+    playlist_id: str, page_token: Optional[str]
+) -> Tuple[List[str], Optional[str]]:
+    # only the ids, unlike iterating a pafy playlist, which also fetches every video
+    query = dict(
+        part="contentDetails", maxResults=PLAYLIST_PAGE_SIZE, playlistId=playlist_id
+    )
+    if page_token:
+        query["pageToken"] = page_token
+    page = pafy.call_gdata("playlistItems", query)
+    return (
+        [item["contentDetails"]["videoId"] for item in page["items"]],
+        page.get("nextPageToken"),
+    )
+
+
+def fetch_videos(ids: List[str]) -> Dict[str, YtdlPafy]:
+    from pafy.playlist import dict_for_playlist
+
+    videos = {}
+    for i in range(0, len(ids), PLAYLIST_PAGE_SIZE):
+        data = pafy.call_gdata(
+            "videos",
+            dict(
+                part="contentDetails,snippet,statistics",
+                maxResults=PLAYLIST_PAGE_SIZE,
+                id=",".join(ids[i : i + PLAYLIST_PAGE_SIZE]),
+            ),
         )
+        for item in data["items"]:
+            video = pafy.new(item["id"], basic=False, gdata=False)
+            video.populate_from_playlist(dict_for_playlist(item))
+            videos[item["id"]] = video
+    return videos
+
+
+def reconcile_playlist(
+    playlist_id: str, saved: OrderedDict, remote_count: int
+) -> OrderedDict:
+    """Brings `saved` (ascending chronological order) up to date with the remote playlist
+    without fetching all of it.
+
+    The remote playlist is read newest first, one page of ids at a time. Every page is
+    looked up among the hashes of all windows of the saved playlist. Once a page matches
+    a saved window with as many videos after it as the remote playlist has left, the
+    rest is the same and is not fetched. Only inserted videos are fetched in full, and
+    deleted ones are dropped."""
+    saved_ids = list(reversed(saved))
+    windows = index_windows(saved_ids, PLAYLIST_PAGE_SIZE)
+
+    ids: List[str] = []
+    page_token: Optional[str] = None
+    while True:
+        page, page_token = fetch_playlist_page(playlist_id, page_token)
+        ids.extend(page)
+        remaining = remote_count - len(ids)
+        offset = next(
+            (
+                offset
+                for offset in windows.get(hash_window(page), [])
+                if len(page) == PLAYLIST_PAGE_SIZE
+                and saved_ids[offset : offset + PLAYLIST_PAGE_SIZE] == page
+                and len(saved_ids) - (offset + PLAYLIST_PAGE_SIZE) == remaining
+            ),
+            None,
+        )
+        if offset is not None:
+            ids.extend(saved_ids[offset + PLAYLIST_PAGE_SIZE :])
+            break
+        if not page_token:
+            break
+
+    inserted = [id for id in ids if id not in saved]
+    fetched = fetch_videos(inserted)
+    logging.info(
+        f"Reconciled playlist '{playlist_id}' with {len(ids)} videos: {len(inserted)} inserted, {len(set(saved) - set(ids))} deleted."
+    )
+    return OrderedDict(
+        (id, saved[id] if id in saved else fetched[id])
+        for id in reversed(ids)
+        if id in saved or id in fetched
+    )
+
 
+async def get_all_uploads(refetch_latest=5):
     def video_to_ordered_pairs(videos):
         return reversed([(video.videoid, video) for video in videos])
 
@@ -115,11 +236,14 @@ async def get_all_uploads(refetch_latest=5):
     # if a video is removed, then the playlist's old_count will be more than the new_count
     if old_count > new_count:
         logging.debug(
-            f"old_count > new_count ===> Deleted YouTube video detected for playlist '{new_playlist.title}'. Refetching the entire playlist."
+            f"old_count > new_count ===> Deleted YouTube video detected for playlist '{new_playlist.title}'. Reconciling the playlist."
         )
 
-        # a video was deleted, so we completely refetch the playlist
-        saved_playlist = OrderedDict(video_to_ordered_pairs(new_playlist))
+        # a video was deleted, so we find out which one
+        saved_playlist = await run_sync(
+            partial(reconcile_playlist, playlist_id, old_playlist, new_count),
+            executor="network",
+        )
     elif old_count == new_count:
         logging.debug(f"old_count == new_count")
         # if the counts are equal, we expect the latest 5 videos to be exactly the same
@@ -132,9 +256,12 @@ async def get_all_uploads(refetch_latest=5):
 
             if old_id != new.videoid:
                 logging.info(
-                    f"Deleted video detected. The video at position '{i}' (where position 0 is the latest video) in the playlist was expected to be video '{old.title}' but was '{new.title}'. Refetching the entire playlist."
+                    f"Deleted video detected. The video at position '{i}' (where position 0 is the latest video) in the playlist was expected to be video '{old.title}' but was '{new.title}'. Reconciling the playlist."
+                )
+                saved_playlist = await run_sync(
+                    partial(reconcile_playlist, playlist_id, old_playlist, new_count),
+                    executor="network",
                 )
-                saved_playlist = OrderedDict(video_to_ordered_pairs(new_playlist))
                 break
     else:
         logging.debug(
@@ -157,40 +284,192 @@ async def get_all_uploads(refetch_latest=5):
         yield video
 
 
-async def is_new_video(video: YtdlPafy) -> bool:
+async def load_processed_ids() -> Set[str]:
     from app.config.pickle import processed_pickle_path
 
-    processed = await load_pickle(
-        await processed_pickle_path(), get_default=lambda: set([])
-    )
-    return video.videoid not in processed
+    return await load_pickle(await processed_pickle_path(), get_default=lambda: set([]))
 
 
-async def mark_video_as_processed(video: YtdlPafy):
+async def mark_videos_as_processed(ids: Iterable[str]):
     from app.config.pickle import processed_pickle_path
 
     pickle_path = await processed_pickle_path()
 
-    await save_pickle(
-        pickle_path,
-        set(
-            [
-                *await load_pickle(pickle_path, get_default=lambda: set([])),
-                video.videoid,
-            ]
+    await update_pickle(pickle_path, lambda processed: set([*processed, *ids]), set)
+
+
+# videos published to the broker at the same time
+PUBLISH_CONCURRENCY = 32
+
+
+async def load_destination_rules() -> Dict[str, EligibilityRules]:
+    """The rules every destination topic's consumer applies to a new video, compiled once
+    until the settings change."""
+    from app.config.discord import webhook_enabled, webhook_max_duration
+    from app.config.podbean import (
+        podbean_enabled,
+        title_negative_pattern,
+        title_pattern,
+    )
+    from app.config.wordpress import wp_enabled, wp_max_duration
+
+    [
+        discord_enabled,
+        discord_max_age,
+        podbean_enabled,
+        title_pattern,
+        title_negative_pattern,
+        wordpress_enabled,
+        wordpress_max_age,
+    ] = await asyncio.gather(
+        webhook_enabled(),
+        webhook_max_duration(),
+        podbean_enabled(),
+        title_pattern(),
+        title_negative_pattern(),
+        wp_enabled(),
+        wp_max_duration(),
+    )
+    return {
+        "new_video/discord": compile_rules(discord_enabled, max_age=discord_max_age),
+        "new_video/podbean": compile_rules(
+            podbean_enabled, title_pattern, title_negative_pattern
+        ),
+        "new_video/wordpress": compile_rules(
+            wordpress_enabled, max_age=wordpress_max_age
         ),
+    }
+
+
+def route_video(video: YtdlPafy, rules: Dict[str, EligibilityRules]) -> List[str]:
+    """The destination topics whose consumers act on `video`."""
+    topics = []
+    for topic, topic_rules in rules.items():
+        reason = topic_rules.skip_reason(video)
+        if reason is None:
+            topics.append(topic)
+        else:
+            logging.debug(f"Not sending '{video.title}' to '{topic}': {reason}.")
+    return topics
+
+
+async def get_publish_limit(statuses: Dict[str, dict]) -> Optional[int]:
+    """How many new videos to publish in this poll given the consumers' heartbeats, or
+    None for all of them. A consumer lagging more than `YouTube:MaxConsumerLag` behind
+    gets at most its in-flight limit per poll, so its backlog on the broker stays small.
+    """
+    from app.config.youtube import max_consumer_lag
+
+    max_lag = await max_consumer_lag()
+    limit: Optional[int] = None
+    for topic, status in statuses.items():
+        if status["lag"] <= max_lag:
+            continue
+        logging.warning(
+            f"The consumer of '{topic}' lags {status['lag']:.0f}s behind with {status['in_flight']} of {status['limit']} videos in flight. Publishing at most {status['limit']} new videos."
+        )
+        limit = status["limit"] if limit is None else min(limit, status["limit"])
+    return limit
+
+
+async def publish_new_videos(
+    client,
+    videos: List[YtdlPafy],
+    consumer_lag: Optional[Callable[[], Dict[str, dict]]] = None,
+) -> List[YtdlPafy]:
+    """Publishes the videos that were not processed yet, in playlist order, and marks them
+    as processed with a single write once the broker confirmed them. Every video only goes
+    to the destinations whose rules it passes (see `load_destination_rules`). With
+    `consumer_lag` (see `watch_consumer_lag`), lagging consumers hold the rest back to the
+    next polls.
+    """
+    new_ids = {video.videoid for video in videos} - await load_processed_ids()
+    new_videos = []
+    for video in videos:
+        if video.videoid in new_ids:
+            new_ids.discard(video.videoid)
+            new_videos.append(video)
+    if not new_videos:
+        logging.debug(f"No new videos among the {len(videos)} videos in uploads.")
+        return []
+
+    publish_limit = (
+        await get_publish_limit(consumer_lag()) if consumer_lag is not None else None
     )
+    if publish_limit is not None and len(new_videos) > publish_limit:
+        logging.info(
+            f"Holding back {len(new_videos) - publish_limit} of {len(new_videos)} new videos until the consumers catch up."
+        )
+        new_videos = new_videos[:publish_limit]
+
+    rules = await load_destination_rules()
+    # the publishing date is fetched from the YouTube API
+    needs_published = any(topic_rules.needs_published for topic_rules in rules.values())
+    limit = asyncio.Semaphore(PUBLISH_CONCURRENCY)
+
+    async def publish(video: YtdlPafy):
+        async with limit:
+            topics = (
+                await run_sync(partial(route_video, video, rules), executor="network")
+                if needs_published
+                else route_video(video, rules)
+            )
+            if not topics:
+                logging.info(
+                    f"New video '{video.title}' detected. No destination takes it. Skipping"
+                )
+                return
+            logging.info(f"New video '{video.title}' detected. Sending it to {topics}")
+            # the same id for every detection of a video, so the consumers drop the
+            # videos a new leader publishes again after the old one died mid-publish
+            await send_video(
+                client, video, topics, event_id=f"detected-{video.videoid}"
+            )
 
+    results = await asyncio.gather(
+        *(publish(video) for video in new_videos), return_exceptions=True
+    )
+    published = [video for video, result in zip(new_videos, results) if result is None]
+    if published:
+        await mark_videos_as_processed(video.videoid for video in published)
 
-if __name__ == "__main__":
+    errors = [result for result in results if result is not None]
+    if errors:
+        raise Exception(
+            f"Could not publish {len(errors)} of {len(new_videos)} new videos."
+        ) from errors[0]
+    return published
 
-    async def main():
-        from app.config.youtube import polling_rate, youtube_api_key, youtube_enabled
 
-        logging.debug(f"Waiting for all other services to connect...")
-        await asyncio.sleep(10)  # sleep 10s to wait for rabbitmq server to go up
+async def poll():
+    from app.config.pickle import leases_path
+    from app.config.youtube import (
+        consumer_wait_timeout,
+        leader_election,
+        leader_lease_ttl,
+        polling_rate,
+        youtube_api_key,
+        youtube_enabled,
+    )
 
-        async with create_client() as client:
+    [directory, election, ttl] = await asyncio.gather(
+        leases_path(), leader_election(), leader_lease_ttl()
+    )
+    async with create_client() as client, elect_leader(
+        directory, "youtube", ttl=ttl, enabled=election
+    ) as leadership:
+        # publishing before the consumers subscribed would lose the first poll's videos
+        logging.debug(f"Waiting for the consumers of {destination_topics}...")
+        missing = await wait_for_consumers(
+            client, destination_topics, await consumer_wait_timeout()
+        )
+        if missing:
+            logging.warning(
+                f"No consumer subscribed to {missing} in time. Videos sent to these topics may be lost."
+            )
+
+        # the consumers' heartbeats, so a lagging consumer is not flooded
+        async with watch_consumer_lag(client, destination_topics) as consumer_lag:
             while True:
                 [wait_time, api_key, enabled] = await asyncio.gather(
                     polling_rate(), youtube_api_key(), youtube_enabled()
@@ -198,8 +477,16 @@ if __name__ == "__main__":
 
                 if not enabled:
                     logging.info(
-                        f"YouTube module is disabled. Skipping detection loop."
+                        f"YouTube module is disabled. Waiting until it is enabled again."
+                    )
+                    await youtube_enabled.wait_for(True)
+                    continue
+
+                if not leadership.is_leader:
+                    logging.info(
+                        f"Another YouTube service is the leader. Standing by until it stops."
                     )
+                    await leadership.elected.wait()
                     continue
 
                 if api_key:
@@ -209,27 +496,14 @@ if __name__ == "__main__":
                     f"YouTube module is enabled. Running YouTube detection loop."
                 )
 
-                async for video in get_all_uploads():
-                    logging.debug(f"Checking video '{video}' in uploads...")
-                    if not await is_new_video(video):
-                        logging.debug(
-                            f"Ignoring video '{video.title}' because it is not new."
-                        )
-                        continue
-
-                    logging.info(f"New video '{video.title}' detected. Processing")
-
-                    await send_video(
-                        client,
-                        video,
-                        [
-                            "new_video/discord",
-                            "new_video/podbean",
-                            "new_video/wordpress",
-                        ],
-                    )
-                    await mark_video_as_processed(video)
+                videos = [video async for video in get_all_uploads()]
+                # a standby may have taken over while this one was fetching the uploads
+                if not leadership.confirm():
+                    continue
+                await publish_new_videos(client, videos, consumer_lag)
 
                 await asyncio.sleep(wait_time)
 
-    entrypoint(main, logger=logging)
+
+if __name__ == "__main__":
+    entrypoint(with_health_server(with_settings_watch(poll)), logger=logging)
@@ -1,8 +1,95 @@
+from importlib import import_module
+
 from .asyncio import *
 from .config import *
-from .download import *
+from .health import *
+from .lease import *
+from .local_broker import *
 from .logging import *
 from .misc import *
 from .pickle import *
-from .streams import *
-from .youtube import *
+from .render import *
+from .scratch import *
+from .stages import *
+
+# these submodules pull in aiohttp, hbmqtt, pafy or youtube_dl, which take most of the
+# startup time. they are only imported once one of their names is used, so e.g. the
+# config modules and the WordPress service never load the media stack.
+lazy_exports = {
+    "download": [
+        "strip_extension",
+        "make_temp_file",
+        "download_to_path_single",
+        "DownloadException",
+        "get_ranged_size",
+        "RangedDownload",
+        "download_to_path",
+        "fetch_thumbnail",
+        "download_thumbnail",
+        "download_audio",
+        "VideoConversionException",
+        "convert_video",
+        "download_audio_as_mp3",
+    ],
+    "eligibility": [
+        "TitleRule",
+        "compile_title_rule",
+        "parse_published",
+        "is_too_old",
+        "EligibilityRules",
+        "compile_rules",
+    ],
+    "http": ["get_session", "close_session"],
+    "streams": [
+        "delivery_qos",
+        "encode_video_event",
+        "decode_video_event",
+        "DedupeWindow",
+        "FlowControlledClient",
+        "consumer_client_id",
+        "shared_topic",
+        "connect_to_broker",
+        "create_client",
+        "subscribe_to_topic",
+        "retry_topic",
+        "dead_letter_topic",
+        "ready_topic",
+        "lag_topic",
+        "wait_for_consumers",
+        "backoff_delay",
+        "RetryScheduler",
+        "new_video_event_handler",
+        "announce_consumer",
+        "report_lag",
+        "watch_consumer_lag",
+        "settings_topic",
+        "read_retained",
+        "watch_settings",
+        "with_settings_watch",
+        "run_event_handler",
+        "send_video",
+    ],
+    "webhook": [
+        "WebhookException",
+        "RateLimitBucket",
+        "execute_webhook",
+        "execute_webhooks",
+    ],
+    "youtube": ["get_playlist_id_for_channel_id", "get_avatar"],
+}
+lazy_submodules = {
+    name: submodule for submodule, names in lazy_exports.items() for name in names
+}
+
+
+def __getattr__(name: str):
+    if name not in lazy_submodules:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    value = getattr(import_module(f".{lazy_submodules[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(lazy_submodules))
@@ -1,6 +1,177 @@
 import asyncio
-from typing import Callable
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional, Tuple
 
 
-async def run_sync(func: Callable):
-    return await asyncio.get_event_loop().run_in_executor(executor=None, func=func)
+class ExecutorStats:
+    """How long work waits for a worker of an executor and how busy its workers are."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.created_at = time.monotonic()
+        self.submitted = 0
+        self.completed = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.busy_total = 0.0
+
+    def record(self, submitted_at: float, started_at: float, finished_at: float):
+        # the clock is shared with the worker processes of a process pool
+        queue_wait = max(0.0, started_at - submitted_at)
+        self.completed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.busy_total += max(0.0, finished_at - started_at)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.created_at, 1e-9)
+        return dict(
+            size=self.size,
+            submitted=self.submitted,
+            completed=self.completed,
+            in_flight=self.submitted - self.completed,
+            queue_wait_mean=self.queue_wait_total / max(self.completed, 1),
+            queue_wait_max=self.queue_wait_max,
+            utilization=self.busy_total / (elapsed * self.size),
+        )
+
+
+def make_network_executor() -> Tuple[Executor, int]:
+    from app.config.executors import network_threads
+
+    size = max(1, int(network_threads.sync()))
+    return ThreadPoolExecutor(max_workers=size, thread_name_prefix="network"), size
+
+
+def make_file_executor() -> Tuple[Executor, int]:
+    from app.config.executors import file_threads
+
+    size = max(1, int(file_threads.sync()))
+    return ThreadPoolExecutor(max_workers=size, thread_name_prefix="file"), size
+
+
+def make_cpu_executor() -> Tuple[Executor, int]:
+    from app.config.executors import cpu_processes
+
+    # pulls in multiprocessing, which every service would load at startup otherwise
+    from concurrent.futures import ProcessPoolExecutor
+
+    size = max(1, int(cpu_processes.sync()))
+    return ProcessPoolExecutor(max_workers=size), size
+
+
+# blocking network calls, file system calls and CPU bound work each get their own workers,
+# so e.g. a slow download does not hold up writing a file. the executors are created on
+# first use. functions sent to "cpu" run in another process and have to be picklable, e.g.
+# a `functools.partial` of a module level function.
+executor_factories: Dict[str, Callable[[], Tuple[Executor, int]]] = dict(
+    network=make_network_executor, file=make_file_executor, cpu=make_cpu_executor
+)
+executors: Dict[str, Executor] = {}
+executor_stats: Dict[str, ExecutorStats] = {}
+
+
+def register_executor(name: str, make: Callable[[], Tuple[Executor, int]]):
+    """Makes the executor (and its number of workers) returned by `make` available to
+    `run_sync` as `name`."""
+    executor_factories[name] = make
+
+
+def get_executor(name: str) -> Executor:
+    if name not in executors:
+        executor, size = executor_factories[name]()
+        executors[name] = executor
+        executor_stats[name] = ExecutorStats(size)
+    return executors[name]
+
+
+def shutdown_executors():
+    for name in list(executors):
+        executor = executors.pop(name)
+        # a process pool that is dropped before its workers exited hangs the interpreter's
+        # exit on Python 3.7, so it finishes the running calls first
+        executor.shutdown(wait=not isinstance(executor, ThreadPoolExecutor))
+        del executor_stats[name]
+
+
+def get_executor_metrics() -> Dict[str, dict]:
+    return {name: stats.snapshot() for name, stats in executor_stats.items()}
+
+
+def timed_call(func: Callable):
+    started_at = time.monotonic()
+    try:
+        result, error = func(), None
+    except Exception as e:
+        result, error = None, e
+    return started_at, time.monotonic(), result, error
+
+
+async def run_sync(func: Callable, executor: Optional[str] = None):
+    """Runs `func` in the named executor ("network", "file", "cpu" or one added with
+    `register_executor`), or in the event loop's default executor."""
+    loop = asyncio.get_event_loop()
+    if executor is None:
+        return await loop.run_in_executor(None, func)
+
+    pool = get_executor(executor)
+    stats = executor_stats[executor]
+    stats.submitted += 1
+    submitted_at = time.monotonic()
+    try:
+        started_at, finished_at, result, error = await loop.run_in_executor(
+            pool, timed_call, func
+        )
+    except BaseException:
+        stats.completed += 1
+        raise
+    stats.record(submitted_at, started_at, finished_at)
+    if error is not None:
+        raise error
+    return result
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = None
+
+    def _refill(self, now: float):
+        if self.updated_at is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated_at) * self.rate
+            )
+        self.updated_at = now
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self._refill(loop.time())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+@asynccontextmanager
+async def limited(limits: Optional[dict], key: str):
+    """Enters `limits[key]` (e.g. a semaphore or a token bucket) if there is one."""
+    limiter = (limits or {}).get(key)
+    if limiter is None:
+        yield
+    else:
+        async with limiter:
+            yield
@@ -1,10 +1,121 @@
+import asyncio
+import copy
 import json
 import os
 from functools import reduce
-from typing import Any, Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 import aiofiles
 
+# parsed settings files shared by every Config, keyed by path. An entry is only used
+# while the file's modification time and size are unchanged.
+settings_cache: dict = {}
+
+
+def _settings_signature(settings_file: str) -> Tuple[int, int]:
+    stat = os.stat(settings_file)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _current_signature(settings_file: str) -> Optional[Tuple[int, int]]:
+    try:
+        return _settings_signature(settings_file)
+    except OSError:
+        return None
+
+
+def settings_signature() -> Optional[Tuple[int, int]]:
+    """Modification time and size of the settings file, or None if it does not exist."""
+    return _current_signature(os.environ.get("SETTINGS_FILE", "./settings.json"))
+
+
+# how often a parked service checks the settings file for changes
+SETTINGS_WATCH_INTERVAL = 2.0
+
+# set while change notifications keep this process up to date (see `watch_settings`).
+# reads then use the cached settings without checking the file.
+settings_watched = False
+settings_listeners: List[Callable[[Optional[List[str]]], None]] = []
+_settings_changed: Optional[asyncio.Event] = None
+
+
+def _settings_changed_event() -> asyncio.Event:
+    global _settings_changed
+
+    if _settings_changed is None:
+        _settings_changed = asyncio.Event()
+    return _settings_changed
+
+
+def set_settings_watched(watched: bool):
+    global settings_watched, _settings_changed
+
+    settings_watched = watched
+    # parked services go back to checking the file themselves
+    if not watched and _settings_changed is not None:
+        _settings_changed.set()
+        _settings_changed = None
+
+
+def notify_settings_changed(changed: Optional[List[str]], call_listeners=True):
+    """Drops the cached settings and wakes everything waiting for a change.
+
+    `changed` lists the changed key paths (e.g. `YouTube:Enabled`), or is None if they are
+    not known.
+    """
+    global _settings_changed
+
+    settings_cache.clear()
+    if _settings_changed is not None:
+        _settings_changed.set()
+        _settings_changed = None
+    if call_listeners:
+        for listener in list(settings_listeners):
+            listener(changed)
+
+
+def on_settings_change(
+    prefixes: List[str], callback: Callable[[Optional[List[str]]], None]
+) -> Callable[[], None]:
+    """Calls `callback` with the changed key paths whenever a key under one of `prefixes`
+    (e.g. `PodBean` or `PodBean:ClientId`) changes. Returns a function that removes it.
+    """
+
+    def listener(changed: Optional[List[str]]):
+        if changed is None or any(
+            path == prefix or path.startswith(f"{prefix}:")
+            for path in changed
+            for prefix in prefixes
+        ):
+            callback(changed)
+
+    settings_listeners.append(listener)
+    return lambda: settings_listeners.remove(listener)
+
+
+async def wait_for_settings_change(since: Optional[Tuple[int, int]] = None):
+    """Returns once the settings file differs from the `since` signature (by default,
+    its signature when this is called). Without change notifications, checking costs one
+    `stat` per interval."""
+    settings_file = os.environ.get("SETTINGS_FILE", "./settings.json")
+    if since is None:
+        since = _current_signature(settings_file)
+    while _current_signature(settings_file) == since:
+        try:
+            await asyncio.wait_for(
+                _settings_changed_event().wait(),
+                None if settings_watched else SETTINGS_WATCH_INTERVAL,
+            )
+        except asyncio.TimeoutError:
+            pass
+
+
+def _cached_settings(settings_file: str, signature: Tuple[int, int]) -> Optional[dict]:
+    entry = settings_cache.get(settings_file)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    return None
+
 
 class Config:
     def __init__(self, config_name: str, default: Any = None):
@@ -25,9 +136,10 @@ class Config:
                 value = self.default()
             else:
                 value = self.default
-        return value
+        return copy.deepcopy(value)
 
     def _set_value_sync(self, data: dict, value: Any, settings_file: str) -> Any:
+        data = copy.deepcopy(data)
         config = data
         for path in self.config_path:
             if path not in config:
@@ -37,6 +149,7 @@ class Config:
 
         with open(settings_file, mode="w") as f:
             f.write(json.dumps(data, indent=4))
+        settings_cache[settings_file] = (_settings_signature(settings_file), data)
 
         return value
 
@@ -44,13 +157,20 @@ class Config:
         settings_file = os.environ.get("SETTINGS_FILE", "./settings.json")
 
         data: dict
-        if not os.path.exists(settings_file):
+        entry = settings_cache.get(settings_file) if settings_watched else None
+        if entry is not None:
+            data = entry[1]
+        elif not os.path.exists(settings_file):
             data = {}
             with open(settings_file, mode="w") as f:
                 f.write(json.dumps(data, indent=4))
         else:
-            with open(settings_file, mode="r") as f:
-                data = json.loads(f.read())
+            signature = _settings_signature(settings_file)
+            data = _cached_settings(settings_file, signature)
+            if data is None:
+                with open(settings_file, mode="r") as f:
+                    data = json.loads(f.read())
+                settings_cache[settings_file] = (signature, data)
 
         if value is None:
             return self._get_value_sync(data)
@@ -74,9 +194,10 @@ class Config:
                 value = await self.default()
             else:
                 value = self.default
-        return value
+        return copy.deepcopy(value)
 
     async def _set_value(self, data: dict, value: Any, settings_file: str) -> Any:
+        data = copy.deepcopy(data)
         config = data
         for path in self.config_path:
             if path not in config:
@@ -86,6 +207,7 @@ class Config:
 
         async with aiofiles.open(settings_file, mode="w") as f:
             await f.write(json.dumps(data, indent=4))
+        settings_cache[settings_file] = (_settings_signature(settings_file), data)
 
         return value
 
@@ -93,13 +215,20 @@ class Config:
         settings_file = os.environ.get("SETTINGS_FILE", "./settings.json")
 
         data: dict
-        if not os.path.exists(settings_file):
+        entry = settings_cache.get(settings_file) if settings_watched else None
+        if entry is not None:
+            data = entry[1]
+        elif not os.path.exists(settings_file):
             data = {}
             async with aiofiles.open(settings_file, mode="w") as f:
                 await f.write(json.dumps(data, indent=4))
         else:
-            async with aiofiles.open(settings_file, mode="r") as f:
-                data = json.loads(await f.read())
+            signature = _settings_signature(settings_file)
+            data = _cached_settings(settings_file, signature)
+            if data is None:
+                async with aiofiles.open(settings_file, mode="r") as f:
+                    data = json.loads(await f.read())
+                settings_cache[settings_file] = (signature, data)
 
         if value is None:
             return await self._get_value(data)
@@ -109,6 +238,17 @@ class Config:
     async def __call__(self, value: Union[Any, None] = None) -> Any:
         return await self._retrieve(value=value)
 
+    async def wait_for(self, expected: Any) -> Any:
+        """Parks until the setting equals `expected`, only reading it again after the
+        settings file changed."""
+        settings_file = os.environ.get("SETTINGS_FILE", "./settings.json")
+        while True:
+            # taken before reading, so a change right after the read is not missed
+            signature = _current_signature(settings_file)
+            if await self() == expected:
+                return expected
+            await wait_for_settings_change(signature)
+
 
 def create_config(config_name: str, default: Any = None):
     return Config(config_name=config_name, default=default)
@@ -1,16 +1,29 @@
+from __future__ import annotations
+
 import asyncio
+import json
 import os
 import random
+import re
 import string
-import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import partial
 from logging import getLogger
+from math import ceil
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
 
-import pafy.g
-import youtube_dl.downloader.http
-from pafy.backend_youtube_dl import YtdlPafy
+import aiohttp
 
 from app.util.asyncio import run_sync
+from app.util.http import get_session
 from app.util.misc import get_url_extension, sanitize_title, temporary_files
+from app.util.scratch import get_scratch_directory, reserve_scratch
+from app.util.stages import current_stage, report_progress
+
+if TYPE_CHECKING:
+    from pafy.backend_youtube_dl import YtdlPafy
 
 logging = getLogger(__name__)
 
@@ -22,19 +35,28 @@ def strip_extension(path: str):
 async def make_temp_file(
     prefix: str,
     suffix: str,
-    directory: str = f"{tempfile.gettempdir()}/youtube2podbean",
+    directory: Optional[str] = None,
+    name: Optional[str] = None,
+    small: bool = False,
 ) -> str:
+    """A path for a new file in `directory`, by default the scratch directory (see
+    `get_scratch_directory`)."""
+    directory = directory or await get_scratch_directory(small)
+
     def sync():
-        if not os.path.isdir(directory):
-            os.mkdir(directory)
+        # a fixed name lets an interrupted download find its partial file again
+        if name is not None:
+            return f"{directory}/{prefix}{name}{suffix}"
         random_string = "".join(random.choice(string.ascii_lowercase) for _ in range(6))
         return f"{directory}/{prefix}{random_string}{suffix}"
 
-    return await run_sync(sync)
+    return await run_sync(sync, executor="file")
 
 
 class ydl:
     def urlopen(self, url):
+        import pafy.g
+
         return pafy.g.opener.open(url)
 
     def to_screen(self, *args, **kwargs):
@@ -53,28 +75,389 @@ class ydl:
         pass
 
 
-async def download_to_path(url: str, path: str) -> str:
+async def download_to_path_single(url: str, path: str) -> str:
+    # the thread cannot be cancelled, so it stops at its next progress report instead
+    cancelled = threading.Event()
+    progress = current_stage.get()
+
+    def hook(status: dict):
+        if cancelled.is_set():
+            raise DownloadException(f"Download of '{url}' into '{path}' was cancelled.")
+        if progress is not None and "downloaded_bytes" in status:
+            progress.update(
+                status["downloaded_bytes"],
+                status.get("total_bytes"),
+                "B",
+                status.get("speed"),
+            )
+
     def sync():
+        import youtube_dl.downloader.http
+
         downloader = youtube_dl.downloader.http.HttpFD(
             ydl(), {"http_chunk_size": 10_485_760}
         )
+        downloader.add_progress_hook(hook)
 
         downloader.download(path, dict(url=url))
 
         return path
 
-    return await run_sync(sync)
+    try:
+        return await run_sync(sync, executor="network")
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+class DownloadException(Exception):
+    pass
+
+
+async def get_ranged_size(session: aiohttp.ClientSession, url: str) -> Optional[int]:
+    """Asks for the first byte of `url` to find out if the server supports range requests.
+
+    Returns:
+        Optional[int] -- the total size of the resource or None if ranges are not supported
+    """
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+        if response.status != 206:
+            return None
+        match = re.match(
+            r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", "")
+        )
+        return int(match[1]) if match else None
+
+
+class RangedDownload:
+    """Downloads a file over several connections, one byte range (chunk) per request.
+
+    Completed chunks are recorded in a manifest next to the output file so an interrupted
+    download only fetches the chunks that are missing. The number of connections is adjusted
+    between `min_connections` and `max_connections` based on the measured throughput.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        path: str,
+        size: int,
+        *,
+        chunk_size: int,
+        min_connections: int,
+        max_connections: int,
+        max_chunk_attempts: int,
+        control_interval: float = 2.0,
+    ):
+        self.session = session
+        self.url = url
+        self.path = path
+        self.manifest_path = f"{path}.manifest"
+        self.size = size
+        self.chunk_size = chunk_size
+        self.num_chunks = ceil(size / chunk_size)
+        self.min_connections = max(1, min_connections)
+        self.max_connections = max(self.min_connections, max_connections)
+        self.max_chunk_attempts = max_chunk_attempts
+        self.control_interval = control_interval
+
+        self.completed: set = set()
+        self.attempts: Counter = Counter()
+        self.bytes_downloaded = 0
+        # the size of the chunks completed before an interruption
+        self.resumed_bytes = 0
+        self.target_connections = self.min_connections
+        self.active_connections = 0
+        self.workers: list = []
+        self.manifest_lock = threading.Lock()
+        # snapshots of `completed` are numbered, so a snapshot saved late by one file
+        # executor thread does not overwrite a newer one saved by another
+        self.manifest_version = 0
+        self.saved_manifest_version = 0
+
+    def _load_manifest(self) -> set:
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) != self.size:
+            return set()
+        try:
+            with open(self.manifest_path, mode="r") as f:
+                manifest = json.loads(f.read())
+        except (OSError, IOError, ValueError):
+            return set()
+        if (
+            manifest.get("size") != self.size
+            or manifest.get("chunk_size") != self.chunk_size
+        ):
+            logging.info(
+                f"Ignoring the resume manifest at '{self.manifest_path}' because it was written for a different file."
+            )
+            return set()
+        return set(manifest.get("completed", []))
+
+    def _save_manifest(self, completed: list, version: int):
+        temp_path = f"{self.manifest_path}.tmp"
+        with self.manifest_lock:
+            if version <= self.saved_manifest_version:
+                return
+            with open(temp_path, mode="w") as f:
+                f.write(
+                    json.dumps(
+                        dict(
+                            size=self.size,
+                            chunk_size=self.chunk_size,
+                            completed=completed,
+                        )
+                    )
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.manifest_path)
+            self.saved_manifest_version = version
+
+    @staticmethod
+    def _write_chunk(fd: int, data: bytearray, start: int):
+        os.pwrite(fd, data, start)
+        # the manifest must not list a chunk whose data a crash could still lose
+        os.fsync(fd)
+
+    def _prepare(self) -> set:
+        completed = self._load_manifest()
+        if not completed:
+            # preallocate the whole file so each chunk can be written in place
+            with open(self.path, mode="wb") as f:
+                f.truncate(self.size)
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(f.fileno(), 0, self.size)
+        return completed
+
+    def _chunk_range(self, index: int):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size) - 1
+
+    async def _fetch_chunk(self, fd: int, index: int):
+        start, end = self._chunk_range(index)
+        data = bytearray()
+        async with self.session.get(
+            self.url, headers={"Range": f"bytes={start}-{end}"}
+        ) as response:
+            if response.status != 206:
+                raise DownloadException(
+                    f"Expected a partial response for bytes {start}-{end} of '{self.url}' but got status '{response.status}'."
+                )
+            async for block in response.content.iter_chunked(65_536):
+                data.extend(block)
+                self.bytes_downloaded += len(block)
+                report_progress(
+                    self.resumed_bytes + self.bytes_downloaded, self.size, "B"
+                )
+
+        if len(data) != end - start + 1:
+            raise DownloadException(
+                f"Expected {end - start + 1} bytes for bytes {start}-{end} of '{self.url}' but got {len(data)}."
+            )
+
+        await run_sync(lambda: self._write_chunk(fd, data, start), executor="file")
+        self.completed.add(index)
+        self.manifest_version += 1
+        completed, version = sorted(self.completed), self.manifest_version
+        await run_sync(lambda: self._save_manifest(completed, version), executor="file")
+
+    async def _worker(self, queue: asyncio.Queue, fd: int, failed: asyncio.Future):
+        try:
+            while self.active_connections <= self.target_connections:
+                index = await queue.get()
+                try:
+                    await self._fetch_chunk(fd, index)
+                except asyncio.CancelledError:
+                    # an Exception before Python 3.8, and not a failed chunk
+                    raise
+                except Exception as e:
+                    self.attempts[index] += 1
+                    if self.attempts[index] >= self.max_chunk_attempts:
+                        if not failed.done():
+                            failed.set_exception(e)
+                        return
+                    logging.warning(
+                        f"Failed to download chunk {index} of '{self.path}' (attempt {self.attempts[index]}): {e!r}. Retrying."
+                    )
+                    queue.put_nowait(index)
+                finally:
+                    queue.task_done()
+        finally:
+            self.active_connections -= 1
+
+    def _spawn_workers(self, queue: asyncio.Queue, fd: int, failed: asyncio.Future):
+        while self.active_connections < self.target_connections:
+            self.active_connections += 1
+            self.workers.append(asyncio.ensure_future(self._worker(queue, fd, failed)))
+
+    async def _control(self, queue: asyncio.Queue, fd: int, failed: asyncio.Future):
+        # simple hill climbing: keep adding connections while each one improves throughput
+        previous = 0.0
+        last_bytes = self.bytes_downloaded
+        while True:
+            await asyncio.sleep(self.control_interval)
+            throughput = (self.bytes_downloaded - last_bytes) / self.control_interval
+            last_bytes = self.bytes_downloaded
+
+            if (
+                throughput >= previous * 1.1
+                and self.target_connections < self.max_connections
+            ):
+                self.target_connections += 1
+            elif (
+                throughput < previous * 0.9
+                and self.target_connections > self.min_connections
+            ):
+                self.target_connections -= 1
+            logging.debug(
+                f"Downloading '{self.path}' at {throughput / 1_048_576:.2f} MiB/s. Using {self.target_connections} connections."
+            )
+            previous = throughput
+            self._spawn_workers(queue, fd, failed)
+
+    async def run(self) -> str:
+        self.completed = await run_sync(self._prepare, executor="file")
+        pending = [i for i in range(self.num_chunks) if i not in self.completed]
+        self.resumed_bytes = sum(
+            end - start + 1 for start, end in map(self._chunk_range, self.completed)
+        )
+        if self.completed:
+            logging.info(
+                f"Resuming download of '{self.path}'. {len(self.completed)}/{self.num_chunks} chunks are already downloaded."
+            )
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in pending:
+            queue.put_nowait(index)
+
+        started = time.monotonic()
+        fd = os.open(self.path, os.O_WRONLY)
+        failed = asyncio.get_event_loop().create_future()
+        finished = asyncio.ensure_future(queue.join())
+        controller = asyncio.ensure_future(self._control(queue, fd, failed))
+        try:
+            self._spawn_workers(queue, fd, failed)
+            await asyncio.wait([finished, failed], return_when=asyncio.FIRST_COMPLETED)
+            if failed.done():
+                raise failed.exception()
+        finally:
+            for task in [finished, controller, *self.workers]:
+                task.cancel()
+            await asyncio.gather(
+                finished, controller, *self.workers, return_exceptions=True
+            )
+            os.close(fd)
+
+        if (
+            len(self.completed) != self.num_chunks
+            or os.path.getsize(self.path) != self.size
+        ):
+            raise DownloadException(
+                f"Download of '{self.url}' into '{self.path}' is incomplete. Expected {self.size} bytes in {self.num_chunks} chunks."
+            )
+        os.remove(self.manifest_path)
+
+        elapsed = time.monotonic() - started
+        logging.debug(
+            f"Downloaded {self.bytes_downloaded} bytes into '{self.path}' in {elapsed:.2f}s ({self.bytes_downloaded / max(elapsed, 1e-6) / 1_048_576:.2f} MiB/s)."
+        )
+        return self.path
+
+
+async def download_to_path(url: str, path: str) -> str:
+    import pafy.g
+
+    from app.config.download import (
+        download_chunk_size,
+        download_max_chunk_attempts,
+        download_max_connections,
+        download_min_connections,
+    )
+
+    [chunk_size, min_connections, max_connections, max_chunk_attempts] = (
+        await asyncio.gather(
+            download_chunk_size(),
+            download_min_connections(),
+            download_max_connections(),
+            download_max_chunk_attempts(),
+        )
+    )
+
+    async with aiohttp.ClientSession(
+        headers=dict(pafy.g.opener.addheaders),
+        connector=aiohttp.TCPConnector(limit=max_connections),
+        timeout=aiohttp.ClientTimeout(sock_connect=30, sock_read=60),
+    ) as session:
+        size = await get_ranged_size(session, url)
+        if size is None:
+            logging.debug(
+                f"'{url}' does not support range requests. Falling back to a single connection download."
+            )
+            return await download_to_path_single(url, path)
+
+        return await RangedDownload(
+            session,
+            url,
+            path,
+            size,
+            chunk_size=chunk_size,
+            min_connections=min_connections,
+            max_connections=max_connections,
+            max_chunk_attempts=max_chunk_attempts,
+        ).run()
+
+
+# thumbnails of the most recent videos, shared by every handler running in this process
+thumbnail_cache: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+THUMBNAIL_CACHE_SIZE = 16
+
+
+async def fetch_thumbnail(video: YtdlPafy) -> bytes:
+    """Returns the thumbnail of `video`, downloading it at most once per process."""
+    if video.videoid in thumbnail_cache:
+        thumbnail_cache.move_to_end(video.videoid)
+        return await asyncio.shield(thumbnail_cache[video.videoid])
+
+    url = video.bigthumbhd if video.bigthumbhd else video.bigthumb
+
+    async def fetch():
+        logging.debug(f"Downloading thumbnail of '{video.title}' from '{url}'")
+        async with get_session().get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    future = asyncio.ensure_future(fetch())
+    thumbnail_cache[video.videoid] = future
+    while len(thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+        thumbnail_cache.popitem(last=False)
+
+    try:
+        return await asyncio.shield(future)
+    except BaseException:
+        if thumbnail_cache.get(video.videoid) is future:
+            del thumbnail_cache[video.videoid]
+        raise
 
 
 async def download_thumbnail(video: YtdlPafy) -> str:
     title = sanitize_title(video.title)
     url = video.bigthumbhd if video.bigthumbhd else video.bigthumb
 
-    path = await make_temp_file(prefix=f"{title}-", suffix=f".{get_url_extension(url)}")
+    path = await make_temp_file(
+        prefix=f"{title}-", suffix=f".{get_url_extension(url)}", small=True
+    )
     logging.debug(
         f"Downloading thumbnail of '{video.title}' (sanitizied = '{title}') from '{url}' into '{path}'"
     )
-    path = await download_to_path(url, path)
+    thumbnail = await fetch_thumbnail(video)
+
+    def sync():
+        with open(path, mode="wb") as f:
+            f.write(thumbnail)
+        return path
+
+    path = await run_sync(sync, executor="file")
     logging.info(
         f"Downloaded thumbnail of '{video.title}' (sanitizied = '{title}') from '{url}' into '{path}'"
     )
@@ -82,18 +465,26 @@ async def download_thumbnail(video: YtdlPafy) -> str:
     return path
 
 
+# scratch space reserved for an audio stream whose size YouTube does not tell
+UNKNOWN_AUDIO_SIZE = 512 * 1_048_576
+
+
 async def download_audio(video: YtdlPafy) -> str:
     title = sanitize_title(video.title)
     best = video.getbestaudio()
     logging.debug(f"The best audio for {video.title} is of type {best.extension}")
 
     path = await make_temp_file(
-        prefix=f"{title}-downloaded", suffix=f".{best.extension}"
+        prefix=f"{title}-downloaded-",
+        suffix=f".{best.extension}",
+        name=video.videoid,
     )
+    size = await run_sync(best.get_filesize, executor="network")
     logging.debug(
         f"Downloading audio stream of '{video.title}' (sanitizied = '{title}') from '{best.url}' into '{path}'"
     )
-    path = await download_to_path(best.url, path)
+    async with reserve_scratch(path, size or UNKNOWN_AUDIO_SIZE):
+        path = await download_to_path(best.url, path)
     logging.info(
         f"Downloaded audio stream of '{video.title}' (sanitizied = '{title}') from '{best.url}' into '{path}'"
     )
@@ -105,27 +496,267 @@ class VideoConversionException(Exception):
     pass
 
 
-async def convert_video(path: str, output_path: str):
-    logging.debug(f"Converting {path} to {output_path} using ffmpeg...")
-
-    # call ffmpeg and wait for it to finish
+# the MP3 every episode is converted to
+MP3_OPTIONS = ["-vn", "-ac", "2", "-ab", "128000", "-ar", "44100"]
+# bytes per second of the MP3, with some room for headers
+MP3_BYTES_PER_SECOND = 128000 // 8 * 1.05
+# a long episode is split into segments of at least this many seconds
+MIN_SEGMENT_DURATION = 5 * 60
+# seconds before and after an even split point that are searched for a silence to cut at
+SILENCE_SEARCH_WINDOW = 30.0
+SILENCE_FILTER = "silencedetect=noise=-40dB:d=0.3"
+SILENCE_PATTERN = re.compile(r"silence_(start|end): (-?[0-9.]+)")
+
+
+async def read_ffmpeg_progress(
+    stream: asyncio.StreamReader, on_progress: Callable[[dict], None]
+):
+    # with -progress, ffmpeg prints blocks of key=value lines, each ending with "progress"
+    block = {}
+    async for line in stream:
+        key, _, value = line.decode(errors="replace").strip().partition("=")
+        block[key] = value
+        if key == "progress":
+            on_progress(block)
+            block = {}
+
+
+def parse_ffmpeg_progress(block: dict) -> Tuple[float, Optional[float]]:
+    """The position in seconds and the speed (as a multiple of real time) in a block of
+    ffmpeg's progress output."""
+    try:
+        position = max(0, int(block.get("out_time_us") or block["out_time_ms"])) / 1e6
+    except (KeyError, ValueError):
+        position = 0.0
+    try:
+        speed: Optional[float] = float(block.get("speed", "").rstrip("x"))
+    except ValueError:
+        speed = None
+    return position, speed
+
+
+async def run_ffmpeg(
+    *args: str,
+    program: str = "ffmpeg",
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> Tuple[str, str]:
+    """Runs `program` (ffmpeg or ffprobe) and returns its stdout and stderr. With
+    `on_progress`, ffmpeg reports its progress to it (see `parse_ffmpeg_progress`) about
+    twice a second instead of printing to stdout. The process is killed when this is
+    cancelled."""
+    if on_progress is not None:
+        args = ("-progress", "pipe:1", "-nostats", *args)
     process = await asyncio.create_subprocess_exec(
-        "ffmpeg", "-i", path, "-ac", "2", "-ab", "128000", "-ar", "44100", output_path
+        program,
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        if on_progress is None:
+            stdout, stderr = await process.communicate()
+        else:
+            # stderr has to be drained while the progress is read, or ffmpeg blocks
+            [_, stderr] = await asyncio.gather(
+                read_ffmpeg_progress(process.stdout, on_progress),
+                process.stderr.read(),
+            )
+            await process.wait()
+            stdout = b""
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+
+    if process.returncode != 0:
+        raise VideoConversionException(
+            f"{program} exited with code {process.returncode}.\nArguments: {args}\nStderr: {stderr.decode(errors='replace')[-4000:]}"
+        )
+    return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+
+async def probe_duration(path: str) -> Optional[float]:
+    try:
+        stdout, _ = await run_ffmpeg(
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path,
+            program="ffprobe",
+        )
+        return float(stdout.strip())
+    except (VideoConversionException, ValueError) as e:
+        logging.warning(f"Could not determine the duration of '{path}': {e}")
+        return None
+
+
+async def find_cut_point(path: str, target: float) -> float:
+    """The middle of the silence closest to `target` seconds into `path`, or `target`
+    itself if there is no silence nearby. Only the audio around `target` is decoded."""
+    start = max(0.0, target - SILENCE_SEARCH_WINDOW)
+    _, stderr = await run_ffmpeg(
+        "-hide_banner",
+        "-nostats",
+        "-ss",
+        f"{start:.3f}",
+        "-t",
+        f"{SILENCE_SEARCH_WINDOW * 2:.3f}",
+        "-i",
+        path,
+        "-vn",
+        "-af",
+        SILENCE_FILTER,
+        "-f",
+        "null",
+        "-",
     )
 
-    exit_code = await process.wait()
-    logging.debug(
-        f"Got the following exit code when converting {path} to {output_path}: {exit_code}"
+    silences = []
+    silence_start: Optional[float] = 0.0
+    for kind, at in SILENCE_PATTERN.findall(stderr):
+        # the timestamps are relative to the start of the searched window
+        if kind == "start":
+            silence_start = max(0.0, float(at))
+        elif silence_start is not None:
+            silences.append((start + silence_start + start + float(at)) / 2)
+            silence_start = None
+    if not silences:
+        logging.debug(f"No silence around {target:.1f}s in '{path}'. Cutting there.")
+        return target
+    return min(silences, key=lambda cut: abs(cut - target))
+
+
+async def convert_in_segments(
+    path: str, output_path: str, duration: float, processes: int
+):
+    """Converts `path` to MP3 in segments, `processes` at a time, and joins them.
+
+    The segments are cut in silences near even split points. Every segment is encoded on
+    its own, so the encoder's delay and padding add a few milliseconds at every cut,
+    which the silence hides. The MP3 frames are then joined without encoding them again.
+    """
+    count = max(1, min(processes, int(duration // MIN_SEGMENT_DURATION)))
+    cuts = await asyncio.gather(
+        *(find_cut_point(path, duration * i / count) for i in range(1, count))
     )
+    bounds = list(zip([0.0, *cuts], [*cuts, None]))
+    base = strip_extension(output_path)
+    segment_paths = [f"{base}.part{i}.mp3" for i in range(len(bounds))]
+    list_path = f"{base}.parts.txt"
+    limit = asyncio.Semaphore(processes)
+    # the position and speed of every segment's ffmpeg
+    positions = [0.0] * len(bounds)
+    speeds = [0.0] * len(bounds)
+
+    def on_progress(index: int, block: dict):
+        positions[index], speed = parse_ffmpeg_progress(block)
+        # a finished segment no longer adds to the speed
+        speeds[index] = (speed or 0.0) if block["progress"] == "continue" else 0.0
+        report_progress(sum(positions), duration, "s", sum(speeds))
+
+    async def convert_segment(
+        index: int, start: float, end: Optional[float], segment_path: str
+    ):
+        async with limit:
+            await run_ffmpeg(
+                "-y",
+                "-ss",
+                f"{start:.3f}",
+                *(["-t", f"{end - start:.3f}"] if end is not None else []),
+                "-i",
+                path,
+                *MP3_OPTIONS,
+                # the header frame and tags of every segment but the first would end up
+                # in the middle of the joined file
+                "-write_xing",
+                "0",
+                "-id3v2_version",
+                "0",
+                segment_path,
+                on_progress=partial(on_progress, index),
+            )
+
+    with temporary_files(*segment_paths, list_path):
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                convert_segment(index, start, end, segment_path)
+                for index, ((start, end), segment_path) in enumerate(
+                    zip(bounds, segment_paths)
+                )
+            )
+        )
 
-    if exit_code != 0:
-        stdout, stderr = await process.communicate()
-        raise VideoConversionException(
-            f"Failed to convert video located at {path}.\nStdout: {stdout}\nStderr: {stderr}"
+        def write_list():
+            with open(list_path, mode="w") as f:
+                for segment_path in segment_paths:
+                    escaped = os.path.abspath(segment_path).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+
+        await run_sync(write_list, executor="file")
+        await run_ffmpeg(
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-c",
+            "copy",
+            output_path,
         )
+        logging.info(
+            f"Converted {duration:.0f}s of '{path}' in {len(bounds)} segments (cut at {[round(cut, 1) for cut in cuts]}) in {time.monotonic() - started:.2f}s."
+        )
+
+
+async def convert_video(path: str, output_path: str):
+    """Converts `path` to an MP3 at `output_path`. Episodes longer than
+    `Download:SegmentedTranscodeThreshold` are converted in segments on several cores,
+    see `convert_in_segments`."""
+    from app.config.download import segmented_transcode_threshold, transcode_processes
+
+    [threshold, processes] = await asyncio.gather(
+        segmented_transcode_threshold(), transcode_processes()
+    )
+    processes = processes or os.cpu_count() or 1
+    duration = await probe_duration(path)
+    segmented = (
+        duration is not None and threshold and processes > 1 and duration >= threshold
+    )
+    # the parts and the joined file exist at the same time
+    size = (
+        duration * MP3_BYTES_PER_SECOND * (2 if segmented else 1)
+        if duration is not None
+        else os.path.getsize(path)
+    )
+    # the download is deleted only after the conversion
+    async with reserve_scratch(strip_extension(output_path), int(size), keeps=[path]):
+        if segmented:
+            logging.debug(
+                f"Converting {path} ({duration:.0f}s) to {output_path} in up to {processes} segments using ffmpeg..."
+            )
+            await convert_in_segments(path, output_path, duration, processes)
+        else:
+            await convert_whole(path, output_path, duration)
     return output_path
 
 
+async def convert_whole(path: str, output_path: str, duration: Optional[float]):
+    def on_progress(block: dict):
+        position, speed = parse_ffmpeg_progress(block)
+        report_progress(position, duration, "s", speed)
+
+    logging.debug(f"Converting {path} to {output_path} using ffmpeg...")
+    await run_ffmpeg(
+        "-y", "-i", path, *MP3_OPTIONS, output_path, on_progress=on_progress
+    )
+
+
 async def download_audio_as_mp3(video: YtdlPafy) -> str:
     logging.debug(f"Downloading original audio for {video.title}")
     original_audio = await download_audio(video)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+import dateutil.parser
+
+if TYPE_CHECKING:
+    from pafy.backend_shared import BasePafy
+
+
+class TitleRule:
+    """A title pattern a video has to match and one it must not match (if any), compiled
+    once for every video checked against them."""
+
+    def __init__(self, pattern: str, negative_pattern: str):
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.negative_pattern = (
+            re.compile(negative_pattern, re.IGNORECASE) if negative_pattern else None
+        )
+
+    def matches(self, title: str) -> bool:
+        return self.pattern.search(title) is not None and (
+            self.negative_pattern is None or self.negative_pattern.search(title) is None
+        )
+
+
+@lru_cache(maxsize=16)
+def compile_title_rule(pattern: str, negative_pattern: str) -> TitleRule:
+    return TitleRule(pattern, negative_pattern)
+
+
+@lru_cache(maxsize=1024)
+def parse_published(published: str) -> datetime:
+    return dateutil.parser.parse(published)
+
+
+def is_too_old(video: BasePafy, max_age: float) -> bool:
+    """Whether `video` is older than `max_age` seconds. A `max_age` of 0 allows any age
+    (and does not fetch the publishing date)."""
+    return (
+        max_age != 0
+        and (datetime.now() - parse_published(video.published)).total_seconds()
+        > max_age
+    )
+
+
+class EligibilityRules:
+    """Decides whether a destination acts on a video: it has to be enabled, the title has
+    to match its patterns and the video must not be older than `max_age` seconds."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        title_rule: Optional[TitleRule] = None,
+        max_age: float = 0,
+    ):
+        self.enabled = enabled
+        self.title_rule = title_rule
+        self.max_age = max_age
+
+    @property
+    def needs_published(self) -> bool:
+        # pafy fetches the publishing date from the YouTube API on first access
+        return self.enabled and self.max_age != 0
+
+    def skip_reason(self, video: BasePafy) -> Optional[str]:
+        """Why the destination would skip `video`, or None if it acts on it."""
+        if not self.enabled:
+            return "not enabled"
+        if self.title_rule is not None and not self.title_rule.matches(video.title):
+            return "title not compatible with the configuration patterns"
+        if is_too_old(video, self.max_age):
+            return "too old"
+        return None
+
+
+@lru_cache(maxsize=64)
+def compile_rules(
+    enabled: bool = True,
+    title_pattern: Optional[str] = None,
+    title_negative_pattern: str = "",
+    max_age: float = 0,
+) -> EligibilityRules:
+    """The rules for the given settings, compiled once until the settings change."""
+    return EligibilityRules(
+        enabled,
+        (
+            compile_title_rule(title_pattern, title_negative_pattern)
+            if title_pattern is not None
+            else None
+        ),
+        max_age,
+    )
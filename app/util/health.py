@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from app.util.asyncio import get_executor_metrics
+from app.util.stages import get_stage_metrics
+
+if TYPE_CHECKING:
+    import aiohttp.web
+
+logging = getLogger(__name__)
+
+# conditions the service itself reports, e.g. "broker" once it is connected
+ready_conditions: Dict[str, bool] = {}
+
+
+def set_ready(name: str, ready: bool = True):
+    if ready_conditions.get(name) != ready:
+        logging.debug(f"Readiness condition '{name}' is now {ready}.")
+    ready_conditions[name] = ready
+
+
+async def check_settings():
+    from app.config.core import message_broker
+
+    # reading any value parses (or creates) the settings file
+    await message_broker()
+
+
+async def check_state_store():
+    from app.config.pickle import processed_pickle_path
+
+    directory = os.path.dirname(await processed_pickle_path()) or "."
+    if not os.path.isdir(directory) or not os.access(directory, os.W_OK):
+        raise Exception(f"The state store directory '{directory}' is not writable.")
+
+
+readiness_checks: Dict[str, Callable[[], Awaitable[None]]] = dict(
+    settings=check_settings, state_store=check_state_store
+)
+
+
+async def get_readiness() -> Tuple[bool, dict]:
+    async def run(check) -> str:
+        try:
+            await check()
+        except BaseException as e:
+            return f"failed: {e}"
+        return "ok"
+
+    names: List[str] = list(readiness_checks)
+    results = await asyncio.gather(*(run(readiness_checks[name]) for name in names))
+    status = dict(zip(names, results))
+    for name, ready in ready_conditions.items():
+        status[name] = "ok" if ready else "waiting"
+    return all(value == "ok" for value in status.values()), status
+
+
+# the runner `serve_health` started, which also serves the callbacks of `serve_callback`
+health_runner: Optional["aiohttp.web.AppRunner"] = None
+# the handlers of the callbacks being served, by path
+callback_handlers: Dict[
+    str, Callable[["aiohttp.web.Request"], Awaitable["aiohttp.web.Response"]]
+] = {}
+
+
+def add_callback_route(app: "aiohttp.web.Application"):
+    import aiohttp.web
+
+    async def callback(request: aiohttp.web.Request):
+        handler = callback_handlers.get(request.path)
+        if handler is None:
+            raise aiohttp.web.HTTPNotFound()
+        return await handler(request)
+
+    # added last, so it does not shadow the other routes
+    app.router.add_get("/{path:.*}", callback)
+
+
+@asynccontextmanager
+async def serve_health():
+    """Serves `/healthz` (the event loop is responsive), `/readyz` (every readiness check
+    passes) and `/metrics` (the executors' queue wait times and utilization, and the
+    progress of the running stages) on `Server:Host`:`Server:HealthPort` while the
+    context is active. Its runner also serves the callbacks of `serve_callback`."""
+
+    import aiohttp.web
+
+    from app.config.server import health_port, host
+
+    async def healthz(request: aiohttp.web.Request):
+        return aiohttp.web.Response(text="ok")
+
+    async def readyz(request: aiohttp.web.Request):
+        ready, status = await get_readiness()
+        return aiohttp.web.Response(
+            status=200 if ready else 503,
+            text=json.dumps(status, indent=4),
+            content_type="application/json",
+        )
+
+    async def metrics(request: aiohttp.web.Request):
+        return aiohttp.web.Response(
+            text=json.dumps(
+                dict(executors=get_executor_metrics(), stages=get_stage_metrics()),
+                indent=4,
+            ),
+            content_type="application/json",
+        )
+
+    [host, port] = await asyncio.gather(host(), health_port())
+    app = aiohttp.web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    add_callback_route(app)
+    runner = aiohttp.web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        if int(port):
+            await aiohttp.web.TCPSite(runner, host, int(port)).start()
+            logging.info(f"Serving /healthz, /readyz and /metrics at {host}:{port}")
+    except OSError as e:
+        # the service itself keeps working without its health endpoints
+        logging.exception(
+            f"Could not start the health server at {host}:{port}.", exc_info=e
+        )
+    global health_runner
+    health_runner = runner
+    try:
+        yield runner
+    finally:
+        health_runner = None
+        await runner.cleanup()
+
+
+@asynccontextmanager
+async def get_callback_runner() -> AsyncIterator["aiohttp.web.AppRunner"]:
+    if health_runner is not None:
+        yield health_runner
+        return
+
+    # e.g. the backfill, which does not serve the health endpoints
+    import aiohttp.web
+
+    app = aiohttp.web.Application()
+    add_callback_route(app)
+    runner = aiohttp.web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        yield runner
+    finally:
+        await runner.cleanup()
+
+
+@asynccontextmanager
+async def serve_callback(
+    path: str,
+    handler: Callable[["aiohttp.web.Request"], Awaitable["aiohttp.web.Response"]],
+    host: str,
+    port: str,
+) -> AsyncIterator[None]:
+    """Serves the GET requests to `path` with `handler` at `host`:`port` while the
+    context is active, e.g. the OAuth callback. They are served in this event loop, by
+    the runner of `serve_health` if it is running."""
+    import aiohttp.web
+
+    callback_handlers[path] = handler
+    try:
+        async with get_callback_runner() as runner:
+            site = None
+            # the health endpoints may share the port
+            if not any(address[1] == int(port) for address in runner.addresses):
+                site = aiohttp.web.TCPSite(runner, host, int(port))
+                await site.start()
+            logging.info(f"Serving {path} at {host}:{port}")
+            try:
+                yield
+            finally:
+                if site is not None:
+                    await site.stop()
+    finally:
+        callback_handlers.pop(path, None)
+
+
+def with_health_server(f: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    async def wrapper():
+        async with serve_health():
+            return await f()
+
+    return wrapper
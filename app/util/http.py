@@ -0,0 +1,32 @@
+import asyncio
+from logging import getLogger
+from typing import Optional
+
+import aiohttp
+
+logging = getLogger(__name__)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Returns the HTTP session (and with it, the connection pool) shared by the whole process."""
+    global _session
+
+    # a session is bound to the event loop it was created in
+    if (
+        _session is None
+        or _session.closed
+        or _session._loop is not asyncio.get_event_loop()
+    ):
+        logging.debug("Creating the shared HTTP session.")
+        _session = aiohttp.ClientSession()
+    return _session
+
+
+async def close_session():
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
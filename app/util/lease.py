@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from .pickle import locked_file, write_atomically
+
+logging = getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def get_worker_name() -> str:
+    # different for every replica, and stable across restarts, so the broker finds the
+    # replica's persistent session and retries again. a container's hostname changes when
+    # it is re-created, so replicas should set WORKER_NAME
+    return os.environ.get("WORKER_NAME") or socket.gethostname()
+
+
+def get_lease_owner() -> str:
+    return f"{get_worker_name()}-{os.getpid()}"
+
+
+def lease_path(directory: str, key: str) -> str:
+    return os.path.join(directory, f"{key}.lease")
+
+
+def read_lease(path: str) -> Optional[dict]:
+    try:
+        with open(path, mode="r") as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def try_acquire_lease(path: str, owner: str, ttl: float) -> bool:
+    """Takes the lease at `path` for `ttl` seconds unless another owner holds it and it
+    has not expired yet."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with locked_file(path):
+        lease = read_lease(path)
+        now = time.time()
+        if lease is not None and lease["owner"] != owner and lease["expires_at"] > now:
+            return False
+        write_atomically(
+            path, json.dumps(dict(owner=owner, expires_at=now + ttl)).encode()
+        )
+        return True
+
+
+def renew_lease(path: str, owner: str, ttl: float) -> bool:
+    """Extends the lease at `path` by `ttl` seconds. Fails if another owner took it over
+    after it expired."""
+    with locked_file(path):
+        lease = read_lease(path)
+        if lease is None or lease["owner"] != owner:
+            return False
+        write_atomically(
+            path, json.dumps(dict(owner=owner, expires_at=time.time() + ttl)).encode()
+        )
+        return True
+
+
+def release_lease(path: str, owner: str):
+    with locked_file(path):
+        lease = read_lease(path)
+        if lease is not None and lease["owner"] == owner:
+            os.remove(path)
+
+
+async def run_with_lease(
+    directory: str,
+    key: str,
+    func: Callable[[], Awaitable],
+    *,
+    ttl: float,
+    owner: Optional[str] = None,
+) -> bool:
+    """Runs `func` while holding the lease on `key` in `directory` (e.g. under the shared
+    `pickles/`), so only one worker at a time works on `key`.
+
+    Returns False without running `func` if another worker holds the lease. The lease is
+    renewed every third of `ttl` and expires `ttl` seconds after a worker died. If a
+    renewal fails, e.g. because the worker was paused for longer than `ttl` and another
+    worker took over or the lease could not be written, `func` is cancelled and
+    `LeaseLost` is raised.
+    """
+    owner = owner or get_lease_owner()
+    path = lease_path(directory, key)
+    if not try_acquire_lease(path, owner, ttl):
+        logging.info(f"Another worker holds the lease on '{key}'. Skipping.")
+        return False
+
+    async def renew():
+        while True:
+            await asyncio.sleep(ttl / 3)
+            if not renew_lease(path, owner, ttl):
+                return
+
+    work = asyncio.ensure_future(func())
+    renewal = asyncio.ensure_future(renew())
+    try:
+        await asyncio.wait([work, renewal], return_when=asyncio.FIRST_COMPLETED)
+        if not work.done():
+            work.cancel()
+            error = renewal.exception()
+            if error is not None:
+                raise LeaseLost(f"Could not renew the lease on '{key}'.") from error
+            raise LeaseLost(f"Lost the lease on '{key}' to another worker.")
+        work.result()
+        return True
+    finally:
+        work.cancel()
+        renewal.cancel()
+        # retrieves the exception of a renewal that failed while `func` finished
+        await asyncio.gather(renewal, return_exceptions=True)
+        release_lease(path, owner)
+
+
+class Leadership:
+    """The state of this process in a leader election, see `elect_leader`."""
+
+    def __init__(self, path: Optional[str], owner: str, ttl: float):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.elected = asyncio.Event()
+        if path is None:
+            # without an election, this process is the only candidate
+            self.elected.set()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.elected.is_set()
+
+    def _update(self, is_leader: bool) -> bool:
+        if is_leader and not self.elected.is_set():
+            logging.info(f"'{self.owner}' is the leader now.")
+            self.elected.set()
+        elif not is_leader and self.elected.is_set():
+            logging.warning(f"'{self.owner}' is not the leader anymore.")
+            self.elected.clear()
+        return is_leader
+
+    def campaign(self) -> bool:
+        if self.path is None:
+            return True
+        if self.is_leader:
+            return self._update(renew_lease(self.path, self.owner, self.ttl))
+        return self._update(try_acquire_lease(self.path, self.owner, self.ttl))
+
+    def confirm(self) -> bool:
+        """Renews the lease right away and returns whether this process still leads.
+
+        Call it right before acting as the leader: a leader that was paused for longer
+        than the lease may have been replaced in the meantime.
+        """
+        if self.path is None:
+            return True
+        return self._update(
+            self.is_leader and renew_lease(self.path, self.owner, self.ttl)
+        )
+
+
+@asynccontextmanager
+async def elect_leader(
+    directory: str,
+    name: str,
+    *,
+    ttl: float,
+    owner: Optional[str] = None,
+    enabled: bool = True,
+) -> AsyncIterator[Leadership]:
+    """Takes part in the election of a leader among the processes that share `directory`
+    (e.g. replicas of a service sharing `pickles/`).
+
+    The leader holds the lease `name` and renews it every third of `ttl`. The others try
+    to take it over just as often, so a leader that dies is replaced within `ttl` seconds,
+    and one that shuts down cleanly within a third of that. Without `enabled`, this
+    process leads.
+    """
+    leadership = Leadership(
+        lease_path(directory, name) if enabled else None,
+        owner or get_lease_owner(),
+        ttl,
+    )
+
+    async def campaign():
+        while True:
+            try:
+                leadership.campaign()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # steps down, so another process takes over once the lease expires
+                logging.warning(f"Could not reach the lease '{name}': {e}")
+                leadership._update(False)
+            await asyncio.sleep(ttl / 3)
+
+    task = asyncio.ensure_future(campaign()) if enabled else None
+    try:
+        yield leadership
+    finally:
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if leadership.is_leader:
+                release_lease(leadership.path, leadership.owner)
@@ -0,0 +1,185 @@
+import asyncio
+from logging import getLogger
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Set, Tuple
+
+logging = getLogger(__name__)
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Checks `topic` against an MQTT topic filter, including the `+` and `#` wildcards."""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def split_shared_filter(topic_filter: str) -> Tuple[Optional[str], str]:
+    """Splits a shared subscription (`$share/<group>/<filter>`) into its group and
+    filter. The group of a normal subscription is None."""
+    if topic_filter.startswith("$share/"):
+        _, group, topic_filter = topic_filter.split("/", 2)
+        return group, topic_filter
+    return None, topic_filter
+
+
+class LocalMessage:
+    """Mimics the parts of hbmqtt's `ApplicationMessage` that the handlers use."""
+
+    def __init__(self, topic: str, data: bytes, retain: bool):
+        self.topic = topic
+        self.data = data
+        self.retain = retain
+        self.publish_packet = SimpleNamespace(payload=SimpleNamespace(data=data))
+
+
+class LocalClient:
+    """An in-memory stand-in for `hbmqtt.client.MQTTClient`."""
+
+    def __init__(self, broker: "LocalBroker", client_id: Optional[str] = None):
+        self.broker = broker
+        self.client_id = client_id
+        self.subscriptions: set = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def connect(self, *args, **kwargs):
+        pass
+
+    async def disconnect(self):
+        self.broker.remove(self)
+
+    async def publish(self, topic: str, message: bytes, qos=None, retain=False):
+        self.broker.publish(topic, message, retain)
+        return LocalMessage(topic, message, retain)
+
+    async def subscribe(self, topics: List[Tuple[str, int]]) -> List[int]:
+        for topic_filter, _ in topics:
+            self.subscriptions.add(topic_filter)
+            # like MQTT brokers, retained messages are not sent to shared subscriptions
+            if split_shared_filter(topic_filter)[0] is not None:
+                continue
+            for topic, data in self.broker.retained.items():
+                if topic_matches(topic_filter, topic):
+                    self.queue.put_nowait(LocalMessage(topic, data, True))
+        self.broker.release_held(self)
+        return [qos for _, qos in topics]
+
+    async def unsubscribe(self, topics: List[str]):
+        for topic_filter in topics:
+            self.subscriptions.discard(topic_filter)
+
+    async def deliver_message(self, timeout: Optional[float] = None) -> LocalMessage:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def subscription_groups(self, topic: str) -> Set[Optional[str]]:
+        groups = set()
+        for topic_filter in self.subscriptions:
+            group, topic_filter = split_shared_filter(topic_filter)
+            if topic_matches(topic_filter, topic):
+                groups.add(group)
+        return groups
+
+    def is_subscribed(self, topic: str) -> bool:
+        return bool(self.subscription_groups(topic))
+
+
+class LocalBroker:
+    """Hands messages between the services of a single process without an MQTT broker.
+
+    Messages published while nobody is subscribed to their topic are held until a
+    subscriber shows up, so events are not lost while a handler is still starting.
+    Retained messages (e.g. pending retries) are only kept in memory, so they do not
+    survive a restart of the process.
+
+    Clients with a `client_id` have a persistent session: after they disconnect, their
+    subscriptions stay and their messages queue until a client with the same id connects.
+    Shared subscriptions (`$share/<group>/<filter>`) hand each message to one member of
+    the group.
+    """
+
+    def __init__(self):
+        self.clients: List[LocalClient] = []
+        self.sessions: Dict[str, LocalClient] = {}
+        self.retained: dict = {}
+        self.held: List[Tuple[str, bytes]] = []
+        self.shared_turns: Dict[str, int] = {}
+
+    def client(self, client_id: Optional[str] = None) -> LocalClient:
+        if client_id is not None and client_id in self.sessions:
+            return self.sessions[client_id]
+
+        client = LocalClient(self, client_id)
+        self.clients.append(client)
+        if client_id is not None:
+            self.sessions[client_id] = client
+        return client
+
+    def remove(self, client: LocalClient):
+        if client.client_id is not None:
+            return
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def publish(self, topic: str, data: bytes, retain: bool):
+        if retain:
+            # like MQTT, an empty retained message clears the retained message of the topic
+            if data:
+                self.retained[topic] = data
+            else:
+                self.retained.pop(topic, None)
+
+        subscribers = self.receivers(topic)
+        if not subscribers and not retain:
+            self.held.append((topic, data))
+        for client in subscribers:
+            client.queue.put_nowait(LocalMessage(topic, data, False))
+
+    def receivers(self, topic: str) -> List[LocalClient]:
+        receivers: List[LocalClient] = []
+        groups: Dict[str, List[LocalClient]] = {}
+        for client in self.clients:
+            for group in client.subscription_groups(topic):
+                if group is None:
+                    receivers.append(client)
+                else:
+                    groups.setdefault(group, []).append(client)
+
+        # each message of a shared subscription goes to one member of the group, in turn
+        for group, members in groups.items():
+            turn = self.shared_turns.get(group, 0)
+            self.shared_turns[group] = turn + 1
+            member = members[turn % len(members)]
+            if member not in receivers:
+                receivers.append(member)
+        return receivers
+
+    def release_held(self, client: LocalClient):
+        held, self.held = self.held, []
+        for topic, data in held:
+            if client.is_subscribed(topic):
+                client.queue.put_nowait(LocalMessage(topic, data, False))
+            else:
+                self.held.append((topic, data))
+
+
+_local_broker: Optional[LocalBroker] = None
+
+
+def use_local_broker(broker: Optional[LocalBroker]):
+    """Makes `create_client` hand out clients of `broker` instead of connecting to MQTT."""
+    global _local_broker
+
+    logging.info(
+        "Using the in-memory message broker."
+        if broker is not None
+        else "Using the MQTT message broker."
+    )
+    _local_broker = broker
+
+
+def get_local_broker() -> Optional[LocalBroker]:
+    return _local_broker
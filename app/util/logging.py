@@ -7,15 +7,15 @@ import sys
 from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
-from discord_webhook import DiscordWebhook
-
-from app.util.asyncio import run_sync
+from app.util.asyncio import run_sync, shutdown_executors
 from app.util.misc import split_by_length
 
 DISCORD_WEBHOOK_CONTENT_MAX_LENGTH = 1900
 
 
 def send_webhook_message(content: str, url: str):
+    from discord_webhook import DiscordWebhook
+
     DiscordWebhook(url=url, content=content).execute()
 
 
@@ -83,9 +83,15 @@ def entrypoint(f, logger: logging.Logger):
         return loop.default_exception_handler(context)
 
     async def wrapper():
+        from app.util.http import close_session
+
         loop = asyncio.get_running_loop()
         loop.set_default_executor(ThreadPoolExecutor())
         loop.set_exception_handler(exception_handler)
-        return await f()
+        try:
+            return await f()
+        finally:
+            await close_session()
+            shutdown_executors()
 
     return asyncio.run(wrapper())
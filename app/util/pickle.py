@@ -1,18 +1,63 @@
 import asyncio
+import fcntl
+import os
 import pickle
+from contextlib import contextmanager
 from logging import getLogger
 from typing import Any
 
+from .asyncio import run_sync
+
 logging = getLogger(__name__)
 
 
+@contextmanager
+def locked_file(path: str):
+    """Holds an exclusive lock on `path` (through `<path>.lock`) that every process
+    sharing the file system respects, e.g. the replicas of a service sharing `pickles/`.
+
+    Do not await while holding it: another coroutine of the same process waiting for the
+    lock would block the event loop.
+    """
+    with open(f"{path}.lock", mode="a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_atomically(path: str, data: bytes):
+    # readers in other processes see either the old or the new file, never a partial one
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, mode="wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def read_pickle(path: str) -> Any:
+    with open(path, mode="rb") as f:
+        return pickle.load(f)
+
+
+def update_pickle_locked(path: str, update, get_default) -> Any:
+    # blocks on the lock, so it runs on the file executor
+    with locked_file(path):
+        try:
+            value = read_pickle(path)
+        except (OSError, IOError):
+            value = get_default()
+        value = update(value)
+        write_atomically(path, pickle.dumps(value))
+    return value
+
+
 async def load_pickle(path: str, get_default=None) -> Any:
     logging.debug(
         f"Loading pickle file at '{path}'. Default value {'exists' if get_default is not None else 'does not exist'}."
     )
     try:
-        with open(path, mode="rb") as f:
-            value = pickle.load(f)
+        value = await run_sync(lambda: read_pickle(path), executor="file")
     except (OSError, IOError):
         if get_default is None:
             logging.error(
@@ -24,11 +69,14 @@ async def load_pickle(path: str, get_default=None) -> Any:
                 f"Could not load pickle file '{path}'. Loading and writing default value to file."
             )
         if asyncio.iscoroutinefunction(get_default):
-            value = await get_default()
+            default = await get_default()
         else:
-            value = get_default()
-        with open(path, mode="wb") as f:
-            pickle.dump(value, f)
+            default = get_default()
+        # another process may have written the file in the meantime, which wins
+        value = await run_sync(
+            lambda: update_pickle_locked(path, lambda value: value, lambda: default),
+            executor="file",
+        )
     else:
         logging.debug(
             f"Successfully loaded pickle file at '{path}'. Object is of type '{type(value)}'."
@@ -42,12 +90,21 @@ async def save_pickle(path: str, object: Any) -> Any:
         f"Saving object of type {type(object)} to the pickle file located at {path}."
     )
 
-    with open(path, mode="wb") as f:
-        pickle.dump(object, f)
+    await run_sync(
+        lambda: write_atomically(path, pickle.dumps(object)), executor="file"
+    )
 
     return object
 
 
+async def update_pickle(path: str, update, get_default) -> Any:
+    """Replaces the object in the pickle file at `path` with `update(object)` while
+    holding its lock, so concurrent updates from other processes are not lost."""
+    return await run_sync(
+        lambda: update_pickle_locked(path, update, get_default), executor="file"
+    )
+
+
 async def is_already_posted(id: str, get_pickle_path) -> bool:
     pickle_path: str = await get_pickle_path()
     posted_set = await load_pickle(pickle_path, get_default=lambda: set([]))
@@ -56,5 +113,32 @@ async def is_already_posted(id: str, get_pickle_path) -> bool:
 
 async def mark_as_posted(id: str, get_pickle_path):
     pickle_path: str = await get_pickle_path()
-    post_history = await load_pickle(pickle_path, get_default=lambda: set([]))
-    await save_pickle(pickle_path, set([id, *post_history]))
+    await update_pickle(
+        pickle_path, lambda post_history: set([id, *post_history]), lambda: set([])
+    )
+
+
+async def load_job_state(id: str, get_pickle_path) -> dict:
+    pickle_path: str = await get_pickle_path()
+    jobs = await load_pickle(pickle_path, get_default=lambda: {})
+    return dict(jobs.get(id, {}))
+
+
+async def load_all_job_states(get_pickle_path) -> dict:
+    pickle_path: str = await get_pickle_path()
+    return await load_pickle(pickle_path, get_default=lambda: {})
+
+
+async def save_job_state(id: str, state: dict, get_pickle_path) -> dict:
+    pickle_path: str = await get_pickle_path()
+    await update_pickle(pickle_path, lambda jobs: {**jobs, id: state}, lambda: {})
+    return state
+
+
+async def clear_job_state(id: str, get_pickle_path):
+    pickle_path: str = await get_pickle_path()
+    await update_pickle(
+        pickle_path,
+        lambda jobs: {key: job for key, job in jobs.items() if key != id},
+        lambda: {},
+    )
@@ -0,0 +1,89 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+from .misc import URL_REGEX, clip_text
+
+URL_PATTERN = re.compile(URL_REGEX)
+# a URL never contains whitespace and always contains a ":" or a "." followed by a letter
+# or digit (the top level domain), so the URL pattern only has to run on the whitespace
+# separated tokens that do, and not on e.g. words at the end of a sentence. the lookbehind
+# only lets a match start at the beginning of a token, which keeps this linear.
+URL_CANDIDATE_PATTERN = re.compile(r"(?<!\S)\S*?(?::|[.][a-zA-Z0-9])\S*")
+
+PODBEAN_CONTENT_LENGTH = 500
+
+
+def replace_urls(text: str, replace: Callable[["re.Match"], str]) -> str:
+    """Like `URL_PATTERN.sub(replace, text)`, but skips the text between URLs cheaply."""
+    pieces = []
+    position = 0
+    for candidate in URL_CANDIDATE_PATTERN.finditer(text):
+        token, count = URL_PATTERN.subn(replace, candidate.group())
+        if count:
+            pieces.append(text[position : candidate.start()])
+            pieces.append(token)
+            position = candidate.end()
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+
+def anchor(match: "re.Match") -> str:
+    return f'<a href="{match[1]}">{match[1]}</a>'
+
+
+def render_wordpress_html(description: str) -> str:
+    # adding anchor tags to each URL prevents WordPress from automatically embedding things into the post
+    # for example, https://twitter.com/user will trigger WordPress to embed a list of tweets from the user
+    # however, <a href="http://twitter.com/user">http://twitter.com/user</a> does not have this problem
+    return replace_urls(description, anchor)
+
+
+def render_discord_embed(description: str, max_length: int) -> str:
+    return clip_text(description, max_length)
+
+
+def render_podbean_content(
+    description: str, max_length: int = PODBEAN_CONTENT_LENGTH
+) -> str:
+    return description[0:max_length]
+
+
+render_targets: Dict[str, Callable[..., str]] = dict(
+    wordpress=render_wordpress_html,
+    discord=render_discord_embed,
+    podbean=render_podbean_content,
+)
+
+# rendered descriptions of the most recent videos, shared by every handler running in
+# this process, so retries and backfills do not render the same description again
+render_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+RENDER_CACHE_SIZE = 64
+
+
+def description_hash(description: str) -> str:
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def render_description(video, target: str, **options) -> str:
+    """Renders the description of `video` for `target` (one of `render_targets`),
+    at most once per video id, description and options."""
+    description = video.description or ""
+    key = (
+        video.videoid,
+        description_hash(description),
+        target,
+        tuple(sorted(options.items())),
+    )
+    if key in render_cache:
+        render_cache.move_to_end(key)
+        return render_cache[key]
+
+    rendered = render_targets[target](description, **options)
+    render_cache[key] = rendered
+    while len(render_cache) > RENDER_CACHE_SIZE:
+        render_cache.popitem(last=False)
+    return rendered
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import shutil
+import time
+import weakref
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import AsyncIterator, Callable, Iterable, List, Tuple
+
+logging = getLogger(__name__)
+
+# how often a job waiting for scratch space checks the disk again, as other processes
+# may have freed some
+SCRATCH_RECHECK_INTERVAL = 5.0
+# scratch files modified this recently are never swept, as another process sharing the
+# scratch directory (e.g. the backfill next to the PodBean service) may be writing them
+ORPHAN_MIN_AGE = 10 * 60
+
+
+class ScratchSpaceException(Exception):
+    pass
+
+
+def list_files(directory: str) -> List[os.DirEntry]:
+    try:
+        return [entry for entry in os.scandir(directory) if entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+def directory_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in list_files(directory))
+
+
+def files_size(paths: Iterable[str]) -> int:
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+class ScratchSpace:
+    """Hands out the scratch directory's space to the jobs of this process.
+
+    A job reserves the space its next stage needs, for the files whose paths start with a
+    prefix, before the stage starts. Reservations are granted first come, first served,
+    once the scratch files and the other reservations fit into `Scratch:Budget` and the
+    disk keeps `Scratch:MinFreeSpace` free. A reservation covers its files as they grow,
+    so they are not counted twice.
+    """
+
+    def __init__(self):
+        self.reservations: List[Tuple[Tuple[str, ...], int]] = []
+        self.queue = asyncio.Lock()
+        self.changed = asyncio.Condition()
+
+    def usage(self, directory: str, ignore: Iterable[str] = ()) -> Tuple[int, int]:
+        """The bytes the scratch files (except `ignore`) and reservations take up, and the
+        bytes of the reservations that are not written yet."""
+        written = [0] * len(self.reservations)
+        unreserved = 0
+        for entry in list_files(directory):
+            if entry.path in ignore:
+                continue
+            size = entry.stat().st_size
+            for index, (prefixes, _) in enumerate(self.reservations):
+                if entry.path.startswith(prefixes):
+                    written[index] += size
+                    break
+            else:
+                unreserved += size
+        outstanding = sum(
+            max(0, reserved - done)
+            for (_, reserved), done in zip(self.reservations, written)
+        )
+        return unreserved + sum(written) + outstanding, outstanding
+
+    async def fits(self, directory: str, size: int, kept: Iterable[str] = ()) -> bool:
+        from app.config.scratch import scratch_budget, scratch_min_free_space
+
+        [budget, min_free_space] = await asyncio.gather(
+            scratch_budget(), scratch_min_free_space()
+        )
+        kept_size = files_size(kept)
+        # waiting would not help, as the job keeps its own files
+        if budget and kept_size + size > budget:
+            raise ScratchSpaceException(
+                f"{size} bytes of scratch space were requested next to {kept_size} bytes of the job's own files, but the budget (Scratch:Budget) is {budget} bytes."
+            )
+
+        used, outstanding = self.usage(directory, ignore=kept)
+        free = shutil.disk_usage(directory).free - outstanding
+        return (
+            not budget or used + kept_size + size <= budget
+        ) and free - size >= min_free_space
+
+    @asynccontextmanager
+    async def reserve(
+        self, prefix: str, size: int, keeps: Iterable[str] = ()
+    ) -> AsyncIterator[None]:
+        """Reserves `size` bytes for the files whose paths start with `prefix` while the
+        context is active. Waits until the space is available.
+
+        `keeps` are the job's files in the scratch directory that the stage still needs,
+        e.g. its input. The reservation takes them over, so they count against it instead
+        of holding it back as if they belonged to another job.
+        """
+        directory = os.path.dirname(prefix)
+        kept = [path for path in keeps if os.path.dirname(path) == directory]
+        async with self.queue:
+            waiting_since = None
+            while not await self.fits(directory, size, kept):
+                if waiting_since is None:
+                    waiting_since = time.monotonic()
+                    logging.info(
+                        f"Waiting for {size / 1_048_576:.1f} MiB of scratch space in '{directory}' for '{prefix}'."
+                    )
+                async with self.changed:
+                    try:
+                        await asyncio.wait_for(
+                            self.changed.wait(), SCRATCH_RECHECK_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+            if waiting_since is not None:
+                logging.info(
+                    f"Reserved {size / 1_048_576:.1f} MiB of scratch space for '{prefix}' after waiting {time.monotonic() - waiting_since:.1f}s."
+                )
+            reservation = ((prefix, *kept), files_size(kept) + size)
+            self.reservations.append(reservation)
+
+        try:
+            yield
+        finally:
+            self.reservations.remove(reservation)
+            async with self.changed:
+                self.changed.notify_all()
+
+
+scratch_spaces: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ScratchSpace]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_scratch_space() -> ScratchSpace:
+    # its lock and condition belong to the event loop they were created in
+    loop = asyncio.get_event_loop()
+    if loop not in scratch_spaces:
+        scratch_spaces[loop] = ScratchSpace()
+    return scratch_spaces[loop]
+
+
+def reserve_scratch(prefix: str, size: int, keeps: Iterable[str] = ()):
+    """See `ScratchSpace.reserve`."""
+    return get_scratch_space().reserve(prefix, size, keeps)
+
+
+async def get_scratch_directory(small: bool = False) -> str:
+    """The directory for scratch files. With `small`, e.g. for thumbnails, it is the RAM
+    backed `Scratch:RamDirectory` if there is one and it has room left."""
+    from app.config.scratch import (
+        scratch_directory,
+        scratch_ram_budget,
+        scratch_ram_directory,
+    )
+
+    [directory, ram_directory, ram_budget] = await asyncio.gather(
+        scratch_directory(), scratch_ram_directory(), scratch_ram_budget()
+    )
+    if small and ram_directory and directory_size(ram_directory) < ram_budget:
+        directory = ram_directory
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+async def sweep_scratch(keep: Callable[[str], bool]) -> int:
+    """Removes the files a crashed process left in the scratch directories, unless
+    `keep(path)` or they were modified in the last `ORPHAN_MIN_AGE` seconds. Returns how
+    many files were removed."""
+    from app.config.scratch import scratch_directory, scratch_ram_directory
+
+    directories: Iterable[str] = filter(
+        None, await asyncio.gather(scratch_directory(), scratch_ram_directory())
+    )
+    now = time.time()
+    removed = 0
+    freed = 0
+    for directory in directories:
+        for entry in list_files(directory):
+            stat = entry.stat()
+            if keep(entry.path) or now - stat.st_mtime < ORPHAN_MIN_AGE:
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                logging.warning(f"Could not remove orphaned file '{entry.path}': {e}")
+                continue
+            removed += 1
+            freed += stat.st_size
+    if removed:
+        logging.info(
+            f"Removed {removed} orphaned scratch file(s), freeing {freed / 1_048_576:.1f} MiB."
+        )
+    return removed
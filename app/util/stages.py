@@ -0,0 +1,224 @@
+import asyncio
+import io
+import os
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from datetime import timedelta
+from logging import getLogger
+from typing import Awaitable, Callable, DefaultDict, Dict, Optional, TypeVar
+
+logging = getLogger(__name__)
+
+T = TypeVar("T")
+
+# how often the progress of a running stage is logged
+PROGRESS_LOG_INTERVAL = 30.0
+
+
+class StageTimeout(Exception):
+    """A stage ran past its deadline or made no progress for too long, and was
+    cancelled."""
+
+
+class StageProgress:
+    """The progress a running stage reports with `report_progress`, e.g. the bytes
+    downloaded so far or the seconds of audio converted."""
+
+    def __init__(self, stage: str, name: str):
+        self.stage = stage
+        self.name = name
+        self.started_at = time.monotonic()
+        # only stages that report their progress can stall
+        self.reported = False
+        self.advanced_at = self.started_at
+        self.initial: Optional[float] = None
+        self.done = 0.0
+        self.total: Optional[float] = None
+        self.unit = ""
+        self.reported_speed: Optional[float] = None
+
+    def update(
+        self,
+        done: float,
+        total: Optional[float] = None,
+        unit: str = "",
+        speed: Optional[float] = None,
+    ):
+        if self.initial is None:
+            self.initial = done
+        if not self.reported or done > self.done:
+            self.advanced_at = time.monotonic()
+        self.reported = True
+        self.done = done
+        self.total = total if total is not None else self.total
+        self.unit = unit
+        self.reported_speed = speed
+
+    @property
+    def speed(self) -> Optional[float]:
+        """Units per second."""
+        if self.reported_speed is not None:
+            return self.reported_speed
+        elapsed = time.monotonic() - self.started_at
+        if self.initial is None or elapsed <= 0:
+            return None
+        return (self.done - self.initial) / elapsed
+
+    @property
+    def eta(self) -> Optional[float]:
+        speed = self.speed
+        if self.total is None or not speed:
+            return None
+        return max(0.0, (self.total - self.done) / speed)
+
+    def as_dict(self) -> dict:
+        return dict(
+            stage=self.stage,
+            name=self.name,
+            elapsed=time.monotonic() - self.started_at,
+            done=self.done,
+            total=self.total,
+            unit=self.unit,
+            speed=self.speed,
+            eta=self.eta,
+            since_progress=time.monotonic() - self.advanced_at,
+        )
+
+    def format(self, value: float) -> str:
+        if self.unit == "B":
+            return f"{value / 1_048_576:.1f} MiB"
+        return f"{value:.1f}{self.unit}"
+
+    def describe(self) -> str:
+        text = f"Stage '{self.stage}' of '{self.name}' is running for {timedelta(seconds=int(time.monotonic() - self.started_at))}"
+        if not self.reported:
+            return f"{text}."
+        if self.total:
+            text += f", {self.done / self.total:.0%} done ({self.format(self.done)} of {self.format(self.total)})"
+        else:
+            text += f", {self.format(self.done)} done"
+        speed, eta = self.speed, self.eta
+        if speed is not None:
+            text += f" at {self.format(speed)}/s"
+        if eta is not None:
+            text += f", ETA {timedelta(seconds=int(eta))}"
+        return f"{text}."
+
+
+# the stage the current task runs in, see `run_stage`
+current_stage: ContextVar[Optional[StageProgress]] = ContextVar(
+    "current_stage", default=None
+)
+running_stages: Dict[int, StageProgress] = {}
+stage_counts: DefaultDict[str, Counter] = defaultdict(Counter)
+
+
+def report_progress(
+    done: float,
+    total: Optional[float] = None,
+    unit: str = "",
+    speed: Optional[float] = None,
+):
+    """Reports the progress of the stage this runs in, if any."""
+    progress = current_stage.get()
+    if progress is not None:
+        progress.update(done, total, unit, speed)
+
+
+def get_stage_metrics() -> dict:
+    return dict(
+        running=[progress.as_dict() for progress in running_stages.values()],
+        counts={stage: dict(counts) for stage, counts in stage_counts.items()},
+    )
+
+
+async def run_stage(
+    stage: str,
+    name: str,
+    func: Callable[[], Awaitable[T]],
+    *,
+    deadline: float = 0,
+    stall_timeout: float = 0,
+) -> T:
+    """Runs `func` as the stage `stage` (e.g. "download") of the job `name`.
+
+    The stage is cancelled and `StageTimeout` is raised once it ran for longer than
+    `deadline` seconds, or once its reported progress (see `report_progress`) did not
+    advance for `stall_timeout` seconds. 0 disables either. Its progress is logged
+    every `PROGRESS_LOG_INTERVAL` seconds and exported through `get_stage_metrics`.
+    """
+    progress = StageProgress(stage, name)
+
+    async def run() -> T:
+        # the task runs in a copy of the context, so this does not leak out of it
+        current_stage.set(progress)
+        return await func()
+
+    work = asyncio.ensure_future(run())
+    running_stages[id(progress)] = progress
+    interval = min(
+        value
+        for value in [PROGRESS_LOG_INTERVAL, deadline / 10, stall_timeout / 4]
+        if value > 0
+    )
+    logged_at = progress.started_at
+    reason = outcome = None
+    try:
+        while reason is None:
+            await asyncio.wait([work], timeout=interval)
+            if work.done():
+                break
+
+            now = time.monotonic()
+            if deadline and now - progress.started_at > deadline:
+                reason = f"did not finish within {deadline:.0f}s"
+                outcome = "timed_out"
+            elif (
+                stall_timeout
+                and progress.reported
+                and now - progress.advanced_at > stall_timeout
+            ):
+                reason = f"made no progress for {stall_timeout:.0f}s"
+                outcome = "stalled"
+            elif now - logged_at >= PROGRESS_LOG_INTERVAL:
+                logging.info(progress.describe())
+                logged_at = now
+
+        if reason is not None:
+            stage_counts[stage][outcome] += 1
+            logging.warning(progress.describe())
+            raise StageTimeout(f"Stage '{stage}' of '{name}' {reason}. Cancelled it.")
+        try:
+            result = work.result()
+        except BaseException:
+            stage_counts[stage]["failed"] += 1
+            raise
+        stage_counts[stage]["completed"] += 1
+        return result
+    finally:
+        running_stages.pop(id(progress), None)
+        work.cancel()
+        await asyncio.gather(work, return_exceptions=True)
+
+
+class ProgressReader(io.BufferedReader):
+    """A file opened for reading that reports how much of it was read, e.g. by an
+    upload, as the progress of `progress`."""
+
+    def __init__(self, path: str, progress: Optional[StageProgress]):
+        super().__init__(io.FileIO(path, mode="rb"))
+        self.progress = progress
+        self.size = os.path.getsize(path)
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        data = super().read(size)
+        if self.progress is not None:
+            self.progress.update(self.tell(), self.size, "B")
+        return data
+
+
+def open_with_progress(path: str) -> ProgressReader:
+    """Opens `path` for reading on behalf of the current stage. Reads may happen on
+    another thread, which does not see the stage."""
+    return ProgressReader(path, current_stage.get())
@@ -1,92 +1,935 @@
+from __future__ import annotations
+
 import asyncio
+import itertools
+import json
 import pickle
+import random
+import time
+import uuid
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from logging import Logger, getLogger
-from typing import AsyncIterator, List
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from weakref import WeakKeyDictionary
 
-from hbmqtt.client import QOS_2, MQTTClient
+from hbmqtt.client import QOS_1, QOS_2, ConnectException, MQTTClient
 from hbmqtt.mqtt.publish import PublishPacket, PublishPayload
 from hbmqtt.session import ApplicationMessage
-from pafy.backend_youtube_dl import YtdlPafy
 
-from app.util import entrypoint
+from app.util import (
+    Config,
+    TokenBucket,
+    entrypoint,
+    get_local_broker,
+    get_worker_name,
+    notify_settings_changed,
+    on_settings_change,
+    set_ready,
+    set_settings_watched,
+    with_health_server,
+)
+
+if TYPE_CHECKING:
+    from pafy.backend_youtube_dl import YtdlPafy
 
 logging = getLogger(__name__)
 
 
+# delay before the second connection attempt. it doubles with every failed attempt.
+BROKER_CONNECT_BASE_DELAY = 0.25
+
+# upper bound of the event ids a consumer remembers, whatever the dedupe window
+DEDUPE_MAX_EVENTS = 10_000
+
+# the `deliver_message` call of every client that is still waiting for a message, see
+# `receive_message`
+pending_deliveries: "WeakKeyDictionary[MQTTClient, asyncio.Future]" = (
+    WeakKeyDictionary()
+)
+
+
+async def delivery_qos() -> int:
+    """The QoS of the bus messages, see the `MessageBrokerDelivery` setting."""
+    from app.config.core import message_broker_delivery
+
+    return QOS_1 if await message_broker_delivery() == "at_least_once" else QOS_2
+
+
+def encode_video_event(video: YtdlPafy, event_id: Optional[str] = None) -> bytes:
+    return pickle.dumps(
+        dict(
+            event_id=event_id or uuid.uuid4().hex,
+            video=video,
+            published_at=time.time(),
+        )
+    )
+
+
+def decode_video_event(data: bytes) -> dict:
+    """Returns the `event_id`, `video` and `published_at` of a video event."""
+    event = pickle.loads(data)
+    # e.g. retained messages of an older version are bare pickled videos without an id
+    if isinstance(event, dict) and "video" in event:
+        return dict(dict(event_id=None, published_at=None), **event)
+    return dict(event_id=None, video=event, published_at=None)
+
+
+class DedupeWindow:
+    """Remembers the event ids a consumer received in the last `window` seconds.
+
+    With QoS 1 the broker sends a message again until the consumer acknowledged it, so a
+    video can arrive twice. Redeliveries follow shortly after the original, so a window is
+    enough to drop them; anything older is caught by the handlers' posted history.
+    """
+
+    def __init__(self, window: float, max_events: int = DEDUPE_MAX_EVENTS):
+        self.window = window
+        self.max_events = max_events
+        self.seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def is_duplicate(self, event_id: Optional[str]) -> bool:
+        now = time.monotonic()
+        while self.seen and (
+            len(self.seen) >= self.max_events
+            or next(iter(self.seen.values())) <= now - self.window
+        ):
+            self.seen.popitem(last=False)
+
+        if event_id is None:
+            return False
+        if event_id in self.seen:
+            return True
+        self.seen[event_id] = now
+        return False
+
+
+class FlowControlledClient(MQTTClient):
+    """An `MQTTClient` that holds at most `in_flight` received messages the application
+    has not taken with `deliver_message` yet.
+
+    hbmqtt acknowledges a QoS 1 or 2 message once it is queued for delivery. While the
+    queue is full, the acknowledgements wait, so the broker stops sending once its in-flight
+    window is used up and keeps the rest of the backlog (in a persistent session) instead of
+    the consumer holding all of it in memory.
+    """
+
+    def __init__(self, in_flight: int, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = in_flight
+
+    def _initsession(self, *args, **kwargs):
+        session = super()._initsession(*args, **kwargs)
+        session.delivered_message_queue = asyncio.Queue(maxsize=self.in_flight)
+        return session
+
+
+def consumer_client_id(topic: str, worker: Optional[str] = None) -> str:
+    # stable across restarts, so the broker finds the consumer's persistent session again
+    client_id = "consumer-" + topic.replace("/", "-")
+    return f"{client_id}-{worker}" if worker else client_id
+
+
+def shared_topic(topic: str) -> str:
+    # the workers of one consumer form a group, and each message goes to one of them
+    return f"$share/{topic.replace('/', '-')}/{topic}"
+
+
+async def connect_to_broker(
+    message_broker: str,
+    max_delay: float,
+    client_id: Optional[str] = None,
+    clean_session: bool = True,
+    in_flight: Optional[int] = None,
+    will: Optional[dict] = None,
+) -> MQTTClient:
+    attempt = 0
+    while True:
+        config = dict(keep_alive=240, cleansession=clean_session)
+        if will is not None:
+            config["will"] = will
+        client = (
+            FlowControlledClient(in_flight, client_id=client_id, config=config)
+            if in_flight is not None
+            else MQTTClient(client_id=client_id, config=config)
+        )
+        logging.debug(f"Connecting to message broker at '{message_broker}'")
+        try:
+            await client.connect(message_broker, cleansession=clean_session)
+        except (ConnectException, OSError) as e:
+            attempt += 1
+            delay = backoff_delay(attempt, BROKER_CONNECT_BASE_DELAY, max_delay)
+            logging.warning(
+                f"Could not connect to message broker at '{message_broker}' (attempt {attempt}): {e}. Retrying in {delay:.2f}s."
+            )
+            await asyncio.sleep(delay)
+        else:
+            logging.debug(f"Connected to message broker at '{message_broker}'")
+            return client
+
+
 @asynccontextmanager
-async def create_client():
-    from app.config.core import message_broker
+async def create_client(
+    client_id: Optional[str] = None,
+    clean_session: bool = True,
+    in_flight: Optional[int] = None,
+    will_topic: Optional[str] = None,
+):
+    """Connects to the message broker. Without `clean_session`, the broker keeps the
+    subscriptions of `client_id` and queues their messages while it is disconnected, and
+    `in_flight` limits the received messages that are not delivered yet. If the connection
+    drops without a disconnect (e.g. the process is killed), the broker clears the
+    retained message of `will_topic`."""
+    from app.config.core import message_broker, message_broker_max_connect_delay
 
-    message_broker = await message_broker()
+    local_broker = get_local_broker()
+    if local_broker is not None:
+        client = local_broker.client(client_id if not clean_session else None)
+        set_ready("broker")
+        try:
+            yield client
+        finally:
+            cancel_delivery(client)
+            await client.disconnect()
+        return
+
+    set_ready("broker", False)
+    [message_broker, max_delay] = await asyncio.gather(
+        message_broker(), message_broker_max_connect_delay()
+    )
+    will = (
+        dict(retain=True, topic=will_topic, message=b"", qos=await delivery_qos())
+        if will_topic is not None
+        else None
+    )
+    client = await connect_to_broker(
+        message_broker, max_delay, client_id, clean_session, in_flight, will
+    )
+    set_ready("broker")
     try:
-        client = MQTTClient(config=dict(keep_alive=240))
-        logging.debug(f"Connecting to message broker at '{message_broker}'")
-        await client.connect(message_broker)
-        logging.debug(f"Connected to message broker at '{message_broker}'")
         yield client
     finally:
+        set_ready("broker", False)
+        cancel_delivery(client)
         logging.debug(f"Disconnecting from message broker at '{message_broker}'")
         await client.disconnect()
         logging.debug(f"Disconnected from message broker at '{message_broker}'")
 
 
+async def receive_message(
+    client: MQTTClient, stops: Optional[List[asyncio.Future]] = None
+) -> Optional[ApplicationMessage]:
+    """Waits for the next message of `client`, or returns None once one of `stops` is done.
+
+    hbmqtt's `deliver_message` takes the message off the client's queue in a task of its
+    own, which keeps running when the call is cancelled and then drops the message it took
+    (the broker already got its acknowledgement). So a delivery that is left waiting here
+    is picked up again by the next call for the same client instead.
+    """
+    delivery = pending_deliveries.get(client)
+    if delivery is None:
+        delivery = asyncio.ensure_future(client.deliver_message())
+        pending_deliveries[client] = delivery
+    await asyncio.wait([delivery, *(stops or [])], return_when=asyncio.FIRST_COMPLETED)
+    if not delivery.done():
+        return None
+    del pending_deliveries[client]
+    return delivery.result()
+
+
+def cancel_delivery(client: MQTTClient):
+    # the client disconnects, so its queue is gone anyway
+    delivery = pending_deliveries.pop(client, None)
+    if delivery is not None:
+        delivery.cancel()
+
+
 @asynccontextmanager
-async def subscribe_to_topic(client: MQTTClient, topic: str):
+async def subscribe_to_topic(client: MQTTClient, topic: str, keep: bool = False):
+    """Subscribes to `topic` for the duration of the context. With `keep`, the
+    subscription stays in place afterwards, so a persistent session queues the messages
+    until the next subscriber of the same client id."""
     try:
         logging.debug(f"Subscribing to the following MQTT topic: '{topic}'")
-        await client.subscribe([(topic, QOS_2)])
+        await client.subscribe([(topic, await delivery_qos())])
         logging.debug(f"Subscribed to the following MQTT topic: '{topic}'")
         yield client
     finally:
-        logging.debug(f"Unsubscribing to the following MQTT topic: '{topic}'")
-        await client.unsubscribe([topic])  # do not need the QOS for unsub
-        logging.debug(f"Unsubscribed to the following MQTT topic: '{topic}'")
+        if not keep:
+            logging.debug(f"Unsubscribing to the following MQTT topic: '{topic}'")
+            await client.unsubscribe([topic])  # do not need the QOS for unsub
+            logging.debug(f"Unsubscribed to the following MQTT topic: '{topic}'")
+
+
+def retry_topic(topic: str, id: str) -> str:
+    return f"retry/{topic}/{id}"
+
+
+def dead_letter_topic(topic: str, id: str) -> str:
+    return f"dead_letter/{topic}/{id}"
+
+
+def ready_topic(topic: str) -> str:
+    return f"ready/{topic}"
+
+
+def lag_topic(topic: str) -> str:
+    return f"lag/{topic}"
+
+
+async def wait_for_consumers(
+    client: MQTTClient, topics: List[str], timeout: float
+) -> List[str]:
+    """Waits until every topic in `topics` has a subscribed consumer.
+
+    Consumers announce their subscription with a retained message on `ready_topic`, so
+    this returns right away if they are already running. Returns the topics that still
+    have no consumer after `timeout` seconds.
+    """
+    missing = set(topics)
+    subscriptions = [ready_topic(topic) for topic in topics]
+    deadline = time.monotonic() + timeout
+    qos = await delivery_qos()
+    await client.subscribe([(topic, qos) for topic in subscriptions])
+    try:
+        while missing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = await client.deliver_message(timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+
+            topic = message.topic[len(ready_topic("")) :]
+            if message.publish_packet.payload.data:
+                missing.discard(topic)
+            else:
+                missing.add(topic)
+    finally:
+        await client.unsubscribe(subscriptions)
+    return sorted(missing)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # exponential backoff with "equal jitter": at least half of the delay is always kept
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryScheduler:
+    """Re-queues failed videos on per-video retained topics under `retry/<topic>/`.
+
+    Retry messages are retained, so the schedule survives restarts of the consumer. Each
+    retry waits for its due time in its own task, which keeps it off the live message loop,
+    and retries are rate limited by a token bucket so an outage does not turn into a storm
+    once the destination comes back. After `Retry:MaxAttempts` failed attempts the video is
+    parked (retained) under `dead_letter/<topic>/` until it is replayed.
+
+    With a `worker` name, the retries live under `retry/<topic>/<worker>/`, so the workers
+    sharing a subscription only retry their own failures.
+    """
+
+    def __init__(
+        self,
+        client: MQTTClient,
+        topic: str,
+        process: Callable[[YtdlPafy], Awaitable[Optional[Exception]]],
+        *,
+        rate_per_minute: float,
+        concurrency: int,
+        worker: Optional[str] = None,
+    ):
+        self.client = client
+        self.topic = topic
+        self.retry_prefix = f"{topic}/{worker}" if worker else topic
+        self.process = process
+        self.bucket = TokenBucket(rate_per_minute / 60.0)
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.waiting: Dict[str, asyncio.Task] = {}
+
+    @property
+    def subscription(self) -> str:
+        return f"retry/{self.retry_prefix}/#"
+
+    def owns(self, topic: str) -> bool:
+        return topic.startswith(f"retry/{self.retry_prefix}/")
+
+    async def retry(self, video: YtdlPafy, attempt: int, error: BaseException):
+        from app.config.retry import (
+            retry_base_delay,
+            retry_max_attempts,
+            retry_max_delay,
+        )
+
+        [max_attempts, base_delay, max_delay] = await asyncio.gather(
+            retry_max_attempts(), retry_base_delay(), retry_max_delay()
+        )
+
+        if attempt >= max_attempts:
+            logging.error(
+                f"Processing video '{video.title}' failed {attempt} times. Moving it to the dead letter topic '{dead_letter_topic(self.topic, video.videoid)}'."
+            )
+            await self.client.publish(
+                dead_letter_topic(self.topic, video.videoid),
+                pickle.dumps(
+                    dict(
+                        video=video,
+                        topic=self.topic,
+                        attempt=attempt,
+                        error=repr(error),
+                    )
+                ),
+                qos=await delivery_qos(),
+                retain=True,
+            )
+            await self.clear(video.videoid)
+            return
 
+        delay = backoff_delay(attempt, base_delay, max_delay)
+        logging.warning(
+            f"Processing video '{video.title}' failed (attempt {attempt}/{max_attempts}). Retrying in {delay:.1f}s."
+        )
+        await self.client.publish(
+            retry_topic(self.retry_prefix, video.videoid),
+            pickle.dumps(
+                dict(
+                    video=video,
+                    topic=self.topic,
+                    attempt=attempt,
+                    not_before=time.time() + delay,
+                    error=repr(error),
+                )
+            ),
+            qos=await delivery_qos(),
+            retain=True,
+        )
+
+    async def clear(self, id: str):
+        # an empty retained message removes the retained retry from the broker
+        await self.client.publish(
+            retry_topic(self.retry_prefix, id),
+            b"",
+            qos=await delivery_qos(),
+            retain=True,
+        )
+
+    def cancel_waiting(self):
+        for task in self.waiting.values():
+            task.cancel()
+        self.waiting.clear()
+
+    def schedule(self, message_topic: str, data: bytes):
+        previous = self.waiting.pop(message_topic, None)
+        if previous is not None:
+            previous.cancel()
+        if not data:
+            return
+
+        self.waiting[message_topic] = asyncio.ensure_future(
+            self._run(message_topic, pickle.loads(data))
+        )
+
+    async def _run(self, message_topic: str, entry: dict):
+        video: YtdlPafy = entry["video"]
+        await asyncio.sleep(max(0.0, entry["not_before"] - time.time()))
+        await self.bucket.acquire()
+        async with self.semaphore:
+            # from here on, a new retry message for this video must not cancel the attempt
+            if self.waiting.get(message_topic) is asyncio.current_task():
+                del self.waiting[message_topic]
+
+            logging.info(
+                f"Retrying video '{video.title}' (attempt {entry['attempt'] + 1})."
+            )
+            error = await self.process(video)
+            if error is None:
+                await self.clear(video.videoid)
+            else:
+                await self.retry(video, entry["attempt"] + 1, error)
+
+
+def new_video_event_handler(
+    topic: str,
+    *,
+    logger: Logger,
+    delay=5.0,
+    init=None,
+    enabled: Optional[Config] = None,
+    reinit_on: Optional[List[str]] = None,
+    concurrency: Union[int, Config] = 1,
+    shared: Optional[Config] = None,
+    resume: Optional[Callable[[], Awaitable[List[YtdlPafy]]]] = None,
+):
+    """Turns `original_func` into a consumer of `topic`.
+
+    While the `enabled` setting is false, the consumer unsubscribes from its topics and
+    parks until the setting changes, so it receives and deserializes nothing. When a
+    setting under one of the `reinit_on` key paths changes (e.g. credentials), `init`
+    runs again after the current message. Up to `concurrency` videos (a number or a
+    setting) are processed at the same time.
+
+    While the `shared` setting is true, several workers (replicas) of the consumer share
+    the subscription and each video goes to one of them. `original_func` still has to make
+    sure a video is not processed twice, e.g. with `run_with_lease`.
+
+    `resume` returns the videos whose processing was interrupted, e.g. by a restart. After
+    the first `init`, they take turns with the new videos and go to the retries when they
+    fail, like a video taken off the broker.
+
+    The decorated function gets a `consume` coroutine function that runs the consumer.
+    Use `run_event_handler` to run it as the entrypoint of a service.
+    """
 
-def new_video_event_handler(topic: str, *, logger: Logger, delay=5.0, init=None):
     def decorator(original_func):
-        async def main():
-            kwargs = {}
-            if init is not None:
-                kwargs = await init()
+        async def consume(worker: Optional[str] = None):
+            from app.config.core import (
+                message_broker_dedupe_window,
+                message_broker_heartbeat_interval,
+                message_broker_persistent_sessions,
+            )
+            from app.config.retry import retry_concurrency, retry_rate_per_minute
+
+            set_ready("consumer", False)
+            # `init` runs once the consumer is first enabled, so e.g. a disabled PodBean
+            # service does not ask for authorization
+            kwargs: Optional[dict] = None
+            # the videos of interrupted jobs, loaded once
+            resuming: Optional[List[YtdlPafy]] = None
+            reinit = asyncio.Event()
+            if reinit_on:
+                on_settings_change(reinit_on, lambda changed: reinit.set())
+
+            async def process(video: YtdlPafy) -> Optional[Exception]:
+                logging.info(f"Processing video '{video.title}'")
+                try:
+                    await original_func(video, **kwargs)
+                except asyncio.CancelledError:
+                    # the consumer is stopping, which is not a failure of the video
+                    raise
+                except Exception as e:
+                    logging.exception(
+                        f"Got an exception of type '{type(e)}' while processing video '{video.title}'",
+                        exc_info=e,
+                    )
+                    return e
+                else:
+                    logging.info(
+                        f"Successfully finished processing video '{video.title}'"
+                    )
+                    return None
 
-            async with create_client() as client:
-                async with subscribe_to_topic(client, topic):
+            [
+                rate_per_minute,
+                retries_concurrency,
+                window,
+                persistent,
+                heartbeat_interval,
+            ] = await asyncio.gather(
+                retry_rate_per_minute(),
+                retry_concurrency(),
+                message_broker_dedupe_window(),
+                message_broker_persistent_sessions(),
+                message_broker_heartbeat_interval(),
+            )
+            if shared is not None and await shared():
+                worker = worker or get_worker_name()
+                subscription = shared_topic(topic)
+            else:
+                worker = None
+                subscription = topic
+            # kept across re-subscriptions, which is when a QoS 1 broker redelivers
+            received = DedupeWindow(window)
+            limit = max(
+                1,
+                (
+                    await concurrency()
+                    if isinstance(concurrency, Config)
+                    else concurrency
+                ),
+            )
+            semaphore = asyncio.Semaphore(limit)
+            # publish time of every video taken off the broker and not finished yet
+            in_flight: Dict[int, float] = {}
+            numbers = itertools.count()
+            handlers: Set[asyncio.Future] = set()
+
+            async def handle(retries: RetryScheduler, video: YtdlPafy, number: int):
+                try:
+                    error = await process(video)
+                    if error is not None:
+                        await retries.retry(video, 1, error)
+                finally:
+                    in_flight.pop(number, None)
+                    semaphore.release()
+
+            def start(retries: RetryScheduler, video: YtdlPafy, published_at: float):
+                # the caller acquired the semaphore
+                number = next(numbers)
+                in_flight[number] = published_at
+                handler = asyncio.ensure_future(handle(retries, video, number))
+                handlers.add(handler)
+                handler.add_done_callback(handlers.discard)
+
+            async def feed(retries: RetryScheduler):
+                while resuming:
+                    await semaphore.acquire()
+                    start(retries, resuming.pop(0), time.time())
+
+            async def receive(client: MQTTClient, retries: RetryScheduler):
+                # returns once the consumer is disabled or has to run `init` again,
+                # after the videos in progress
+                stops = [asyncio.ensure_future(reinit.wait())]
+                if enabled is not None:
+                    stops.append(asyncio.ensure_future(enabled.wait_for(False)))
+                # the rest is resumed after the next `init`
+                feeder = asyncio.ensure_future(feed(retries))
+                try:
                     while True:
-                        message: ApplicationMessage = await client.deliver_message()
+                        message = await receive_message(client, stops)
+                        if message is None:
+                            feeder.cancel()
+                            # they still use the kwargs of the previous `init`
+                            if handlers:
+                                await asyncio.wait(handlers)
+                            return
+
                         logging.debug(
                             f"Received a new message from MQTT topic '{message.topic}'"
                         )
                         packet: PublishPacket = message.publish_packet
-                        if packet:
-                            payload: PublishPayload = packet.payload
-                            video: YtdlPafy = pickle.loads(payload.data)
-                            logging.info(f"Processing video '{video.title}'")
-                            try:
-                                await original_func(video, **kwargs)
-                            except BaseException as e:
-                                logging.exception(
-                                    f"Got an exception of type '{type(e)}' while processing video '{video.title}'",
-                                    exc_info=e,
-                                )
-                            else:
-                                logging.info(
-                                    f"Successfully finished processing video '{video.title}'"
-                                )
-
-        entrypoint(main, logger=logger)
+                        if not packet:
+                            continue
+
+                        payload: PublishPayload = packet.payload
+                        if retries.owns(message.topic):
+                            retries.schedule(message.topic, payload.data)
+                            continue
+
+                        event = decode_video_event(payload.data)
+                        video: YtdlPafy = event["video"]
+                        if received.is_duplicate(event["event_id"]):
+                            logging.info(
+                                f"Video '{video.title}' was delivered again (event '{event['event_id']}'). Ignoring."
+                            )
+                            continue
+                        # waits for a free slot before taking the next message
+                        await semaphore.acquire()
+                        start(retries, video, event["published_at"] or time.time())
+                finally:
+                    feeder.cancel()
+                    for stop in stops:
+                        stop.cancel()
+
+            async with create_client(
+                consumer_client_id(topic, worker),
+                clean_session=not persistent,
+                in_flight=limit,
+                # withdraws the announcement of a consumer that died without a disconnect
+                will_topic=ready_topic(topic),
+            ) as client:
+                retries = RetryScheduler(
+                    client,
+                    topic,
+                    process,
+                    rate_per_minute=rate_per_minute,
+                    concurrency=retries_concurrency,
+                    worker=worker,
+                )
+                while True:
+                    if enabled is not None and not await enabled():
+                        # while unsubscribed, the broker does not send (or queue) anything
+                        if persistent:
+                            await client.unsubscribe(
+                                [subscription, retries.subscription]
+                            )
+                        logging.info(
+                            f"The consumer of '{topic}' is disabled. Unsubscribed until it is enabled again."
+                        )
+                        async with announce_consumer(client, topic):
+                            await enabled.wait_for(True)
+                        logging.info(
+                            f"The consumer of '{topic}' is enabled again. Subscribing."
+                        )
+
+                    if reinit.is_set():
+                        logging.info(
+                            f"Settings under {reinit_on} changed. Initializing the consumer of '{topic}' again."
+                        )
+                        reinit.clear()
+                        kwargs = None
+                    if kwargs is None:
+                        kwargs = await init() if init is not None else {}
+                    if resuming is None:
+                        resuming = await resume() if resume is not None else []
+
+                    # a persistent session keeps the subscriptions while the consumer
+                    # runs `init` again or restarts, so no video is lost in between
+                    async with subscribe_to_topic(
+                        client, subscription, keep=persistent
+                    ), subscribe_to_topic(
+                        client, retries.subscription, keep=persistent
+                    ), announce_consumer(
+                        client, topic
+                    ), report_lag(
+                        client, topic, limit, in_flight, heartbeat_interval
+                    ):
+                        await receive(client, retries)
+                    # the retained retries are delivered again after subscribing
+                    retries.cancel_waiting()
+
+        original_func.consume = consume
+        original_func.logger = logger
         return original_func
 
     return decorator
 
 
-async def send_video(client: MQTTClient, video: YtdlPafy, topics: List[str]):
-    video_bytes = pickle.dumps(video)
+@asynccontextmanager
+async def announce_consumer(client: MQTTClient, topic: str):
+    await client.publish(
+        ready_topic(topic), b"1", qos=await delivery_qos(), retain=True
+    )
+    set_ready("consumer")
+    try:
+        yield
+    finally:
+        set_ready("consumer", False)
+        try:
+            await client.publish(
+                ready_topic(topic), b"", qos=await delivery_qos(), retain=True
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(
+                f"Could not withdraw the consumer announcement of '{topic}': {e}"
+            )
+
+
+@asynccontextmanager
+async def report_lag(
+    client: MQTTClient,
+    topic: str,
+    limit: int,
+    in_flight: Dict[int, float],
+    interval: float,
+):
+    """Publishes a retained heartbeat of the consumer on `lag_topic` every `interval`
+    seconds: {"limit": 8, "in_flight": 3, "lag": 12.5, "interval": 15, "time": ...}.
+
+    `in_flight` maps the videos the consumer took but did not finish to the time they
+    were published, and `lag` is the age of the oldest of them.
+    """
+
+    async def heartbeat():
+        while True:
+            now = time.time()
+            status = dict(
+                limit=limit,
+                in_flight=len(in_flight),
+                lag=max(
+                    (now - published for published in in_flight.values()), default=0.0
+                ),
+                interval=interval,
+                time=now,
+            )
+            try:
+                await client.publish(
+                    lag_topic(topic),
+                    json.dumps(status).encode(),
+                    qos=await delivery_qos(),
+                    retain=True,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(
+                    f"Could not report the lag of the consumer of '{topic}': {e}"
+                )
+            await asyncio.sleep(interval)
+
+    task = asyncio.ensure_future(heartbeat())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+@asynccontextmanager
+async def watch_consumer_lag(client: MQTTClient, topics: List[str]):
+    """Yields a function that returns the latest heartbeat of each consumer of `topics`,
+    see `report_lag`. Heartbeats older than three intervals are left out, since their
+    consumer is not running (or disabled).
+
+    `client` must not be used to receive other messages in the meantime.
+    """
+    statuses: Dict[str, dict] = {}
+    prefix = lag_topic("")
+
+    def parse(data: bytes) -> Optional[dict]:
+        try:
+            status = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(status, dict) or not {"time", "interval"} <= status.keys():
+            return None
+        return status
+
+    async def receive():
+        while True:
+            # cancelled with the context, which leaves a pending delivery to the next
+            # receiver of the client
+            message = await receive_message(client)
+            # e.g. an announcement that arrived after `wait_for_consumers` returned
+            if not message.topic.startswith(prefix):
+                continue
+            data = message.publish_packet.payload.data
+            topic = message.topic[len(prefix) :]
+            if not data:
+                statuses.pop(topic, None)
+                continue
+            status = parse(data)
+            if status is None:
+                logging.warning(f"Ignoring a malformed heartbeat on '{message.topic}'.")
+                continue
+            statuses[topic] = status
+
+    def current() -> Dict[str, dict]:
+        now = time.time()
+        return {
+            topic: status
+            for topic, status in statuses.items()
+            if now - status["time"] <= 3 * status["interval"]
+        }
+
+    qos = await delivery_qos()
+    subscriptions = [lag_topic(topic) for topic in topics]
+    await client.subscribe([(topic, qos) for topic in subscriptions])
+    task = asyncio.ensure_future(receive())
+    try:
+        yield current
+    finally:
+        task.cancel()
+        await client.unsubscribe(subscriptions)
+
+
+# retained JSON notification of the latest settings change, published by the settings
+# service: {"version": 3, "hash": "<sha256 of the settings>", "changed": ["YouTube:Enabled"]}
+settings_topic = "config/settings"
+
+
+async def read_retained(
+    client: MQTTClient, topic: str, timeout: float = 1.0
+) -> Optional[bytes]:
+    async with subscribe_to_topic(client, topic):
+        try:
+            message = await client.deliver_message(timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        return message.publish_packet.payload.data or None
+
+
+async def watch_settings():
+    """Applies the change notifications of `settings_topic` to this process' settings.
+
+    Once the first notification arrived, settings are read from memory until the next one
+    (or until the broker connection is lost), and the `on_settings_change` listeners are
+    called with the changed key paths.
+    """
+    from app.config.core import message_broker_max_connect_delay
+
+    version: Optional[int] = None
+    attempt = 0
+    while True:
+        try:
+            async with create_client() as client, subscribe_to_topic(
+                client, settings_topic
+            ):
+                attempt = 0
+                while True:
+                    message: ApplicationMessage = await client.deliver_message()
+                    data = message.publish_packet.payload.data
+                    if not data:
+                        continue
+
+                    notification = json.loads(data)
+                    if notification["version"] == version:
+                        set_settings_watched(True)
+                        continue
+
+                    logging.info(
+                        f"Settings changed (version {notification['version']}): {notification['changed']}"
+                    )
+                    # without the previous version, the changes in between are unknown
+                    known = (
+                        version is not None and notification["version"] == version + 1
+                    )
+                    notify_settings_changed(
+                        notification["changed"] if known else None,
+                        call_listeners=version is not None,
+                    )
+                    version = notification["version"]
+                    set_settings_watched(True)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            attempt += 1
+            delay = backoff_delay(
+                attempt,
+                BROKER_CONNECT_BASE_DELAY,
+                await message_broker_max_connect_delay(),
+            )
+            logging.warning(
+                f"Lost the settings change notifications ({e}). Reading the settings file directly and reconnecting in {delay:.2f}s."
+            )
+            await asyncio.sleep(delay)
+        finally:
+            set_settings_watched(False)
+
+
+def with_settings_watch(f: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    async def wrapper():
+        watcher = asyncio.ensure_future(watch_settings())
+        try:
+            return await f()
+        finally:
+            watcher.cancel()
+
+    return wrapper
+
+
+def run_event_handler(handler):
+    return entrypoint(
+        with_health_server(with_settings_watch(handler.consume)),
+        logger=handler.logger,
+    )
+
+
+async def send_video(
+    client: MQTTClient,
+    video: YtdlPafy,
+    topics: List[str],
+    event_id: Optional[str] = None,
+):
+    # every topic gets the same event id, each consumer dedupes its own deliveries
+    event_bytes = encode_video_event(video, event_id)
+    qos = await delivery_qos()
     logging.debug(f"Sending video '{video.title}' to the following topics: '{topics}'")
     await asyncio.gather(
         *(
-            asyncio.ensure_future(client.publish(topic, video_bytes, qos=QOS_2))
+            asyncio.ensure_future(client.publish(topic, event_bytes, qos=qos))
             for topic in topics
         )
     )
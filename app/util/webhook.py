@@ -0,0 +1,159 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .http import get_session
+
+logging = getLogger(__name__)
+
+WEBHOOK_REQUEST_TIMEOUT = 30.0
+
+
+class WebhookException(Exception):
+    pass
+
+
+class RateLimitBucket:
+    """Discord's rate limit state of one webhook. Messages to it are sent one at a time and
+    in order, so while the bucket is exhausted they queue instead of failing."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_after is not None:
+            self.reset_at = time.monotonic() + float(reset_after)
+
+    def exhaust(self, retry_after: float):
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + retry_after)
+
+    async def wait(self):
+        delay = self.reset_at - time.monotonic()
+        if self.remaining == 0 and delay > 0:
+            await asyncio.sleep(delay)
+
+
+_buckets: Dict[str, RateLimitBucket] = {}
+_buckets_loop: Optional[asyncio.AbstractEventLoop] = None
+# set by a 429 with "global": true, which applies to every webhook
+_global_reset_at = 0.0
+
+
+def get_bucket(url: str) -> RateLimitBucket:
+    global _buckets_loop
+
+    # the buckets' locks are bound to the event loop they were created in
+    if _buckets_loop is not asyncio.get_event_loop():
+        _buckets.clear()
+        _buckets_loop = asyncio.get_event_loop()
+    if url not in _buckets:
+        _buckets[url] = RateLimitBucket()
+    return _buckets[url]
+
+
+async def get_retry_after(response: aiohttp.ClientResponse) -> Tuple[float, bool]:
+    try:
+        body = await response.json(content_type=None)
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        body = {}
+    # the header is always in seconds, unlike "retry_after" in older API versions
+    retry_after = response.headers.get("Retry-After") or response.headers.get(
+        "X-RateLimit-Reset-After"
+    )
+    if retry_after is None:
+        retry_after = body.get("retry_after", 1.0)
+    is_global = bool(body.get("global")) or "X-RateLimit-Global" in response.headers
+    return float(retry_after), is_global
+
+
+async def execute_webhook(
+    url: str,
+    payload: dict,
+    max_attempts: int = 5,
+    limit: Optional[asyncio.Semaphore] = None,
+):
+    """Sends `payload` to the Discord webhook at `url` through the shared HTTP session.
+
+    Waits while the webhook's rate limit bucket (or the global rate limit) is exhausted
+    and retries rate limited (429), failed (5xx) and timed out requests up to
+    `max_attempts` times. Only the requests themselves count against `limit`."""
+
+    global _global_reset_at
+
+    limit = limit or asyncio.Semaphore()
+    bucket = get_bucket(url)
+    async with bucket.lock:
+        for attempt in range(1, max_attempts + 1):
+            await bucket.wait()
+            delay = _global_reset_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                async with limit:
+                    async with get_session().post(
+                        url,
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=WEBHOOK_REQUEST_TIMEOUT),
+                    ) as response:
+                        bucket.update(response.headers)
+                        if response.status == 429:
+                            retry_after, is_global = await get_retry_after(response)
+                            logging.warning(
+                                f"Discord webhook is rate limited{' globally' if is_global else ''} for {retry_after:.2f}s (attempt {attempt} of {max_attempts})."
+                            )
+                            if is_global:
+                                _global_reset_at = max(
+                                    _global_reset_at, time.monotonic() + retry_after
+                                )
+                            else:
+                                bucket.exhaust(retry_after)
+                            continue
+                        if response.status < 500:
+                            if response.status >= 400:
+                                raise WebhookException(
+                                    f"Discord webhook rejected the message with status {response.status}: {await response.text()}"
+                                )
+                            return
+                        error = f"status {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            logging.warning(
+                f"Could not send the Discord webhook message ({error}, attempt {attempt} of {max_attempts})."
+            )
+            if attempt < max_attempts:
+                await asyncio.sleep(min(2 ** (attempt - 1), 30))
+
+    raise WebhookException(
+        f"Could not send the Discord webhook message after {max_attempts} attempts."
+    )
+
+
+async def execute_webhooks(
+    messages: List[Tuple[str, dict]], concurrency: int = 8, max_attempts: int = 5
+) -> List[Optional[BaseException]]:
+    """Sends every `(url, payload)` in `messages`, at most `concurrency` requests at a
+    time and in order per webhook. Returns the exception each message failed with, or
+    None."""
+
+    limit = asyncio.Semaphore(max(1, int(concurrency)))
+    return await asyncio.gather(
+        *(
+            execute_webhook(url, payload, max_attempts, limit)
+            for url, payload in messages
+        ),
+        return_exceptions=True,
+    )
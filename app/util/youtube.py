@@ -1,12 +1,18 @@
 from logging import getLogger
 
-import aiohttp
-import pafy
+from app.util.http import get_session
 
 logging = getLogger(__name__)
 
 
+def get_playlist_id_for_channel_id(channel_id: str) -> str:
+    # in YouTube, taking a channel ID and changing the second letter from "C" to "U" gives you a playlist with all that channel's uploads
+    return f"{channel_id[:1]}U{channel_id[2:]}" if channel_id[1] == "C" else channel_id
+
+
 async def get_avatar(username_or_channel_id: str) -> str:
+    import pafy.g
+
     try:
         # if a channel does not have a proper username, `username_or_channel_id` will include the channel id
         username = None
@@ -27,21 +33,20 @@ async def get_avatar(username_or_channel_id: str) -> str:
             "Trying to get avatar for YouTube channel with "
             + (f"channel id '{channel_id}'" if channel_id else f"username '{username}'")
         )
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url="https://www.googleapis.com/youtube/v3/channels",
-                params=dict(
-                    part="snippet",
-                    fields="items/snippet/thumbnails/default",
-                    key=pafy.g.api_key,
-                    **channel_info,
-                ),
-            ) as response:
-                logging.debug(
-                    f"Got the following response while trying to get avatar for user '{username_or_channel_id}': '{await response.text()}'"
-                )
-                json = await response.json()
-                return json["items"][0]["snippet"]["thumbnails"]["default"]["url"]
+        async with get_session().get(
+            url="https://www.googleapis.com/youtube/v3/channels",
+            params=dict(
+                part="snippet",
+                fields="items/snippet/thumbnails/default",
+                key=pafy.g.api_key,
+                **channel_info,
+            ),
+        ) as response:
+            logging.debug(
+                f"Got the following response while trying to get avatar for user '{username_or_channel_id}': '{await response.text()}'"
+            )
+            json = await response.json()
+            return json["items"][0]["snippet"]["thumbnails"]["default"]["url"]
     except BaseException as e:
         from app.config.youtube import youtube_default_avatar
 
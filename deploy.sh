@@ -22,6 +22,11 @@ docker tag "$DOCKER_USERNAME/youtube2podbean-wordpress:$TRAVIS_TAG" "$DOCKER_USE
 docker push $DOCKER_USERNAME/youtube2podbean-wordpress:$TRAVIS_TAG
 docker push $DOCKER_USERNAME/youtube2podbean-wordpress:latest
 
+docker build --rm -f "services/settings.Dockerfile" -t "$DOCKER_USERNAME/youtube2podbean-settings:$TRAVIS_TAG" --build-arg BASE_VERSION=$TRAVIS_TAG ..
+docker tag "$DOCKER_USERNAME/youtube2podbean-settings:$TRAVIS_TAG" "$DOCKER_USERNAME/youtube2podbean-settings:latest"
+docker push $DOCKER_USERNAME/youtube2podbean-settings:$TRAVIS_TAG
+docker push $DOCKER_USERNAME/youtube2podbean-settings:latest
+
 docker build --rm -f "services/youtube.Dockerfile" -t "$DOCKER_USERNAME/youtube2podbean-youtube:$TRAVIS_TAG" --build-arg BASE_VERSION=$TRAVIS_TAG ..
 docker tag "$DOCKER_USERNAME/youtube2podbean-youtube:$TRAVIS_TAG" "$DOCKER_USERNAME/youtube2podbean-youtube:latest"
 docker push $DOCKER_USERNAME/youtube2podbean-youtube:$TRAVIS_TAG
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from measure_memory import read_rss_kib
+
+services = ["settings", "youtube", "podbean", "discord", "wordpress"]
+destinations = ["podbean", "discord", "wordpress"]
+
+
+def record(destination: str, video):
+    now = time.time()
+    line = json.dumps(
+        dict(
+            destination=destination,
+            videoid=video.videoid,
+            sent=now - video.sent_at,
+            uploaded=now - video.uploaded_at,
+        )
+    )
+    # a single appending write, so the lines of several processes do not interleave
+    fd = os.open(
+        os.environ["BENCHMARK_RESULTS"], os.O_WRONLY | os.O_APPEND | os.O_CREAT
+    )
+    try:
+        os.write(fd, (line + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+# every service only imports its own module, like its container does
+def patch_youtube(args):
+    import app.services.youtube as youtube
+
+    start = float(os.environ["BENCHMARK_START"])
+
+    # stands in for the uploads playlist, a new video every `interval` seconds
+    async def get_all_uploads(refetch_latest=5):
+        now = time.time()
+        for i in range(args.videos):
+            uploaded_at = start + i * args.interval
+            if uploaded_at > now:
+                break
+            yield SimpleNamespace(
+                videoid=f"video{i:05}",
+                title=f"Sermon {i}",
+                published=str(datetime.fromtimestamp(uploaded_at)),
+                description="x" * 2000,
+                uploaded_at=uploaded_at,
+            )
+
+    send_video = youtube.send_video
+
+    async def stamped_send_video(client, video, topics, event_id=None):
+        video.sent_at = time.time()
+        await send_video(client, video, topics, event_id=event_id)
+
+    youtube.get_all_uploads = get_all_uploads
+    youtube.send_video = stamped_send_video
+    return youtube.poll
+
+
+def patch_podbean(args):
+    import app.services.podbean as podbean
+
+    async def nothing(*args):
+        return None
+
+    # stands in for downloading, transcoding and uploading the video
+    async def process_podbean_exclusively(oauth, video):
+        record("podbean", video)
+
+    podbean.create_oauth_session = nothing
+    podbean.sweep_orphaned_files = nothing
+    podbean.process_podbean_exclusively = process_podbean_exclusively
+    return podbean.on_new_video.consume
+
+
+def patch_discord(args):
+    import app.services.discord as discord
+
+    async def process_discord(video):
+        record("discord", video)
+
+    discord.process_discord = process_discord
+    return discord.on_new_video.consume
+
+
+def patch_wordpress(args):
+    import app.services.wordpress as wordpress
+
+    async def post_video(video):
+        record("wordpress", video)
+
+    wordpress.post_video = post_video
+    return wordpress.on_new_video.consume
+
+
+def patch_settings(args):
+    import app.services.settings as settings
+
+    return settings.publish_changes
+
+
+patches = dict(
+    settings=patch_settings,
+    youtube=patch_youtube,
+    podbean=patch_podbean,
+    discord=patch_discord,
+    wordpress=patch_wordpress,
+)
+
+
+def run_service(args):
+    from app.util import entrypoint, setup_logging, with_health_server
+
+    logger = setup_logging("benchmark")
+    if args.run == "broker":
+        from struct import unpack
+
+        import hbmqtt.mqtt.connect
+        from hbmqtt.broker import Broker
+        from hbmqtt.codecs import read_or_raise
+
+        # hbmqtt's broker rejects the consumers' zero-length will messages, which
+        # mosquitto accepts
+        @asyncio.coroutine
+        def decode_data_with_length(reader):
+            length = unpack("!H", (yield from read_or_raise(reader, 2)))[0]
+            return (yield from read_or_raise(reader, length)) if length else b""
+
+        hbmqtt.mqtt.connect.decode_data_with_length = decode_data_with_length
+
+        async def serve_broker():
+            broker = Broker(
+                dict(
+                    listeners=dict(
+                        default=dict(type="tcp", bind=f"127.0.0.1:{args.port}")
+                    ),
+                    sys_interval=0,
+                    auth=dict(plugins=["auth_anonymous"], **{"allow-anonymous": True}),
+                    **{"topic-check": dict(enabled=False)},
+                )
+            )
+            await broker.start()
+            await asyncio.Event().wait()
+
+        return asyncio.get_event_loop().run_until_complete(serve_broker())
+
+    from app.util import with_settings_watch
+
+    if args.run in ["all", "all-mqtt"]:
+        from app.main import run_all_in_one
+
+        for service in services:
+            patches[service](args)
+
+        async def main():
+            await run_all_in_one(services, args.run == "all-mqtt")
+
+        entrypoint(with_health_server(with_settings_watch(main)), logger=logger)
+    elif args.run == "settings":
+        entrypoint(with_health_server(patches["settings"](args)), logger=logger)
+    else:
+        consume = patches[args.run](args)
+        entrypoint(with_health_server(with_settings_watch(consume)), logger=logger)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(args, name: str, directory: str, settings: dict, env: dict):
+    settings_file = os.path.join(directory, f"settings-{name}.json")
+    with open(settings_file, mode="w") as f:
+        f.write(json.dumps(settings, indent=4))
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--run", name, *args.forwarded],
+        cwd=directory,
+        env=dict(env, SETTINGS_FILE=settings_file),
+    )
+
+
+def stop(processes):
+    for process in processes:
+        process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def run_layout(args, layout: str, broker_port: int):
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.mkdir(os.path.join(directory, "pickles"))
+    results = os.path.join(directory, "results.jsonl")
+    env = dict(
+        os.environ,
+        BENCHMARK_RESULTS=results,
+        # the first video is uploaded once the services had time to start
+        BENCHMARK_START=str(time.time() + args.warmup),
+    )
+    env.setdefault("LOG_LEVEL", "WARNING")
+    settings = dict(
+        MessageBroker=f"mqtt://127.0.0.1:{broker_port}/",
+        MessageBrokerHeartbeatInterval=1.0,
+        YouTube=dict(
+            PollingRate=args.polling_rate,
+            LeaderElection=False,
+            ConsumerWaitTimeout=args.warmup,
+        ),
+        PodBean=dict(Enabled=True),
+        WebHook=dict(Enabled=True, MaxDuration=86400),
+        WordPress=dict(Enabled=True, MaxDuration=86400),
+    )
+    selected = services if layout == "separate" else [layout]
+    processes = {
+        name: start(
+            args,
+            name,
+            directory,
+            dict(settings, Server=dict(HealthPort=str(free_port()))),
+            env,
+        )
+        for name in selected
+    }
+
+    expected = args.videos * len(destinations)
+    deadline = time.time() + args.warmup + args.videos * args.interval + args.timeout
+    lines = []
+    while len(lines) < expected and time.time() < deadline:
+        time.sleep(0.5)
+        if os.path.exists(results):
+            with open(results, mode="r") as f:
+                lines = f.read().splitlines()
+    # idle again, as between two uploads
+    time.sleep(args.settle)
+    rss = {name: read_rss_kib(str(process.pid)) for name, process in processes.items()}
+    stop(processes.values())
+
+    handled = [json.loads(line) for line in lines]
+    label = dict(
+        separate="One process per service",
+        all="All-in-one (in memory)",
+        **{"all-mqtt": "All-in-one (--mqtt)"},
+    )[layout]
+    print(
+        f"{label}: {sum(rss.values()) / 1024:.1f} MiB RSS "
+        f"({', '.join(f'{name} {kib / 1024:.1f}' for name, kib in rss.items())}), "
+        f"{len(handled)} of {expected} deliveries"
+    )
+    for destination in destinations:
+        sent = [
+            entry["sent"] * 1000
+            for entry in handled
+            if entry["destination"] == destination
+        ]
+        if sent:
+            print(
+                f"    {destination:<10} sent to handled: p50 {statistics.median(sent):.1f} ms, "
+                f"p95 {percentile(sent, 0.95):.1f} ms, max {max(sent):.1f} ms"
+            )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares the memory and the per-video latency of the services in one process (app.main) with one process per service"
+    )
+    parser.add_argument("--videos", type=int, default=50)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="Seconds between two uploads",
+    )
+    parser.add_argument("--polling-rate", type=float, default=1.0)
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=15.0,
+        help="Seconds the services get to start before the first upload",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=3.0,
+        help="Seconds to wait after the last delivery before measuring the memory",
+    )
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--layout",
+        dest="layouts",
+        action="append",
+        choices=["separate", "all", "all-mqtt"],
+        help="Layout to measure. Can be repeated (default: all layouts).",
+    )
+    parser.add_argument("--run", help=SUPPRESS)
+    parser.add_argument("--port", type=int, help=SUPPRESS)
+    args = parser.parse_args()
+    args.forwarded = [
+        f"--videos={args.videos}",
+        f"--interval={args.interval}",
+    ]
+
+    if args.run:
+        return run_service(args)
+
+    broker_port = free_port()
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    with open(os.path.join(directory, "settings.json"), mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    broker = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--run",
+            "broker",
+            f"--port={broker_port}",
+        ],
+        cwd=directory,
+        env=dict(
+            os.environ,
+            SETTINGS_FILE=os.path.join(directory, "settings.json"),
+            LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        ),
+    )
+    try:
+        time.sleep(2.0)
+        for layout in args.layouts or ["separate", "all", "all-mqtt"]:
+            run_layout(args, layout, broker_port)
+        print(
+            f"The MQTT broker (hbmqtt here, mosquitto in docker-compose.yml) used {read_rss_kib(str(broker.pid)) / 1024:.1f} MiB RSS"
+        )
+    finally:
+        stop([broker])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TOPIC = "new_video/consumer"
+
+
+def make_broker():
+    """A local broker that drops messages nobody is subscribed to, like an MQTT broker
+    does, instead of holding them for the next subscriber."""
+    from app.util import LocalBroker
+
+    class Broker(LocalBroker):
+        def release_held(self, client):
+            self.held.clear()
+
+    return Broker()
+
+
+async def run(args, persistent: bool):
+    from app.config.core import (
+        message_broker_heartbeat_interval,
+        message_broker_persistent_sessions,
+    )
+    from app.util import (
+        create_client,
+        new_video_event_handler,
+        send_video,
+        use_local_broker,
+        wait_for_consumers,
+        watch_consumer_lag,
+    )
+
+    await message_broker_persistent_sessions(persistent)
+    await message_broker_heartbeat_interval(args.heartbeat)
+    use_local_broker(make_broker())
+    processed = set()
+    done = asyncio.Event()
+
+    @new_video_event_handler(TOPIC, logger=None, concurrency=args.concurrency)
+    async def consumer(video):
+        await asyncio.sleep(args.work / 1000.0)
+        processed.add(video.videoid)
+        if len(processed) >= args.backlog:
+            done.set()
+
+    async with create_client() as client:
+        task = asyncio.ensure_future(consumer.consume())
+        await wait_for_consumers(client, [TOPIC], timeout=5.0)
+        # the consumer restarts (or is stuck) while the videos come in
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        for i in range(args.backlog):
+            await send_video(
+                client,
+                SimpleNamespace(videoid=f"video{i:05}", title=f"Video {i}"),
+                [TOPIC],
+            )
+
+        peak = dict(lag=0.0, in_flight=0)
+        async with watch_consumer_lag(client, [TOPIC]) as consumer_lag:
+            started = time.monotonic()
+            task = asyncio.ensure_future(consumer.consume())
+            while not done.is_set() and time.monotonic() - started < args.timeout:
+                await asyncio.sleep(args.heartbeat / 2)
+                for status in consumer_lag().values():
+                    peak["lag"] = max(peak["lag"], status["lag"])
+                    peak["in_flight"] = max(peak["in_flight"], status["in_flight"])
+            elapsed = time.monotonic() - started
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    print(
+        f"{'Persistent' if persistent else 'Clean'} session: {len(processed)} of {args.backlog} queued videos processed after the restart"
+        + (f" in {elapsed:.2f}s" if processed else "")
+        + f"; heartbeats showed up to {peak['in_flight']} of {args.concurrency} in flight and {peak['lag']:.2f}s lag"
+    )
+
+
+async def benchmark(args):
+    for persistent in [False, True]:
+        await run(args, persistent)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures the replay of videos published while a consumer restarts"
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=200, help="Videos published during the restart"
+    )
+    parser.add_argument(
+        "--work", type=float, default=20.0, help="Milliseconds to process a video"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--heartbeat", type=float, default=0.2, help="Heartbeat interval in seconds"
+    )
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
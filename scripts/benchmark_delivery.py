@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# packets of one message between a client and the broker: PUBLISH and PUBACK with QoS 1,
+# PUBLISH, PUBREC, PUBREL and PUBCOMP with QoS 2
+PACKETS = {0: 1, 1: 2, 2: 4}
+
+
+def make_model_broker(rtt: float, packet_time: float, redelivery: float):
+    """A local broker with the costs of a remote one: every round trip takes `rtt`
+    seconds and the broker handles one packet at a time, `packet_time` seconds each. With
+    QoS 1, a share of `redelivery` deliveries lose their PUBACK and are sent again."""
+    from app.util import LocalBroker, LocalClient, LocalMessage
+
+    class ModelClient(LocalClient):
+        async def publish(self, topic: str, message: bytes, qos=None, retain=False):
+            await self.broker.exchange(qos)
+            self.broker.publish(topic, message, retain)
+            return LocalMessage(topic, message, retain)
+
+    class ModelBroker(LocalBroker):
+        def __init__(self):
+            super().__init__()
+            self.worker = asyncio.Lock()
+            self.packets = 0
+            self.round_trips = 0
+            self.redelivered = 0
+            self.rng = random.Random(0)
+
+        def client(self, client_id=None):
+            client = ModelClient(self, client_id)
+            self.clients.append(client)
+            return client
+
+        async def exchange(self, qos: int):
+            packets = PACKETS[qos or 0]
+            self.packets += packets
+            self.round_trips += (packets + 1) // 2
+            for _ in range(packets):
+                async with self.worker:
+                    await asyncio.sleep(packet_time)
+            await asyncio.sleep(rtt * ((packets + 1) // 2))
+
+        def publish(self, topic: str, data: bytes, retain: bool):
+            if retain:
+                if data:
+                    self.retained[topic] = data
+                else:
+                    self.retained.pop(topic, None)
+            for client in self.clients:
+                if client.is_subscribed(topic):
+                    # the deliveries to the consumers load the same broker
+                    asyncio.ensure_future(self.forward(client, topic, data))
+
+        async def forward(self, client, topic: str, data: bytes):
+            await self.exchange(self.qos)
+            client.queue.put_nowait(LocalMessage(topic, data, False))
+            if self.qos == 1 and self.rng.random() < redelivery:
+                # the PUBACK got lost, so the broker sends the message again
+                self.redelivered += 1
+                await self.exchange(self.qos)
+                client.queue.put_nowait(LocalMessage(topic, data, False))
+
+    return ModelBroker()
+
+
+async def run(args, delivery: str):
+    from app.config.core import message_broker_delivery
+    from app.util import (
+        create_client,
+        delivery_qos,
+        new_video_event_handler,
+        send_video,
+        use_local_broker,
+        wait_for_consumers,
+    )
+
+    await message_broker_delivery(delivery)
+    broker = make_model_broker(
+        args.rtt / 1000.0, args.packet_time / 1000.0, args.redelivery
+    )
+    broker.qos = await delivery_qos()
+    use_local_broker(broker)
+
+    topics = [f"new_video/consumer{i}" for i in range(args.consumers)]
+    processed = Counter()
+    done = asyncio.Event()
+
+    def make_consumer(topic: str):
+        @new_video_event_handler(topic, logger=None, concurrency=8)
+        async def consumer(video):
+            processed[(topic, video.videoid)] += 1
+            if sum(processed.values()) >= args.videos * len(topics):
+                done.set()
+
+        return asyncio.ensure_future(consumer.consume())
+
+    consumers = [make_consumer(topic) for topic in topics]
+    videos = [
+        SimpleNamespace(videoid=f"video{i:05}", title=f"Video {i}")
+        for i in range(args.videos)
+    ]
+    latencies = []
+
+    async with create_client() as client:
+        await wait_for_consumers(client, topics, timeout=10.0)
+        broker.packets = broker.round_trips = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def publish(video):
+            async with semaphore:
+                started = time.monotonic()
+                await send_video(client, video, topics)
+                latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        await asyncio.gather(*(publish(video) for video in videos))
+        published = time.monotonic() - started
+        await asyncio.wait_for(done.wait(), timeout=60.0)
+        # let redeliveries that are still in flight arrive
+        await asyncio.sleep(args.rtt / 1000.0 * 4 + 0.1)
+
+    for consumer in consumers:
+        consumer.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+
+    latencies.sort()
+    duplicates = sum(count - 1 for count in processed.values())
+    print(
+        f"{delivery}: {args.videos} videos to {len(topics)} topics published in {published:.2f}s, "
+        f"publish latency median {statistics.median(latencies) * 1000:.1f}ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms; "
+        f"{broker.packets} packets, {broker.round_trips} broker round trips; "
+        f"{broker.redelivered} redeliveries, {duplicates} processed twice"
+    )
+
+
+async def benchmark(args):
+    for delivery in ["exactly_once", "at_least_once"]:
+        await run(args, delivery)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares the QoS 2 and the QoS 1 (deduplicating) delivery modes against a modelled broker"
+    )
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--consumers", type=int, default=3, help="Topics per video")
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Videos published at the same time"
+    )
+    parser.add_argument(
+        "--rtt", type=float, default=2.0, help="Round trip time to the broker in ms"
+    )
+    parser.add_argument(
+        "--packet-time",
+        type=float,
+        default=0.05,
+        help="Milliseconds the broker spends on every packet",
+    )
+    parser.add_argument(
+        "--redelivery",
+        type=float,
+        default=0.05,
+        help="Share of QoS 1 deliveries that are sent twice",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+async def start_stand_in(port: int, limit: int, window: float, latency: float):
+    """Serves Discord's webhook endpoint. Every webhook accepts `limit` messages per
+    `window` seconds and answers further messages with 429, like Discord does."""
+    import aiohttp.web
+
+    windows = defaultdict(lambda: [0.0, 0])
+    delivered = []
+
+    async def execute(request: aiohttp.web.Request):
+        await asyncio.sleep(latency)
+        state = windows[request.match_info["id"]]
+        now = time.monotonic()
+        if now - state[0] >= window:
+            state[:] = [now, 0]
+        reset_after = window - (now - state[0])
+        if state[1] >= limit:
+            return aiohttp.web.Response(
+                status=429,
+                text=json.dumps(dict(retry_after=reset_after, **{"global": False})),
+                content_type="application/json",
+                headers={
+                    "Retry-After": f"{reset_after:.3f}",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                },
+            )
+        state[1] += 1
+        delivered.append(request.match_info["id"])
+        return aiohttp.web.Response(
+            text=json.dumps(dict(id=str(len(delivered)))),
+            content_type="application/json",
+            headers={
+                "X-RateLimit-Limit": str(limit),
+                "X-RateLimit-Remaining": str(limit - state[1]),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            },
+        )
+
+    app = aiohttp.web.Application()
+    app.router.add_post("/api/webhooks/{id}/{token}", execute)
+    runner = aiohttp.web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, windows, delivered
+
+
+def make_payload(i: int) -> dict:
+    return dict(
+        embeds=[
+            dict(
+                type="rich",
+                title=f"Video {i}",
+                description="Lorem ipsum dolor sit amet. " * 4,
+                footer=dict(text="Duration: 00:10:00"),
+            )
+        ]
+    )
+
+
+async def benchmark(args):
+    from discord_webhook import DiscordWebhook
+
+    from app.util import close_session, execute_webhooks, run_sync
+
+    runner, windows, delivered = await start_stand_in(
+        args.port, args.limit, args.window, args.latency / 1000.0
+    )
+    urls = [
+        f"http://127.0.0.1:{args.port}/api/webhooks/{i}/token"
+        for i in range(args.webhooks)
+    ]
+    total = args.videos * args.webhooks
+
+    def report(name: str, latencies, started: float):
+        elapsed = time.monotonic() - started
+        print(
+            f"{name}: {len(latencies)} of {total} messages delivered ({len(latencies) / total * 100:.1f}%) in {elapsed:.2f}s"
+            + (
+                f", latency median {statistics.median(latencies):.2f}s, max {max(latencies):.2f}s"
+                if latencies
+                else ""
+            )
+        )
+
+    # what send_webhook did before: a synchronous DiscordWebhook in a thread per url
+    async def send_old(payload: dict, url: str) -> bool:
+        def sync():
+            webhook = DiscordWebhook(url=url)
+            webhook.add_embed(payload["embeds"][0])
+            return webhook.execute()
+
+        response = await run_sync(sync)
+        return response.status_code in (200, 204)
+
+    async def old_video(i: int, latencies):
+        started = time.monotonic()
+        payload = make_payload(i)
+
+        async def send(url: str):
+            if await send_old(payload, url):
+                latencies.append(time.monotonic() - started)
+
+        await asyncio.gather(*(send(url) for url in urls))
+
+    async def new_video(i: int, latencies):
+        started = time.monotonic()
+        payload = make_payload(i)
+        results = await execute_webhooks(
+            [(url, payload) for url in urls], args.concurrency, args.max_attempts
+        )
+        latencies.extend(
+            time.monotonic() - started for error in results if error is None
+        )
+
+    for name, video in [
+        ("Synchronous DiscordWebhook per url", old_video),
+        (
+            f"Async client with rate limit buckets, {args.concurrency} concurrent requests",
+            new_video,
+        ),
+    ]:
+        windows.clear()
+        latencies = []
+        started = time.monotonic()
+        # the videos arrive one after another, each fanning out to every webhook
+        await asyncio.gather(*(video(i, latencies) for i in range(args.videos)))
+        report(name, latencies, started)
+        await asyncio.sleep(args.window)
+
+    await close_session()
+    await runner.cleanup()
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures Discord webhook fan-out against a local rate limited stand-in"
+    )
+    parser.add_argument("--webhooks", type=int, default=40, help="Number of webhooks")
+    parser.add_argument(
+        "--videos", type=int, default=12, help="Videos sent to every webhook at once"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=5, help="Messages per webhook and window"
+    )
+    parser.add_argument(
+        "--window", type=float, default=2.0, help="Rate limit window in seconds"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=20.0,
+        help="Milliseconds the stand-in takes to answer every request",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--port", type=int, default=23898, help="Stand-in port")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
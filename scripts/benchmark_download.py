@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import aiohttp.web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def make_app(payload: bytes, rate: int) -> aiohttp.web.Application:
+    """Serves `payload` with range support, throttling every connection to `rate` bytes/s."""
+
+    async def handler(request: aiohttp.web.Request):
+        start, end = 0, len(payload) - 1
+        status = 200
+        headers = {"Accept-Ranges": "bytes"}
+        if request.http_range.start is not None or request.http_range.stop is not None:
+            start = request.http_range.start or 0
+            end = min((request.http_range.stop or len(payload)) - 1, len(payload) - 1)
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(payload)}"
+        headers["Content-Length"] = str(end - start + 1)
+
+        response = aiohttp.web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        block = 65_536
+        try:
+            for offset in range(start, end + 1, block):
+                data = payload[offset : min(offset + block, end + 1)]
+                await response.write(data)
+                await asyncio.sleep(len(data) / rate)
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # the client went away (e.g. the interrupted resume scenario)
+        return response
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+async def benchmark(size: int, rate: int, port: int, interrupt_after: float):
+    from app.util.download import download_to_path, download_to_path_single
+
+    payload = os.urandom(size)
+    expected = hashlib.sha256(payload).hexdigest()
+
+    runner = aiohttp.web.AppRunner(make_app(payload, rate))
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, "127.0.0.1", port).start()
+    url = f"http://127.0.0.1:{port}/file"
+
+    def check(path: str) -> str:
+        with open(path, mode="rb") as f:
+            return (
+                "ok" if hashlib.sha256(f.read()).hexdigest() == expected else "CORRUPT"
+            )
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            path = os.path.join(directory, "single.bin")
+            started = time.monotonic()
+            await download_to_path_single(url, path)
+            single = time.monotonic() - started
+            print(f"HttpFD (single connection): {single:.2f}s [{check(path)}]")
+
+            path = os.path.join(directory, "ranged.bin")
+            started = time.monotonic()
+            await download_to_path(url, path)
+            ranged = time.monotonic() - started
+            print(
+                f"Ranged (adaptive connections): {ranged:.2f}s [{check(path)}] ({single / ranged:.2f}x)"
+            )
+
+            path = os.path.join(directory, "resumed.bin")
+            try:
+                await asyncio.wait_for(download_to_path(url, path), interrupt_after)
+            except asyncio.TimeoutError:
+                print(f"Interrupted ranged download after {interrupt_after:.2f}s")
+            started = time.monotonic()
+            await download_to_path(url, path)
+            print(
+                f"Resumed ranged download finished in {time.monotonic() - started:.2f}s [{check(path)}]"
+            )
+        finally:
+            await runner.cleanup()
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares youtube_dl's HttpFD with the ranged downloader against a throttled local server"
+    )
+    parser.add_argument(
+        "--size", type=int, default=32, help="Size of the served file in MiB"
+    )
+    parser.add_argument(
+        "--rate",
+        type=int,
+        default=2048,
+        help="Throughput limit of every connection in KiB/s",
+    )
+    parser.add_argument("--port", type=int, default=23899, help="Local server port")
+    parser.add_argument(
+        "--interrupt-after",
+        type=float,
+        default=3.0,
+        help="Seconds after which the resume scenario interrupts the first attempt",
+    )
+    args = parser.parse_args()
+
+    if "SETTINGS_FILE" not in os.environ:
+        os.environ["SETTINGS_FILE"] = os.path.join(tempfile.mkdtemp(), "settings.json")
+        with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+            f.write("{}")
+    asyncio.run(
+        benchmark(
+            args.size * 1_048_576, args.rate * 1024, args.port, args.interrupt_after
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
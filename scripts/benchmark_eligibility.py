@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def make_videos(args):
+    rng = random.Random(0)
+    now = datetime.now()
+    return [
+        SimpleNamespace(
+            videoid=f"video{i:05}",
+            title=f"{rng.choice(['Sermon', 'Announcements', 'Livestream'])} {i}",
+            # most videos are older than the maximum age, e.g. after a history reset
+            published=str(now - timedelta(seconds=rng.uniform(0, args.max_age * 10))),
+            description="x" * args.description,
+        )
+        for i in range(args.videos)
+    ]
+
+
+async def run(args, routed: bool):
+    import app.services.youtube as youtube
+    from app.config.discord import webhook_max_duration
+    from app.config.pickle import processed_pickle_path
+    from app.config.podbean import title_pattern
+    from app.config.wordpress import wp_max_duration
+    from app.services.discord import is_video_too_old as too_old_for_discord
+    from app.services.podbean import is_valid_title
+    from app.services.wordpress import is_video_too_old as too_old_for_wordpress
+    from app.util import (
+        LocalBroker,
+        compile_rules,
+        create_client,
+        new_video_event_handler,
+        use_local_broker,
+        wait_for_consumers,
+    )
+
+    await processed_pickle_path(
+        os.path.join(tempfile.mkdtemp(dir="pickles"), "processed.pickle")
+    )
+    await title_pattern("^Sermon")
+    await webhook_max_duration(args.max_age)
+    await wp_max_duration(args.max_age)
+    use_local_broker(LocalBroker())
+
+    if not routed:
+        # what the poller did before: every video to every destination
+        load_destination_rules = youtube.load_destination_rules
+
+        async def send_everywhere():
+            return {topic: compile_rules() for topic in youtube.destination_topics}
+
+        youtube.load_destination_rules = send_everywhere
+
+    delivered = Counter()
+    acted = Counter()
+
+    # the cheap recheck the consumers keep
+    async def acts_on(topic: str, video) -> bool:
+        if topic == "new_video/podbean":
+            return await is_valid_title(video.title)
+        if topic == "new_video/discord":
+            return not await too_old_for_discord(video)
+        return not await too_old_for_wordpress(video)
+
+    def make_consumer(topic: str):
+        @new_video_event_handler(topic, logger=None, concurrency=8)
+        async def consumer(video):
+            delivered[topic] += 1
+            if await acts_on(topic, video):
+                acted[topic] += 1
+
+        return asyncio.ensure_future(consumer.consume())
+
+    consumers = [make_consumer(topic) for topic in youtube.destination_topics]
+    videos = make_videos(args)
+    async with create_client() as client:
+        await wait_for_consumers(client, youtube.destination_topics, timeout=5.0)
+        started = time.monotonic()
+        published = await youtube.publish_new_videos(client, videos)
+        rules = await youtube.load_destination_rules()
+        expected = sum(len(youtube.route_video(video, rules)) for video in published)
+        while sum(delivered.values()) < expected:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - started
+
+    for consumer in consumers:
+        consumer.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+    if not routed:
+        youtube.load_destination_rules = load_destination_rules
+
+    print(
+        f"{'Routed by the poller' if routed else 'Sent to every destination'}: "
+        f"{sum(delivered.values())} deliveries for {len(videos)} videos in {elapsed:.2f}s, "
+        f"{sum(acted.values())} acted on ({dict(acted)})"
+    )
+
+
+async def benchmark(args):
+    for routed in [False, True]:
+        await run(args, routed)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares sending every new video to every destination with routing it by the destinations' rules in the poller"
+    )
+    parser.add_argument("--videos", type=int, default=1000)
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=1800.0,
+        help="Maximum age in seconds of videos sent to Discord and WordPress",
+    )
+    parser.add_argument(
+        "--description",
+        type=int,
+        default=2000,
+        help="Characters in every video's description",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.mkdir(os.path.join(directory, "pickles"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
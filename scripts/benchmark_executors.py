@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def network_call(seconds: float):
+    # like a youtube_dl download or an XML-RPC call waiting for the server
+    time.sleep(seconds)
+
+
+def file_call(path: str, size: int):
+    with open(path, mode="wb") as f:
+        f.write(os.urandom(size))
+        os.fsync(f.fileno())
+
+
+def cpu_call(iterations: int) -> int:
+    # like ColorThief quantizing the pixels of a thumbnail
+    total = 0
+    for i in range(iterations):
+        total = (total + i * i) % 1_000_003
+    return total
+
+
+async def workload(args, executors):
+    from app.util import run_sync
+
+    latencies = dict(network=[], file=[], cpu=[])
+
+    async def timed(kind: str, func):
+        started = time.monotonic()
+        await run_sync(func, executor=executors[kind])
+        latencies[kind].append(time.monotonic() - started)
+
+    directory = tempfile.mkdtemp()
+    calls = (
+        [
+            timed("network", partial(network_call, args.network_seconds))
+            for _ in range(args.network)
+        ]
+        + [
+            timed("file", partial(file_call, os.path.join(directory, str(i)), 1 << 20))
+            for i in range(args.file)
+        ]
+        + [
+            timed("cpu", partial(cpu_call, args.cpu_iterations))
+            for _ in range(args.cpu)
+        ]
+    )
+    started = time.monotonic()
+    await asyncio.gather(*calls)
+    elapsed = time.monotonic() - started
+    return latencies, elapsed
+
+
+def report(name: str, latencies, elapsed: float):
+    print(f"{name} (done in {elapsed:.2f}s):")
+    for kind, values in latencies.items():
+        print(
+            f"    {kind}: median {statistics.median(values):.3f}s, max {max(values):.3f}s"
+        )
+
+
+async def benchmark(args):
+    from app.util import get_executor_metrics, shutdown_executors
+
+    # what entrypoint did before: one default executor for everything, sized by this
+    # Python's default (cpu_count * 5 on 3.7, min(32, cpu_count + 4) from 3.8 on)
+    executor = ThreadPoolExecutor(max_workers=args.default_threads)
+    loop = asyncio.get_event_loop()
+    loop.set_default_executor(executor)
+    latencies, elapsed = await workload(args, dict(network=None, file=None, cpu=None))
+    report(
+        f"One default executor with {executor._max_workers} threads",
+        latencies,
+        elapsed,
+    )
+
+    latencies, elapsed = await workload(
+        args, dict(network="network", file="file", cpu="cpu")
+    )
+    report("Named executors", latencies, elapsed)
+    print(json.dumps(get_executor_metrics(), indent=4))
+    shutdown_executors()
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares one shared executor with the named network, file and cpu executors"
+    )
+    parser.add_argument(
+        "--network", type=int, default=40, help="Blocking network calls"
+    )
+    parser.add_argument("--network-seconds", type=float, default=1.0)
+    parser.add_argument("--file", type=int, default=20, help="1 MiB file writes")
+    parser.add_argument("--cpu", type=int, default=8, help="CPU bound calls")
+    parser.add_argument("--cpu-iterations", type=int, default=2_000_000)
+    parser.add_argument(
+        "--default-threads",
+        type=int,
+        help="Size of the shared executor (default: Python's default)",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
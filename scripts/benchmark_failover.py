@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# the replica a coroutine belongs to, as the lease owner
+replica = contextvars.ContextVar("replica")
+
+
+async def run(args, name: str, election: bool, crash: bool):
+    import app.services.youtube as youtube
+    import app.util.lease as lease
+    from app.config.core import message_broker_heartbeat_interval
+    from app.config.pickle import leases_path, processed_pickle_path
+    from app.config.youtube import (
+        consumer_wait_timeout,
+        leader_election,
+        leader_lease_ttl,
+        polling_rate,
+    )
+    from app.util import (
+        LocalBroker,
+        create_client,
+        decode_video_event,
+        new_video_event_handler,
+        use_local_broker,
+    )
+
+    directory = tempfile.mkdtemp(dir="pickles")
+    await leases_path(os.path.join(directory, "leases"))
+    await processed_pickle_path(os.path.join(directory, "processed.pickle"))
+    await leader_election(election)
+    await leader_lease_ttl(args.ttl)
+    await polling_rate(args.polling_rate)
+    await consumer_wait_timeout(5.0)
+    await message_broker_heartbeat_interval(1.0)
+    broker = LocalBroker()
+    use_local_broker(broker)
+
+    uploads = []
+    polls = []
+    crashed = set()
+
+    # stands in for fetching the uploads playlist from YouTube
+    async def get_all_uploads(refetch_latest=5):
+        polls.append((time.monotonic(), replica.get()))
+        for video in list(uploads):
+            yield video
+
+    async def upload():
+        while True:
+            uploads.append(
+                SimpleNamespace(
+                    videoid=f"video{len(uploads):05}", title=f"Video {len(uploads)}"
+                )
+            )
+            await asyncio.sleep(args.upload_interval)
+
+    get_lease_owner = lease.get_lease_owner
+    release_lease = lease.release_lease
+
+    def release_unless_crashed(path: str, owner: str):
+        # a process that crashed leaves its lease behind until it expires
+        if owner not in crashed:
+            release_lease(path, owner)
+
+    youtube.get_all_uploads = get_all_uploads
+    lease.get_lease_owner = replica.get
+    lease.release_lease = release_unless_crashed
+
+    handled = Counter()
+
+    def make_consumer(topic: str):
+        @new_video_event_handler(topic, logger=None)
+        async def consumer(video):
+            handled[(topic, video.videoid)] += 1
+
+        return asyncio.ensure_future(consumer.consume())
+
+    consumers = [make_consumer(topic) for topic in youtube.destination_topics]
+    detected = Counter()
+
+    async def count_detections():
+        # every detection event on the bus, including the ones the consumers drop
+        async with create_client() as client:
+            await client.subscribe([(topic, 2) for topic in youtube.destination_topics])
+            while True:
+                message = await client.deliver_message()
+                event = decode_video_event(message.publish_packet.payload.data)
+                detected[(message.topic, event["video"].videoid)] += 1
+
+    counter = asyncio.ensure_future(count_detections())
+
+    def start(owner: str):
+        replica.set(owner)
+        return asyncio.ensure_future(youtube.poll())
+
+    pollers = {owner: start(owner) for owner in ["poller0", "poller1", "poller2"]}
+    uploader = asyncio.ensure_future(upload())
+    await asyncio.sleep(args.duration / 2)
+
+    leader = polls[-1][1]
+    if crash:
+        crashed.add(leader)
+    killed = time.monotonic()
+    pollers[leader].cancel()
+    await asyncio.gather(pollers[leader], return_exceptions=True)
+    await asyncio.sleep(args.duration / 2)
+
+    for task in [uploader, *pollers.values(), counter, *consumers]:
+        task.cancel()
+    await asyncio.gather(
+        uploader, counter, *pollers.values(), *consumers, return_exceptions=True
+    )
+
+    lease.get_lease_owner = get_lease_owner
+    lease.release_lease = release_lease
+    takeover = next(
+        (at - killed for at, owner in polls if at > killed and owner != leader), None
+    )
+    pollers_seen = len({owner for _, owner in polls})
+    duplicates = sum(count - 1 for count in detected.values())
+    handled_twice = sum(count - 1 for count in handled.values())
+    print(
+        f"{name}: {len(polls)} polls by {pollers_seen} replicas, "
+        + (
+            f"next poll {takeover:.2f}s after the leader stopped, "
+            if takeover is not None
+            else "no poll after the leader stopped, "
+        )
+        + f"{duplicates} duplicate detection events, {handled_twice} videos handled twice"
+    )
+
+
+async def benchmark(args):
+    await run(args, "3 pollers without election", False, True)
+    await run(args, "3 pollers with election, leader crashes", True, True)
+    await run(args, "3 pollers with election, leader shuts down", True, False)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures the failover between redundant YouTube pollers with a stand-in for YouTube"
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=3.0, help="Leader lease in seconds"
+    )
+    parser.add_argument(
+        "--polling-rate", type=float, default=1.0, help="Seconds between polls"
+    )
+    parser.add_argument(
+        "--upload-interval",
+        type=float,
+        default=0.25,
+        help="Seconds between uploads to the channel",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds to run each scenario"
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.mkdir(os.path.join(directory, "pickles"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from collections import Counter, OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class StandInVideo:
+    def __init__(self, videoid: str):
+        self.videoid = videoid
+
+    def populate_from_playlist(self, data: dict):
+        self.title = data["title"]
+
+
+class StandInYouTube:
+    """Answers the YouTube Data API calls pafy makes from an in-memory playlist (newest
+    first) and counts them."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.calls = Counter()
+
+    def call_gdata(self, api: str, query: dict) -> dict:
+        self.calls[api] += 1
+        if api == "playlists":
+            return dict(
+                items=[
+                    dict(
+                        snippet=dict(
+                            title="Uploads", channelTitle="Channel", description=""
+                        ),
+                        contentDetails=dict(itemCount=len(self.ids)),
+                    )
+                ]
+            )
+        if api == "playlistItems":
+            start = int(query.get("pageToken", 0))
+            end = start + query["maxResults"]
+            page = dict(
+                items=[
+                    dict(
+                        contentDetails=dict(videoId=id),
+                        snippet=dict(resourceId=dict(videoId=id)),
+                    )
+                    for id in self.ids[start:end]
+                ]
+            )
+            if end < len(self.ids):
+                page["nextPageToken"] = str(end)
+            return page
+        if api == "videos":
+            return dict(
+                items=[
+                    dict(id=id, snippet=dict(title=f"Video {id}"))
+                    for id in query["id"].split(",")
+                ]
+            )
+        raise Exception(f"Unexpected API '{api}'.")
+
+
+def scenarios(ids, rng: random.Random):
+    n = len(ids)
+    yield "Newest video deleted", ids[1:]
+    yield "Video in the middle deleted", ids[: n // 2] + ids[n // 2 + 1 :]
+    yield "Oldest video deleted", ids[:-1]
+    deleted = set(rng.sample(ids, 3))
+    yield "3 random videos deleted", [id for id in ids if id not in deleted]
+    yield "1 video deleted, 2 uploaded", ["new0", "new1"] + ids[:10] + ids[11:]
+
+
+def main():
+    parser = ArgumentParser(
+        description="Counts the YouTube API calls needed to bring a saved playlist up to date after deletions"
+    )
+    parser.add_argument("--videos", type=int, default=2000, help="Playlist size")
+    args = parser.parse_args()
+
+    import pafy
+    import pafy.playlist
+
+    from app.services.youtube import reconcile_playlist
+
+    ids = [f"video{i:05}" for i in range(args.videos)]
+    saved = OrderedDict((id, StandInVideo(id)) for id in reversed(ids))
+
+    pafy.new = pafy.playlist.new = lambda id, **kwargs: StandInVideo(id)
+    pafy.playlist.dict_for_playlist = lambda item: dict(title=item["snippet"]["title"])
+
+    for name, remote in scenarios(ids, random.Random(0)):
+        youtube = StandInYouTube(remote)
+        pafy.call_gdata = pafy.playlist.call_gdata = youtube.call_gdata
+
+        # what get_all_uploads did before: materialize the whole playlist again
+        playlist = pafy.get_playlist2("UUchannel")
+        refetched = OrderedDict(
+            reversed([(video.videoid, video) for video in playlist])
+        )
+        before = sum(youtube.calls.values())
+
+        youtube.calls.clear()
+        playlist = pafy.get_playlist2("UUchannel")
+        reconciled = reconcile_playlist("UUchannel", saved, len(playlist))
+        after = sum(youtube.calls.values())
+
+        if list(reconciled) != list(refetched) or list(reconciled) != remote[::-1]:
+            raise Exception(f"Reconciled playlist differs in '{name}'.")
+        print(
+            f"{name}: {before} API calls with a full refetch, {after} with reconciliation ({dict(youtube.calls)})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TOPIC = "new_video/podbean"
+
+
+async def run(args, name: str, workers: int, coordinated: bool):
+    import app.services.podbean as podbean
+    from app.config.core import message_broker_persistent_sessions
+    from app.config.pickle import podbean_posted_pickle_path
+    from app.config.podbean import shared_subscription
+    from app.util import (
+        LocalBroker,
+        create_client,
+        is_already_posted,
+        mark_as_posted,
+        new_video_event_handler,
+        send_video,
+        use_local_broker,
+        wait_for_consumers,
+    )
+
+    await shared_subscription(coordinated)
+    # replicas used to connect with clean sessions and random client ids
+    await message_broker_persistent_sessions(coordinated)
+    await podbean_posted_pickle_path(
+        os.path.join(tempfile.mkdtemp(dir="pickles"), "posted.pickle")
+    )
+    use_local_broker(LocalBroker())
+    published = Counter()
+    done = asyncio.Event()
+    rng = random.Random(0)
+
+    # stands in for downloading, transcoding and uploading the episode
+    async def process_podbean(oauth, video, **kwargs):
+        await asyncio.sleep(args.transcode / 1000.0 * rng.uniform(0.5, 1.5))
+        await asyncio.sleep(args.upload / 1000.0 * rng.uniform(0.5, 1.5))
+        published[video.videoid] += 1
+        await mark_as_posted(video.videoid, podbean_posted_pickle_path)
+        if len(published) >= args.videos:
+            done.set()
+
+    podbean.process_podbean = process_podbean
+
+    def make_worker(worker: str):
+        @new_video_event_handler(
+            TOPIC, logger=None, concurrency=args.concurrency, shared=shared_subscription
+        )
+        async def on_new_video(video):
+            if coordinated:
+                await podbean.process_podbean_exclusively(None, video, owner=worker)
+            # what every replica did before: check the posted history, then process
+            elif not await is_already_posted(video.videoid, podbean_posted_pickle_path):
+                await process_podbean(None, video)
+
+        return asyncio.ensure_future(on_new_video.consume(worker))
+
+    tasks = [make_worker(f"worker{i}") for i in range(workers)]
+    videos = [
+        SimpleNamespace(videoid=f"video{i:05}", title=f"Video {i}")
+        for i in range(args.videos)
+    ]
+    # e.g. replays or a second poller publish some videos again, with a new event id
+    sent = videos + rng.sample(videos, int(args.videos * args.republished))
+    async with create_client() as client:
+        await wait_for_consumers(client, [TOPIC], timeout=5.0)
+        started = time.monotonic()
+        for video in sent:
+            await send_video(client, video, [TOPIC])
+        await asyncio.wait_for(done.wait(), timeout=120.0)
+        # let republished videos that are still in flight finish
+        await asyncio.sleep((args.transcode + args.upload) / 1000.0 * 2)
+        elapsed = time.monotonic() - started
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    duplicates = sum(count - 1 for count in published.values())
+    print(
+        f"{name}: {len(published)} videos in {elapsed:.2f}s ({len(published) / elapsed:.1f} per second), {duplicates} published twice"
+    )
+
+
+async def benchmark(args):
+    await run(args, "1 worker", 1, True)
+    await run(args, f"{args.workers} replicas, no coordination", args.workers, False)
+    await run(
+        args,
+        f"{args.workers} workers, shared subscription and leases",
+        args.workers,
+        True,
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures PodBean workers sharing the new video topic with stand-ins for transcoding and uploading"
+    )
+    parser.add_argument("--videos", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Videos per worker at a time"
+    )
+    parser.add_argument(
+        "--republished",
+        type=float,
+        default=0.2,
+        help="Share of videos that are published a second time",
+    )
+    parser.add_argument(
+        "--transcode", type=float, default=150.0, help="Milliseconds to transcode"
+    )
+    parser.add_argument(
+        "--upload", type=float, default=100.0, help="Milliseconds to upload"
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.mkdir(os.path.join(directory, "pickles"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class SlowClient:
+    """Publishes through a local broker client, but every publish waits `latency` seconds
+    for the broker's confirmation like a QoS 2 publish to a remote broker."""
+
+    def __init__(self, client, latency: float):
+        self.client = client
+        self.latency = latency
+
+    async def publish(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await self.client.publish(*args, **kwargs)
+
+
+async def old_poll(client, videos):
+    """The previous poll cycle: one read of the processed index per video, and one
+    publish and one rewrite of the index per new video."""
+    from app.config.pickle import processed_pickle_path
+    from app.services.youtube import destination_topics
+    from app.util import load_pickle, save_pickle, send_video
+
+    pickle_path = await processed_pickle_path()
+    for video in videos:
+        processed = await load_pickle(pickle_path, get_default=lambda: set([]))
+        if video.videoid in processed:
+            continue
+        await send_video(client, video, destination_topics)
+        await save_pickle(
+            pickle_path,
+            set(
+                [
+                    *await load_pickle(pickle_path, get_default=lambda: set([])),
+                    video.videoid,
+                ]
+            ),
+        )
+
+
+async def benchmark(args):
+    from app.services.youtube import publish_new_videos
+    from app.util import LocalBroker, LocalClient
+
+    videos = [
+        SimpleNamespace(videoid=f"video{i:05}", title=f"Video {i}")
+        for i in range(args.videos)
+    ]
+    processed = {video.videoid for video in videos[args.new :]}
+    client = SlowClient(LocalClient(LocalBroker()), args.latency / 1000.0)
+
+    for name, cycle in [
+        ("Per-video checks and writes", old_poll),
+        ("Set difference and one batched write", publish_new_videos),
+    ]:
+        with open("pickles/processed.pickle", mode="wb") as f:
+            pickle.dump(processed, f)
+        started = time.monotonic()
+        await cycle(client, videos)
+        print(
+            f"{name}: {time.monotonic() - started:.3f}s for {args.videos} videos ({args.new} new)"
+        )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures one YouTube poll cycle over a large playlist with a local broker"
+    )
+    parser.add_argument("--videos", type=int, default=10_000, help="Playlist size")
+    parser.add_argument("--new", type=int, default=20, help="Videos not processed yet")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=5.0,
+        help="Milliseconds the broker takes to confirm a publish",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.mkdir(os.path.join(directory, "pickles"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
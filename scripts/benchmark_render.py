@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+links = [
+    "https://www.patreon.com/{}",
+    "https://twitter.com/{}",
+    "http://instagram.com/{}/",
+    "https://www.youtube.com/watch?v={}&t=42s",
+    "https://amzn.to/{}",
+    "www.{}.com/shop",
+    "{}.net",
+    "(https://en.wikipedia.org/wiki/{}_(disambiguation))",
+    "contact@{}.org",
+]
+
+
+def make_description(rng: random.Random, length: int) -> str:
+    parts = []
+    while sum(len(part) + 1 for part in parts) < length:
+        if rng.random() < 0.15:
+            parts.append(rng.choice(links).format(f"channel{rng.randrange(1000)}"))
+        elif rng.random() < 0.05:
+            parts.append(f"{rng.randrange(60)}:{rng.randrange(60):02}\n")
+        else:
+            parts.append(rng.choice(words) + rng.choice(["", "", ",", "."]))
+    return " ".join(parts)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares the description rendering against the previous uncompiled URL regex"
+    )
+    parser.add_argument("--videos", type=int, default=200, help="Number of videos")
+    parser.add_argument(
+        "--length", type=int, default=5000, help="Characters per description"
+    )
+    parser.add_argument(
+        "--renders",
+        type=int,
+        default=3,
+        help="Times each video is rendered, e.g. because of retries or backfills",
+    )
+    args = parser.parse_args()
+
+    from app.util import URL_REGEX, render_cache, render_description
+    from app.util.render import RENDER_CACHE_SIZE
+
+    rng = random.Random(0)
+    videos = [
+        SimpleNamespace(
+            videoid=f"video{i}", description=make_description(rng, args.length)
+        )
+        for i in range(args.videos)
+    ]
+
+    def report(name: str, started: float):
+        elapsed = time.monotonic() - started
+        count = args.videos * args.renders
+        print(
+            f"{name}: {count} renders in {elapsed:.3f}s ({elapsed / count * 1000:.3f}ms per render)"
+        )
+
+    # what the WordPress service did before, for every post
+    started = time.monotonic()
+    expected = {}
+    for _ in range(args.renders):
+        for video in videos:
+            expected[video.videoid] = re.sub(
+                URL_REGEX, r'<a href="\1">\1</a>', video.description
+            )
+    report("re.sub(URL_REGEX)", started)
+
+    started = time.monotonic()
+    for _ in range(args.renders):
+        render_cache.clear()
+        for video in videos:
+            rendered = render_description(video, "wordpress")
+    report("Tokenized, without memoization", started)
+
+    # the render cache holds the most recent videos, so render in windows that fit
+    render_cache.clear()
+    started = time.monotonic()
+    window = RENDER_CACHE_SIZE
+    for offset in range(0, len(videos), window):
+        for _ in range(args.renders):
+            for video in videos[offset : offset + window]:
+                rendered = render_description(video, "wordpress")
+                if rendered != expected[video.videoid]:
+                    raise Exception(f"Different output for '{video.videoid}'.")
+    report("Tokenized, memoized", started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from typing import Dict, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_BUDGET = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "startup_budget.json"
+)
+
+# run in a fresh interpreter so nothing is cached, then report the peak RSS after the import
+MEASURE = """
+import resource, sys
+import {module}
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)
+"""
+
+
+def measure_once(module: str, directory: str) -> Tuple[float, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE.format(module=module)],
+        cwd=directory,
+        env=dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1"),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    lines = result.stderr.strip().splitlines()
+    if result.returncode != 0:
+        raise Exception(f"Importing '{module}' failed:\n" + "\n".join(lines[-10:]))
+    # -X importtime lines look like "import time: self [us] | cumulative | imported package"
+    pattern = re.compile(rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$")
+    cumulative = next(
+        int(match.group(1))
+        for match in map(pattern.match, reversed(lines))
+        if match is not None
+    )
+    return cumulative / 1000.0, int(lines[-1])
+
+
+def measure(module: str, runs: int) -> Tuple[float, int]:
+    with tempfile.TemporaryDirectory() as directory:
+        # the services log into ./logs and read ./settings.json
+        os.mkdir(os.path.join(directory, "logs"))
+        with open(os.path.join(directory, "settings.json"), mode="w") as f:
+            f.write("{}")
+
+        samples = [measure_once(module, directory) for _ in range(runs)]
+    return (
+        statistics.median(import_ms for import_ms, _ in samples),
+        int(statistics.median(rss_kib for _, rss_kib in samples)),
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures the cold import time and baseline RSS of the app modules and fails if either exceeds the recorded budget"
+    )
+    parser.add_argument(
+        "--budget", default=DEFAULT_BUDGET, help="Path of the budget JSON file"
+    )
+    parser.add_argument(
+        "--module",
+        dest="modules",
+        action="append",
+        default=[],
+        help="Module to measure (default: every module in the budget file). Can be repeated.",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Number of cold starts per module"
+    )
+    parser.add_argument(
+        "--report-only",
+        action="store_true",
+        help="Print the measurements against the budget without failing, e.g. on CI machines whose timings vary",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Record the measurements (plus --headroom) as the new budget instead of checking them",
+    )
+    # cold import times vary by up to 50% between runs on the same machine, while the
+    # RSS after an import barely moves
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=2.0,
+        help="Factor applied to the measured import time when recording a budget",
+    )
+    parser.add_argument(
+        "--rss-headroom",
+        type=float,
+        default=1.1,
+        help="Factor applied to the measured RSS when recording a budget",
+    )
+    args = parser.parse_args()
+
+    budget: Dict[str, dict] = {}
+    if os.path.exists(args.budget):
+        with open(args.budget, mode="r") as f:
+            budget = json.load(f)
+
+    modules = args.modules or sorted(budget)
+    if not modules:
+        parser.error("No modules to measure. Pass --module or record a budget first.")
+
+    failed = False
+    for module in modules:
+        import_ms, rss_kib = measure(module, args.runs)
+        limits = budget.get(module)
+        if args.update:
+            budget[module] = dict(
+                import_ms=round(import_ms * args.headroom, 1),
+                rss_kib=int(rss_kib * args.rss_headroom),
+            )
+            status = "recorded"
+        elif limits is None:
+            status = "no budget"
+        elif import_ms > limits["import_ms"] or rss_kib > limits["rss_kib"]:
+            status = (
+                f"OVER BUDGET ({limits['import_ms']:.1f} ms, {limits['rss_kib']} KiB)"
+            )
+            failed = True
+        else:
+            status = "ok"
+        print(f"{module}: {import_ms:.1f} ms, {rss_kib} KiB [{status}]")
+
+    if args.update:
+        with open(args.budget, mode="w") as f:
+            f.write(json.dumps(budget, indent=4, sort_keys=True) + "\n")
+
+    sys.exit(1 if failed and not args.report_only else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+async def make_fixture(args, path: str):
+    """A long episode like a livestream VOD: a tone that pauses for a second every
+    `--pause-every` seconds, as AAC like the audio streams YouTube serves."""
+    from app.util.download import run_ffmpeg
+
+    await run_ffmpeg(
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=220:sample_rate=48000:duration={args.duration}",
+        "-af",
+        f"volume='if(lt(mod(t,{args.pause_every}),{args.pause_every - 1}),1,0)':eval=frame",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        path,
+    )
+
+
+async def find_silences(path: str) -> List[Tuple[float, float]]:
+    """Every stretch of at least 10ms below -60dB, e.g. a gap between two segments."""
+    from app.util.download import SILENCE_PATTERN, run_ffmpeg
+
+    _, stderr = await run_ffmpeg(
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        path,
+        "-af",
+        "silencedetect=noise=-60dB:d=0.01",
+        "-f",
+        "null",
+        "-",
+    )
+    starts, silences = [], []
+    for kind, value in SILENCE_PATTERN.findall(stderr):
+        if kind == "start":
+            starts.append(float(value))
+        elif starts:
+            silences.append((starts.pop(), float(value)))
+    return silences
+
+
+def compare_silences(args, silences, reference) -> str:
+    """Where the silences of `silences` differ from those of `reference`. The fixture only
+    pauses in the last second of every `--pause-every` seconds, so any other silence is a
+    gap."""
+
+    def pause(start: float, end: float) -> Optional[int]:
+        middle = (start + end) / 2
+        if middle % args.pause_every < args.pause_every - 1:
+            return None
+        return int(middle // args.pause_every)
+
+    leading = [end - start for start, end in silences if start <= 0.0]
+    gaps = [
+        (start, end)
+        for start, end in silences
+        if start > 0.0 and pause(start, end) is None
+    ]
+    pauses = {pause(start, end): (start, end) for start, end in reference}
+    longer, later = 0.0, 0.0
+    for start, end in silences:
+        index = pause(start, end)
+        if index is None or index not in pauses:
+            continue
+        other_start, other_end = pauses[index]
+        longer = max(longer, (end - start) - (other_end - other_start))
+        later = max(later, end - other_end)
+    return (
+        f"{len(gaps)} outside the pauses{f' {gaps}' if gaps else ''}, "
+        f"{sum(leading) * 1000:.0f}ms of leading silence, pauses up to {longer * 1000:.0f}ms "
+        f"longer and audio up to {later * 1000:.0f}ms later than in one process"
+    )
+
+
+async def benchmark(args):
+    from app.config.download import segmented_transcode_threshold, transcode_processes
+    from app.util.download import convert_video, probe_duration
+
+    fixture = os.path.abspath("fixture.m4a")
+    started = time.monotonic()
+    await make_fixture(args, fixture)
+    print(f"Created a {args.duration}s fixture in {time.monotonic() - started:.2f}s")
+    source_duration = await probe_duration(fixture)
+
+    await transcode_processes(args.processes)
+    results = {}
+    silences = {}
+    for name, threshold in [("One ffmpeg process", 0), ("Segmented", 1)]:
+        await segmented_transcode_threshold(threshold)
+        output_path = os.path.abspath(f"output-{threshold}.mp3")
+        started = time.monotonic()
+        await convert_video(fixture, output_path)
+        elapsed = time.monotonic() - started
+        results[name] = elapsed
+        duration = await probe_duration(output_path)
+        print(
+            f"{name}: {elapsed:.2f}s ({source_duration / elapsed:.0f}x real time), "
+            f"{os.path.getsize(output_path) / 1_048_576:.1f} MiB, "
+            f"duration off by {(duration - source_duration) * 1000:+.0f}ms"
+        )
+        silences[name] = await find_silences(output_path)
+    print(
+        f"Gaps: {compare_silences(args, silences['Segmented'], silences['One ffmpeg process'])}"
+    )
+    print(
+        f"Speedup: {results['One ffmpeg process'] / results['Segmented']:.2f}x with {args.processes or os.cpu_count()} processes"
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares converting a long synthetic episode to MP3 in one ffmpeg process and in segments"
+    )
+    parser.add_argument(
+        "--duration", type=int, default=3 * 60 * 60, help="Seconds of audio"
+    )
+    parser.add_argument(
+        "--pause-every",
+        type=int,
+        default=20,
+        help="Seconds between the one second pauses",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=0, help="0 for one per CPU core"
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps({}, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class StandInRequestHandler(SimpleXMLRPCRequestHandler):
+    # like WordPress behind a regular web server, keep connections open between requests
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/xmlrpc.php",)
+    latency = 0.0
+
+    def do_POST(self):
+        # every request (including a whole multicall) costs one round trip to the blog
+        time.sleep(self.latency)
+        super().do_POST()
+
+
+class StandInServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def start_stand_in(port: int, latency: float) -> StandInServer:
+    """Serves the XML-RPC methods the WordPress service uses. Every request takes
+    `latency` seconds, like a round trip to a remote blog."""
+    StandInRequestHandler.latency = latency
+    server = StandInServer(
+        ("127.0.0.1", port),
+        requestHandler=StandInRequestHandler,
+        allow_none=True,
+        logRequests=False,
+    )
+    ids = itertools.count(1)
+
+    def supported_methods():
+        return ["wp.newPost", "system.multicall"]
+
+    def new_post(blog_id, username, password, content):
+        return str(next(ids))
+
+    server.register_function(supported_methods, "mt.supportedMethods")
+    server.register_function(new_post, "wp.newPost")
+    server.register_multicall_functions()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_post(i: int):
+    import wordpress_xmlrpc as xmlrpc
+
+    post = xmlrpc.WordPressPost()
+    post.title = f"Video {i}"
+    post.content = "<p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p>"
+    post.post_status = "publish"
+    return xmlrpc.methods.posts.NewPost(post)
+
+
+async def benchmark(url: str, count: int, burst: int):
+    import wordpress_xmlrpc as xmlrpc
+
+    from app.services.wordpress import submit_post
+    from app.util import run_sync
+
+    def report(name: str, started: float):
+        elapsed = time.monotonic() - started
+        print(
+            f"{name}: {count} posts in {elapsed:.2f}s ({count / elapsed:.1f} posts/s)"
+        )
+
+    # what post_video did before: a new client (and connection) for every video
+    started = time.monotonic()
+    for i in range(count):
+        post = make_post(i)
+        await run_sync(lambda: xmlrpc.Client(url, "user", "password").call(post))
+    report("New client per post", started)
+
+    started = time.monotonic()
+    for i in range(count):
+        await submit_post(make_post(i))
+    report("Persistent client, one post at a time", started)
+
+    started = time.monotonic()
+    for offset in range(0, count, burst):
+        await asyncio.gather(
+            *(
+                submit_post(make_post(i))
+                for i in range(offset, min(count, offset + burst))
+            )
+        )
+    report(f"Persistent client, bursts of {burst} posts (multicall)", started)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measures WordPress posting throughput against a local XML-RPC stand-in"
+    )
+    parser.add_argument("--count", type=int, default=100, help="Number of posts")
+    parser.add_argument(
+        "--burst", type=int, default=10, help="Posts that become ready together"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=20.0,
+        help="Milliseconds the stand-in takes to answer every request",
+    )
+    parser.add_argument("--port", type=int, default=23897, help="Stand-in port")
+    args = parser.parse_args()
+
+    start_stand_in(args.port, args.latency / 1000.0)
+    url = f"http://127.0.0.1:{args.port}/xmlrpc.php"
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(
+            json.dumps(
+                dict(
+                    WordPress=dict(
+                        XmlRpcUrl=url,
+                        Username="user",
+                        Password="password",
+                        MaxBatchSize=args.burst,
+                    )
+                ),
+                indent=4,
+            )
+        )
+    os.chdir(directory)
+
+    asyncio.run(benchmark(url, args.count, args.burst))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+sections = ["YouTube", "PodBean", "WebHook", "WordPress"]
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def measure(seconds: float, warmup: float):
+    from app.main import run_all_in_one, services
+
+    task = asyncio.ensure_future(run_all_in_one(services, use_mqtt=False))
+    await asyncio.sleep(warmup)
+
+    started_cpu, started = cpu_seconds(), time.monotonic()
+    await asyncio.sleep(seconds)
+    used, elapsed = cpu_seconds() - started_cpu, time.monotonic() - started
+    print(
+        f"Idle for {elapsed:.1f}s with every service disabled: {used:.3f}s of CPU time ({used / elapsed * 100:.2f}% of a core)"
+    )
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main():
+    parser = ArgumentParser(
+        description="Runs all services in one process with every service disabled and reports the CPU time used while idle"
+    )
+    parser.add_argument(
+        "--settings",
+        default=os.environ.get("SETTINGS_FILE", "./settings.json"),
+        help="Settings file to start from. It is copied, not modified.",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=30.0, help="Length of the measurement"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for the services to park before measuring",
+    )
+    args = parser.parse_args()
+
+    settings = {}
+    if os.path.exists(args.settings):
+        with open(args.settings, mode="r") as f:
+            settings = json.load(f)
+    for section in sections:
+        settings.setdefault(section, {})["Enabled"] = False
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "logs"))
+    os.environ["SETTINGS_FILE"] = os.path.join(directory, "settings.json")
+    with open(os.environ["SETTINGS_FILE"], mode="w") as f:
+        f.write(json.dumps(settings, indent=4))
+    os.chdir(directory)
+
+    asyncio.run(measure(args.seconds, args.warmup))
+
+
+if __name__ == "__main__":
+    main()
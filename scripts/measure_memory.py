@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import os
+from argparse import ArgumentParser
+
+
+def read_rss_kib(pid: str) -> int:
+    with open(f"/proc/{pid}/status", mode="r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def find_processes(patterns):
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", mode="rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode().strip()
+        except (OSError, IOError):
+            continue
+        if any(pattern in cmdline for pattern in patterns):
+            yield pid, cmdline
+
+
+def main():
+    parser = ArgumentParser(
+        description="Prints the resident memory (RSS) of the running YouTube2PodBean processes, e.g. to compare the all-in-one mode against one process per service"
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        default=["app.services.", "app.main"],
+        help="Command line substrings of the processes to measure",
+    )
+    args = parser.parse_args()
+
+    total = 0
+    for pid, cmdline in find_processes(args.patterns):
+        rss = read_rss_kib(pid)
+        total += rss
+        print(f"{pid:>8} {rss / 1024:>8.1f} MiB  {cmdline}")
+    print(f"{'total':>8} {total / 1024:>8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
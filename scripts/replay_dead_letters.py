@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import pickle
+import sys
+from argparse import ArgumentParser
+from typing import Dict, List, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+async def collect_dead_letters(client, timeout: float) -> Dict[str, dict]:
+    from app.util import subscribe_to_topic
+
+    entries = {}
+    async with subscribe_to_topic(client, "dead_letter/#"):
+        # dead letters are retained, so the broker delivers all of them right after subscribing
+        while True:
+            try:
+                message = await client.deliver_message(timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            data = message.publish_packet.payload.data
+            if data:
+                entries[message.topic] = pickle.loads(data)
+    return entries
+
+
+async def replay_dead_letters(
+    video_ids: Set[str], destinations: List[str], replay: bool, timeout: float
+):
+    from app.util import create_client, delivery_qos, send_video
+
+    async with create_client() as client:
+        entries = await collect_dead_letters(client, timeout)
+        selected = {
+            topic: entry
+            for topic, entry in entries.items()
+            if (not video_ids or entry["video"].videoid in video_ids)
+            and (not destinations or entry["topic"] in destinations)
+        }
+
+        if not selected:
+            print("No dead letters found.")
+            return
+
+        for topic, entry in sorted(selected.items()):
+            video = entry["video"]
+            print(
+                f"{entry['topic']}: '{video.videoid}' ('{video.title}') failed {entry['attempt']} times. Last error: {entry['error']}"
+            )
+            if not replay:
+                continue
+
+            await send_video(client, video, [entry["topic"]])
+            await client.publish(topic, b"", qos=await delivery_qos(), retain=True)
+            print(f"Replayed '{video.videoid}' onto '{entry['topic']}'.")
+
+
+def main():
+    parser = ArgumentParser(
+        description="Lists (and optionally replays) videos parked on the dead letter topics"
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay",
+        action="store_true",
+        help="Publish the selected videos to their original topic again and remove them from the dead letter topic",
+    )
+    parser.add_argument(
+        "--destination",
+        dest="destinations",
+        action="append",
+        default=[],
+        help="Only select dead letters of this topic (e.g. new_video/podbean). Can be repeated.",
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=2.0,
+        help="Seconds to wait for more retained dead letters before stopping",
+    )
+    parser.add_argument(
+        "video_id", nargs="*", help="List of video ids to select (default: all)"
+    )
+
+    args = parser.parse_args()
+    asyncio.run(
+        replay_dead_letters(
+            set(args.video_id), args.destinations, args.replay, args.timeout
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
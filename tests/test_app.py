@@ -1,2 +1,900 @@
+import pytest
+
+
+@pytest.fixture
+def service_directory(tmp_path, monkeypatch):
+    # the services log into ./logs and read ./settings.json
+    (tmp_path / "logs").mkdir()
+    (tmp_path / "settings.json").write_text("{}")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SETTINGS_FILE", str(tmp_path / "settings.json"))
+    return tmp_path
+
+
+def require_hbmqtt():
+    # the services import hbmqtt, which only imports on the Python versions they run on
+    # (see .travis.yml)
+    try:
+        import hbmqtt.client  # noqa: F401
+    except (ImportError, AttributeError) as e:
+        pytest.skip(f"hbmqtt does not import on this Python: {e!r}")
+
+
 def test_true():
     assert True
+
+
+def test_lazy_util_imports():
+    import subprocess
+    import sys
+
+    # app.util and the config modules are imported by every service, so they must not
+    # load the media and broker stacks
+    code = """
+import sys
+import app.util, app.config.core, app.config.podbean, app.config.server
+heavy = ["aiohttp", "pafy", "youtube_dl", "hbmqtt", "colorthief", "discord_webhook"]
+print(",".join(name for name in heavy if name in sys.modules))
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_rewind_job(service_directory):
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    from app.services.podbean import rewind_job
+
+    def make_file(name: str) -> str:
+        path = service_directory / name
+        path.write_bytes(b"x")
+        return str(path)
+
+    def make_job(stage: str, **paths) -> dict:
+        return dict(video=SimpleNamespace(title="Sermon"), stage=stage, **paths)
+
+    missing = str(service_directory / "missing")
+    downloaded, audio, thumbnail = map(make_file, ["downloaded", "audio", "thumbnail"])
+
+    # only the thumbnail is fetched again, not the transcoded episode
+    job = rewind_job(make_job("transcoded", audio_path=audio, thumbnail_path=missing))
+    assert (job["stage"], job["thumbnail_path"]) == ("transcoded", None)
+    job = rewind_job(
+        make_job("audio_uploaded", audio_path=missing, thumbnail_path=missing)
+    )
+    assert (job["stage"], job["thumbnail_path"]) == ("audio_uploaded", None)
+    job = rewind_job(
+        make_job("downloaded", downloaded_path=downloaded, thumbnail_path=missing)
+    )
+    assert (job["stage"], job["thumbnail_path"]) == ("downloaded", None)
+
+    # a missing transcode falls back to the download, if it is still there
+    job = rewind_job(
+        make_job(
+            "transcoded",
+            downloaded_path=downloaded,
+            audio_path=missing,
+            thumbnail_path=thumbnail,
+        )
+    )
+    assert (job["stage"], job["thumbnail_path"]) == ("downloaded", thumbnail)
+    job = rewind_job(
+        make_job(
+            "transcoded",
+            downloaded_path=missing,
+            audio_path=missing,
+            thumbnail_path=thumbnail,
+        )
+    )
+    assert job["stage"] is None
+
+    job = make_job("logo_uploaded", audio_path=missing, thumbnail_path=missing)
+    assert rewind_job(job) == job
+
+
+async def start_mqtt_broker():
+    import asyncio
+    import socket
+    from struct import unpack
+
+    import hbmqtt.mqtt.connect
+    from hbmqtt.broker import Broker
+    from hbmqtt.codecs import read_or_raise
+
+    from app.config.core import message_broker
+
+    # hbmqtt's broker rejects the consumers' zero-length will messages, which mosquitto
+    # accepts
+    @asyncio.coroutine
+    def decode_data_with_length(reader):
+        length = unpack("!H", (yield from read_or_raise(reader, 2)))[0]
+        return (yield from read_or_raise(reader, length)) if length else b""
+
+    hbmqtt.mqtt.connect.decode_data_with_length = decode_data_with_length
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    broker = Broker(
+        dict(
+            listeners=dict(default=dict(type="tcp", bind=f"127.0.0.1:{port}")),
+            sys_interval=0,
+            auth=dict(plugins=["auth_anonymous"], **{"allow-anonymous": True}),
+            **{"topic-check": dict(enabled=False)},
+        )
+    )
+    await broker.start()
+    await message_broker(f"mqtt://127.0.0.1:{port}/")
+    return broker
+
+
+def test_abandoned_delivery_keeps_its_message(service_directory):
+    import asyncio
+
+    require_hbmqtt()
+    from hbmqtt.client import QOS_1
+
+    from app.util.streams import create_client, receive_message
+
+    async def receive_after_stop():
+        broker = await start_mqtt_broker()
+        try:
+            async with create_client() as consumer, create_client() as producer:
+                await consumer.subscribe([("new_video/test", QOS_1)])
+                # e.g. the consumer is disabled while it waits for the next video
+                stop = asyncio.ensure_future(asyncio.sleep(0.1))
+                assert await receive_message(consumer, [stop]) is None
+
+                for data in [b"first", b"second"]:
+                    await producer.publish("new_video/test", data, qos=QOS_1)
+                return [
+                    (
+                        await asyncio.wait_for(receive_message(consumer), 5)
+                    ).publish_packet.payload.data
+                    for _ in range(2)
+                ]
+        finally:
+            await broker.shutdown()
+
+    assert asyncio.run(receive_after_stop()) == [b"first", b"second"]
+
+
+def test_failed_resumed_video_is_retried(service_directory):
+    import asyncio
+    import logging
+    import pickle
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    from hbmqtt.client import QOS_1
+
+    from app.util.streams import (
+        create_client,
+        new_video_event_handler,
+        receive_message,
+        retry_topic,
+    )
+
+    topic = "new_video/test"
+    video = SimpleNamespace(videoid="abc", title="Interrupted")
+    calls = []
+
+    async def resume():
+        return [video]
+
+    @new_video_event_handler(topic, logger=logging, resume=resume)
+    async def on_new_video(video):
+        calls.append(video.videoid)
+        raise RuntimeError("upload failed")
+
+    async def run():
+        broker = await start_mqtt_broker()
+        try:
+            async with create_client() as client:
+                await client.subscribe([(retry_topic(topic, "#"), QOS_1)])
+                consumer = asyncio.ensure_future(on_new_video.consume())
+                try:
+                    message = await asyncio.wait_for(receive_message(client), 5)
+                finally:
+                    consumer.cancel()
+                    await asyncio.gather(consumer, return_exceptions=True)
+                return message.topic, pickle.loads(message.publish_packet.payload.data)
+        finally:
+            await broker.shutdown()
+
+    message_topic, entry = asyncio.run(run())
+    assert calls == ["abc"]
+    assert message_topic == retry_topic(topic, "abc")
+    assert entry["attempt"] == 1 and entry["video"].videoid == "abc"
+
+
+def test_consumer_lag_ignores_other_messages(service_directory):
+    import asyncio
+    import json
+    import time
+
+    require_hbmqtt()
+    from hbmqtt.client import QOS_1
+
+    from app.util.streams import (
+        create_client,
+        lag_topic,
+        ready_topic,
+        receive_message,
+        watch_consumer_lag,
+    )
+
+    topic = "new_video/test"
+    status = dict(limit=1, in_flight=0, lag=0.0, interval=60, time=time.time())
+
+    async def watch():
+        broker = await start_mqtt_broker()
+        try:
+            async with create_client() as poller, create_client() as consumer:
+                await consumer.publish(
+                    lag_topic(topic), json.dumps(status).encode(), QOS_1, retain=True
+                )
+                async with watch_consumer_lag(poller, [topic]) as current:
+                    # like a consumer announcement `wait_for_consumers` did not take
+                    await poller.subscribe([(ready_topic(topic), QOS_1)])
+                    await consumer.publish(ready_topic(topic), b"1", QOS_1)
+                    await consumer.publish(lag_topic(topic), b"[]", QOS_1)
+                    await asyncio.sleep(0.5)
+                    statuses = current()
+
+                # the watcher's delivery was left for the next receiver
+                await consumer.publish(ready_topic(topic), b"", QOS_1)
+                message = await asyncio.wait_for(receive_message(poller), 5)
+                return statuses, message.topic
+        finally:
+            await broker.shutdown()
+
+    assert asyncio.run(watch()) == ({topic: status}, ready_topic(topic))
+
+
+def test_scratch_reservation_keeps_the_input(service_directory):
+    import asyncio
+
+    from app.config.scratch import scratch_budget, scratch_min_free_space
+    from app.util.scratch import ScratchSpace, ScratchSpaceException
+
+    scratch = service_directory / "scratch"
+    scratch.mkdir()
+    download = scratch / "Sermon-downloaded-abc.m4a"
+    download.write_bytes(b"x" * 600)
+    prefix = str(scratch / "Sermon-abc")
+
+    async def convert(size: int):
+        await scratch_budget(1000)
+        await scratch_min_free_space(0)
+        space = ScratchSpace()
+        async with space.reserve(prefix, size, keeps=[str(download)]):
+            # the download does not count twice
+            assert space.usage(str(scratch)) == (600 + size, size)
+
+    asyncio.run(asyncio.wait_for(convert(300), 1))
+    # the job's own download and the MP3 never fit, so it must not wait for them
+    with pytest.raises(ScratchSpaceException):
+        asyncio.run(asyncio.wait_for(convert(500), 1))
+
+
+class RecordingClient:
+    # stands in for an MQTTClient that only publishes
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, topic, message, qos=None, retain=False):
+        self.published.append((topic, message, retain))
+
+
+def test_backoff_delay_keeps_half_of_the_delay():
+    require_hbmqtt()
+    from app.util.streams import backoff_delay
+
+    for attempt, delay in [
+        (1, 30),
+        (2, 60),
+        (3, 120),
+        (7, 1920),
+        (8, 3600),
+        (20, 3600),
+    ]:
+        for _ in range(20):
+            assert delay / 2 <= backoff_delay(attempt, 30.0, 3600.0) <= delay
+
+
+def test_retry_scheduler_dead_letters_after_max_attempts(service_directory):
+    import asyncio
+    import pickle
+    import time
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    from app.config.retry import retry_base_delay, retry_max_attempts
+    from app.util.streams import RetryScheduler, dead_letter_topic, retry_topic
+
+    video = SimpleNamespace(videoid="abc", title="Failing")
+    client = RecordingClient()
+
+    async def process(video):
+        return RuntimeError("upload failed")
+
+    async def run():
+        await retry_max_attempts(3)
+        await retry_base_delay(10.0)
+        retries = RetryScheduler(
+            client,
+            "new_video/test",
+            process,
+            rate_per_minute=6000.0,
+            concurrency=1,
+            worker="worker1",
+        )
+        assert retries.subscription == "retry/new_video/test/worker1/#"
+        await retries.retry(video, 1, RuntimeError("upload failed"))
+        for _ in range(2):
+            topic, data, _ = client.published[-1]
+            assert retries.owns(topic)
+            # due now instead of after the backoff
+            entry = dict(pickle.loads(data), not_before=time.time())
+            retries.schedule(topic, pickle.dumps(entry))
+            await asyncio.wait_for(retries.waiting[topic], 5)
+
+    started = time.time()
+    asyncio.run(run())
+    topic = retry_topic("new_video/test/worker1", "abc")
+    assert topic == "retry/new_video/test/worker1/abc"
+    [first, second, dead, cleared] = client.published
+    assert all(retain for _, _, retain in client.published)
+
+    entries = [pickle.loads(data) for _, data, _ in [first, second]]
+    assert [first[0], second[0]] == [topic, topic]
+    assert [entry["attempt"] for entry in entries] == [1, 2]
+    assert 5 <= entries[0]["not_before"] - started <= 11
+
+    # the dead letter is not per worker, so any worker can replay it
+    assert dead[0] == dead_letter_topic("new_video/test", "abc")
+    assert dead[0] == "dead_letter/new_video/test/abc"
+    entry = pickle.loads(dead[1])
+    assert entry["attempt"] == 3 and entry["video"].videoid == "abc"
+    assert cleared == (topic, b"", True)
+
+
+def test_wordpress_posts_are_batched(service_directory, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    from xmlrpc.client import Fault
+
+    require_hbmqtt()
+    pytest.importorskip("wordpress_xmlrpc")
+    import wordpress_xmlrpc as xmlrpc
+
+    import app.services.wordpress as wordpress
+    from app.config.wordpress import wp_max_batch_size
+
+    batches = []
+
+    def multicall(calls):
+        titles = [call["params"][3]["post_title"] for call in calls]
+        batches.append(titles)
+        return [
+            (
+                dict(faultCode=500, faultString="Rejected")
+                if title == "rejected"
+                else [f"id of {title}"]
+            )
+            for title in titles
+        ]
+
+    def call(post):
+        # a single post is not worth a multicall
+        batches.append([post.content.title])
+        return f"id of {post.content.title}"
+
+    client = SimpleNamespace(
+        call=call,
+        blog_id=0,
+        username="user",
+        password="password",
+        supported_methods=["system.multicall", "wp.newPost"],
+        server=SimpleNamespace(system=SimpleNamespace(multicall=multicall)),
+    )
+
+    def make_post(title: str):
+        post = xmlrpc.WordPressPost()
+        post.title = title
+        return xmlrpc.methods.posts.NewPost(post)
+
+    async def submit(titles):
+        return await asyncio.gather(
+            *(wordpress.submit_post(make_post(title)) for title in titles),
+            return_exceptions=True,
+        )
+
+    async def get_client():
+        return client
+
+    monkeypatch.setattr(wordpress, "get_client", get_client)
+    asyncio.run(wp_max_batch_size(2))
+    results = asyncio.run(submit(["first", "second", "rejected", "fourth", "fifth"]))
+    assert batches == [["first", "second"], ["rejected", "fourth"], ["fifth"]]
+    assert results[:2] == ["id of first", "id of second"]
+    # the fault only fails its own post
+    assert isinstance(results[2], Fault)
+    assert results[3:] == ["id of fourth", "id of fifth"]
+
+    async def no_client():
+        return None
+
+    # e.g. incomplete credentials
+    monkeypatch.setattr(wordpress, "get_client", no_client)
+    assert asyncio.run(submit(["first", "second"])) == [None, None]
+    assert len(batches) == 3
+
+
+def make_embed(title: str, description: str = "") -> dict:
+    return dict(
+        title=title,
+        description=description,
+        author=dict(name="Church"),
+        footer=dict(text="Duration: 01:00:00"),
+    )
+
+
+def test_discord_embeds_are_grouped_within_the_limits(service_directory):
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    pytest.importorskip("colorthief")
+    from app.services.discord import group_embeds
+
+    def titles(messages):
+        return [[embed["title"] for _, embed in message] for message in messages]
+
+    videos = [(SimpleNamespace(videoid=str(i)), make_embed(str(i))) for i in range(25)]
+    assert titles(group_embeds(videos)) == [
+        [str(i) for i in range(0, 10)],
+        [str(i) for i in range(10, 20)],
+        [str(i) for i in range(20, 25)],
+    ]
+
+    # about 2500 characters each, so only two fit into 6000
+    videos = [
+        (SimpleNamespace(videoid=str(i)), make_embed(str(i), "x" * 2480))
+        for i in range(5)
+    ]
+    assert titles(group_embeds(videos)) == [["0", "1"], ["2", "3"], ["4"]]
+
+
+def test_discord_resends_only_to_failed_urls(service_directory, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    pytest.importorskip("colorthief")
+    import app.services.discord as discord
+    from app.config.discord import webhook_coalesce_window, webhook_url_list
+
+    sent = []
+    failing = {"https://discord/b"}
+
+    async def execute_webhooks(messages, concurrency, max_attempts):
+        sent.append(
+            [
+                (url, [embed["title"] for embed in message["embeds"]])
+                for url, message in messages
+            ]
+        )
+        return [
+            Exception("Bad gateway") if url in failing else None for url, _ in messages
+        ]
+
+    async def make_webhook_embed(video):
+        return make_embed(video.title)
+
+    monkeypatch.setattr(discord, "execute_webhooks", execute_webhooks)
+    monkeypatch.setattr(discord, "make_webhook_embed", make_webhook_embed)
+    monkeypatch.setattr(discord, "delivered_urls", {})
+    video = SimpleNamespace(videoid="abc", title="Sermon")
+
+    async def run():
+        await webhook_url_list(["https://discord/a", "https://discord/b"])
+        await webhook_coalesce_window(0.0)
+        # the same video twice while it waits is only sent once
+        results = await asyncio.gather(
+            discord.process_discord(video),
+            discord.process_discord(video),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, Exception) for result in results)
+
+        failing.clear()
+        await discord.process_discord(video)
+
+    asyncio.run(run())
+    assert sent == [
+        [("https://discord/a", ["Sermon"]), ("https://discord/b", ["Sermon"])],
+        [("https://discord/b", ["Sermon"])],
+    ]
+    assert discord.delivered_urls["abc"] == {"https://discord/a", "https://discord/b"}
+
+
+class StubResponse:
+    def __init__(self, status: int, headers=None, body=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+
+    async def json(self, content_type="application/json"):
+        if self.body is None:
+            raise ValueError("No JSON body")
+        return self.body
+
+    async def text(self):
+        return str(self.body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class StubSession:
+    # answers the requests to every url with its queued responses, then with 204
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def post(self, url, json, timeout):
+        import time
+
+        self.requests.append((url, json["n"], time.monotonic()))
+        queued = self.responses.get(url)
+        return queued.pop(0) if queued else StubResponse(204)
+
+
+def test_webhook_retry_after_prefers_the_header():
+    import asyncio
+
+    pytest.importorskip("aiohttp")
+    from app.util.webhook import get_retry_after
+
+    cases = [
+        (
+            StubResponse(429, {"Retry-After": "2.5"}, dict(retry_after=10.0)),
+            (2.5, False),
+        ),
+        (StubResponse(429, {}, dict(retry_after=0.3, **{"global": True})), (0.3, True)),
+        (
+            StubResponse(
+                429, {"X-RateLimit-Reset-After": "4", "X-RateLimit-Global": "true"}
+            ),
+            (4.0, True),
+        ),
+        (StubResponse(429), (1.0, False)),
+    ]
+    for response, expected in cases:
+        assert asyncio.run(get_retry_after(response)) == expected
+
+
+def test_webhook_rate_limits(monkeypatch):
+    import asyncio
+    import time
+
+    pytest.importorskip("aiohttp")
+    import app.util.webhook as webhook
+
+    def run(responses, messages):
+        session = StubSession(responses)
+        monkeypatch.setattr(webhook, "get_session", lambda: session)
+        monkeypatch.setattr(webhook, "_global_reset_at", 0.0)
+        started = time.monotonic()
+        results = asyncio.run(webhook.execute_webhooks(messages, concurrency=4))
+        assert results == [None] * len(messages)
+        return [(url, n, at - started) for url, n, at in session.requests]
+
+    limited = StubResponse(429, body=dict(retry_after=0.3))
+    # a webhook's limit holds back its own messages (in order), but not the others'
+    requests = run(
+        {"a": [limited]},
+        [("a", dict(n=1)), ("a", dict(n=2)), ("b", dict(n=3)), ("a", dict(n=4))],
+    )
+    assert [(url, n) for url, n, _ in requests if url == "a"] == [
+        ("a", 1),
+        ("a", 1),
+        ("a", 2),
+        ("a", 4),
+    ]
+    assert all(at >= 0.3 for url, _, at in requests[1:] if url == "a")
+    assert [at for url, _, at in requests if url == "b"][0] < 0.1
+
+    # a global limit holds back every webhook
+    limited = StubResponse(429, body=dict(retry_after=0.3, **{"global": True}))
+
+    async def send():
+        first = asyncio.ensure_future(webhook.execute_webhooks([("a", dict(n=1))]))
+        await asyncio.sleep(0.05)
+        await webhook.execute_webhooks([("b", dict(n=2))])
+        await first
+
+    session = StubSession({"a": [limited]})
+    monkeypatch.setattr(webhook, "get_session", lambda: session)
+    started = time.monotonic()
+    asyncio.run(send())
+    [(_, _, limited_at), *rest] = session.requests
+    assert [(url, n) for url, n, _ in rest] in (
+        [("b", 2), ("a", 1)],
+        [("a", 1), ("b", 2)],
+    )
+    assert all(at - started >= 0.3 for _, _, at in rest)
+
+
+@pytest.mark.parametrize(
+    "change, pages, inserted",
+    [
+        ("unchanged", 1, []),
+        ("inserted", 2, ["new"]),
+        ("removed", 2, []),
+        ("reordered", 2, []),
+    ],
+)
+def test_reconcile_playlist(service_directory, monkeypatch, change, pages, inserted):
+    from collections import OrderedDict
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    pytest.importorskip("pafy")
+    import app.services.youtube as youtube
+
+    size = youtube.PLAYLIST_PAGE_SIZE
+    # oldest first, like the saved playlist
+    saved = OrderedDict(
+        (f"v{i:03}", SimpleNamespace(videoid=f"v{i:03}")) for i in range(130)
+    )
+    # newest first, like the uploads playlist
+    remote = list(reversed(saved))
+    if change == "inserted":
+        remote.insert(0, "new")
+    elif change == "removed":
+        remote.remove("v100")
+    elif change == "reordered":
+        remote[0], remote[1] = remote[1], remote[0]
+
+    requested = []
+
+    def fetch_playlist_page(playlist_id, page_token):
+        start = int(page_token or 0)
+        requested.append(start)
+        end = start + size
+        return remote[start:end], str(end) if end < len(remote) else None
+
+    def fetch_videos(ids):
+        assert ids == inserted
+        return {id: SimpleNamespace(videoid=id) for id in ids}
+
+    monkeypatch.setattr(youtube, "fetch_playlist_page", fetch_playlist_page)
+    monkeypatch.setattr(youtube, "fetch_videos", fetch_videos)
+    result = youtube.reconcile_playlist("uploads", saved, len(remote))
+
+    assert list(result) == list(reversed(remote))
+    # the videos that were already saved are not fetched again
+    assert all(result[id] is saved[id] for id in result if id in saved)
+    assert len(requested) == pages
+
+
+def test_dedupe_window(monkeypatch):
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    import app.util.streams as streams
+
+    now = [1000.0]
+    monkeypatch.setattr(streams, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    received = streams.DedupeWindow(60.0, max_events=3)
+
+    assert not received.is_duplicate("a")
+    now[0] += 30
+    # a redelivery inside the window
+    assert received.is_duplicate("a")
+    assert not received.is_duplicate(None) and not received.is_duplicate(None)
+
+    now[0] += 31
+    # the window is counted from the first delivery
+    assert not received.is_duplicate("a")
+
+    # and it holds at most `max_events` ids
+    for id in ["b", "c", "d"]:
+        assert not received.is_duplicate(id)
+    assert not received.is_duplicate("a")
+
+
+def test_lease_renewal_failure_hands_over(service_directory, monkeypatch):
+    import asyncio
+
+    import app.util.lease as lease
+
+    # e.g. the shared directory became unreachable for one of the workers
+    unreachable = set()
+
+    def flaky(write_lease):
+        def wrapper(path, owner, ttl):
+            if owner in unreachable:
+                raise OSError("Stale file handle")
+            return write_lease(path, owner, ttl)
+
+        return wrapper
+
+    monkeypatch.setattr(lease, "renew_lease", flaky(lease.renew_lease))
+    monkeypatch.setattr(lease, "try_acquire_lease", flaky(lease.try_acquire_lease))
+    directory = str(service_directory / "leases")
+    errors = []
+
+    async def run_with_lease():
+        asyncio.get_event_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        cancelled = asyncio.Event()
+
+        async def work():
+            unreachable.add("a")
+            try:
+                await asyncio.sleep(5)
+            finally:
+                cancelled.set()
+
+        with pytest.raises(lease.LeaseLost) as raised:
+            await lease.run_with_lease(directory, "video", work, ttl=0.3, owner="a")
+        assert isinstance(raised.value.__cause__, OSError)
+        assert cancelled.is_set()
+        # the lease was released, so another worker takes over right away
+        unreachable.clear()
+
+        async def nothing():
+            pass
+
+        assert await lease.run_with_lease(
+            directory, "video", nothing, ttl=0.3, owner="b"
+        )
+
+    asyncio.run(run_with_lease())
+
+    async def elect():
+        asyncio.get_event_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        async with lease.elect_leader(
+            directory, "poller", ttl=0.3, owner="a"
+        ) as a, lease.elect_leader(directory, "poller", ttl=0.3, owner="b") as b:
+            await asyncio.wait_for(a.elected.wait(), 1)
+            assert not b.is_leader
+
+            # the leader cannot renew its lease, steps down and the other takes over
+            unreachable.add("a")
+            await asyncio.wait_for(b.elected.wait(), 2)
+            assert not a.is_leader
+
+    asyncio.run(elect())
+    assert errors == []
+
+
+@pytest.mark.parametrize(
+    "title, published, topics",
+    [
+        # matches every rule
+        ("Sunday Sermon", "2 hours ago", ["discord", "podbean", "wordpress"]),
+        # the title pattern does not match
+        ("Choir Rehearsal", "2 hours ago", ["discord", "wordpress"]),
+        # the negative title pattern matches
+        ("Youth Sermon", "2 hours ago", ["discord", "wordpress"]),
+        # older than the WordPress maximum age
+        ("Sunday Sermon", "3 days ago", ["discord", "podbean"]),
+        # only the route without rules is left
+        ("Youth Night", "3 days ago", ["discord"]),
+    ],
+)
+def test_route_video(service_directory, title, published, topics):
+    from datetime import datetime, timedelta
+    from types import SimpleNamespace
+
+    require_hbmqtt()
+    pytest.importorskip("pafy")
+    from app.services.youtube import route_video
+    from app.util.eligibility import compile_rules
+
+    age = timedelta(hours=2) if published == "2 hours ago" else timedelta(days=3)
+    video = SimpleNamespace(title=title, published=str(datetime.now() - age))
+    rules = dict(
+        discord=compile_rules(),
+        podbean=compile_rules(title_pattern="sermon", title_negative_pattern="youth"),
+        wordpress=compile_rules(max_age=24 * 60 * 60),
+        disabled=compile_rules(False),
+    )
+    assert route_video(video, rules) == topics
+    # compiled once for the same settings
+    assert compile_rules(max_age=24 * 60 * 60) is rules["wordpress"]
+
+
+def test_stalled_stage_times_out():
+    import asyncio
+
+    from app.util.stages import (
+        StageTimeout,
+        get_stage_metrics,
+        report_progress,
+        run_stage,
+        stage_counts,
+    )
+
+    finished = []
+
+    async def stalls():
+        report_progress(100, 1000, "B")
+        await asyncio.sleep(0.1)
+        # then hangs, e.g. on a dead connection
+        report_progress(200, 1000, "B")
+        try:
+            await asyncio.sleep(10)
+        finally:
+            finished.append("cancelled")
+
+    async def silent():
+        # stages that never report their progress cannot stall
+        await asyncio.sleep(0.5)
+        return "done"
+
+    async def run():
+        with pytest.raises(StageTimeout, match="made no progress"):
+            await run_stage("download", "Sermon", stalls, stall_timeout=0.3)
+        assert finished == ["cancelled"]
+        assert get_stage_metrics()["running"] == []
+        assert await run_stage("upload", "Sermon", silent, stall_timeout=0.2) == "done"
+
+    stage_counts.clear()
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert stage_counts["download"] == {"stalled": 1}
+    assert stage_counts["upload"] == {"completed": 1}
+
+
+def test_oauth_callback_resolves_the_code(service_directory):
+    import asyncio
+    import socket
+
+    require_hbmqtt()
+    aiohttp = pytest.importorskip("aiohttp")
+    from app.services.podbean import get_oauth_code
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/"
+
+    async def authorize():
+        code = asyncio.ensure_future(get_oauth_code("127.0.0.1", str(port)))
+        async with aiohttp.ClientSession() as session:
+            for _ in range(50):
+                try:
+                    # e.g. the user denied access
+                    async with session.get(url, params=dict(error="denied")) as r:
+                        assert await r.text() == "Failed to authorize!"
+                    break
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.1)
+            assert not code.done()
+
+            async with session.get(url, params=dict(code="abc")) as response:
+                assert await response.text() == "Successfully authorized!"
+            result = await asyncio.wait_for(code, 5)
+
+            # the callback is only served while waiting for the code
+            with pytest.raises(aiohttp.ClientConnectionError):
+                async with session.get(url, params=dict(code="def")):
+                    pass
+        return result
+
+    assert asyncio.run(authorize()) == "abc"